@@ -7,19 +7,35 @@ Copyright (C) 2025 - 2026 - PsychedelicPalimpsest
 """
 
 import argparse
+import atexit
+import gzip
+import io
+import itertools
 import json
 import os
 import platform
+import queue
 import shutil
 import subprocess
 import sys
 import shlex
+import struct
+import tarfile
 import tempfile
+import threading
+import time
+import urllib.parse
 import xml.etree.ElementTree as ET
+import zipfile
+import zlib
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager, nullcontext, redirect_stdout
+from datetime import datetime
 from hashlib import sha1
 from os.path import dirname, exists, join, basename, abspath
-from typing import cast, Optional, Dict, List
-import urllib3
+from functools import partial
+from typing import cast, Callable, NamedTuple, Optional, Dict, List, Tuple
 
 # --- CONSTANTS ---
 
@@ -35,8 +51,161 @@ YARN_LEGACY_BASE = "https://repo.legacyfabric.net/legacyfabric/net/legacyfabric/
 
 MAPPINGIO_URL = "https://raw.githubusercontent.com/GrylaMC/gryla_utils/main/deps/mapping-io-cli-0.3.0-all.jar"
 
-# Initialize HTTP Pool
-http = urllib3.PoolManager()
+SPIGOT_BUILD_DATA_GIT = "https://hub.spigotmc.org/stash/scm/spigot/builddata.git"
+
+# Pinned sha1 of the tool jars, checked when they are fetched and by
+# `scrub_cache`. SpecialSource follows BuildData's master branch, so it
+# cannot be pinned. Tools without a pinned hash are held to the one
+# recorded when they were first fetched.
+TOOL_SHA1S: Dict[str, str] = {
+    # deps/mapping-io-cli-0.3.0-all.jar
+    MAPPINGIO_URL: "a71624df600aaeef4dad3110eb741e2eaca8d77b",
+}
+# Checksum files published by the repository of a tool jar, for the tools
+# pinned there rather than in TOOL_SHA1S, see `tool_sha1`. The CFR site
+# publishes none.
+TOOL_SHA1_URLS: Dict[str, str] = {
+    REMAPPER_URL: REMAPPER_URL + ".sha1",
+}
+
+# Number of artifacts processed at once by a batch `get`/`remap`
+DEFAULT_JOBS = min(32, (os.cpu_count() or 1) + 4)
+
+# JVM tools run at once, whatever the number of jobs. Each takes a core and
+# a default heap of a quarter of the RAM, so fewer fit than downloads do.
+TOOL_JOBS = int(os.environ.get("GRYLA_TOOL_JOBS", max(1, (os.cpu_count() or 1) // 2)))
+_tool_slots = threading.BoundedSemaphore(TOOL_JOBS)
+
+# HTTP Pool shared by every worker thread, see `get_http`
+_http = None
+_http_lock = threading.Lock()
+
+# Attempts made by `download_file` after the first one fails, and the
+# delay before the first retry, in seconds (doubled after each attempt)
+DOWNLOAD_RETRIES = 4
+DOWNLOAD_BACKOFF = 1.0
+
+# Concurrent byte ranges used to fetch a large file, and the smallest range
+# worth its own connection. 1 downloads everything over a single stream.
+DOWNLOAD_SEGMENTS = 1
+SEGMENT_MIN_SIZE = 1 << 20
+
+# Seconds before version manifests and other listings that change upstream
+# are revalidated. REFRESH_MANIFESTS revalidates them on their next use.
+MANIFEST_TTL = float(os.environ.get("GRYLA_MANIFEST_TTL", 60 * 60))
+REFRESH_MANIFESTS = False
+# When this process last tried to revalidate each entry, successfully or not
+_revalidated_at: Dict[str, float] = {}
+
+# Whether downloads report progress by default, see `PROGRESS_SINKS`
+SHOW_PROGRESS = True
+
+# Minimum seconds between two progress events of the same transfer
+PROGRESS_INTERVAL = 0.2
+
+
+def parse_mirrors(spec: str) -> Dict[str, str]:
+    """ Parses 'UPSTREAM=MIRROR' pairs, separated by ';' or whitespace """
+    mirrors = {}
+    for pair in spec.replace(";", " ").split():
+        upstream, sep, mirror = pair.partition("=")
+        if not sep:
+            raise ValueError(f"Invalid mirror '{pair}', expected UPSTREAM=MIRROR")
+        mirrors[upstream] = mirror
+    return mirrors
+
+
+def parse_host_limits(spec: str) -> Dict[str, int]:
+    """ Parses 'HOST=N' pairs, separated by ';' or whitespace """
+    return {host: int(limit) for host, limit in parse_mirrors(spec).items()}
+
+
+def parse_size(value: str) -> float:
+    """ Parses a byte count with an optional K/M/G/T (binary) suffix """
+    units = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30, "T": 1 << 40}
+    number = value.strip().upper().rstrip("B")
+    if number and number[-1] in units:
+        return float(number[:-1]) * units[number[-1]]
+    return float(number)
+
+
+# Concurrent connections allowed to each host, shared by every job and
+# download segment. Hosts not listed get DEFAULT_HOST_LIMIT.
+HOST_LIMITS: Dict[str, int] = {
+    "piston-meta.mojang.com": 8,
+    "piston-data.mojang.com": 8,
+    "maven.fabricmc.net": 4,
+    "repo.legacyfabric.net": 2,
+    "hub.spigotmc.org": 2,
+    "meta.omniarchive.uk": 2,
+}
+HOST_LIMITS.update(parse_host_limits(os.environ.get("GRYLA_HOST_LIMITS", "")))
+DEFAULT_HOST_LIMIT = 4
+
+# Global download budget in bytes per second, None for unlimited
+MAX_RATE: Optional[float] = None
+
+# Size budget of the cache in bytes, None for unbounded. Enforced by
+# `gc_cache`, which also runs every GC_INTERVAL seconds as entries are
+# added. Pinned entries and the Spigot BuildData clone do not count
+# against it, library and asset objects and the class store do.
+CACHE_BUDGET: Optional[float] = (
+    parse_size(os.environ["GRYLA_CACHE_SIZE"]) if os.environ.get("GRYLA_CACHE_SIZE") else None
+)
+GC_INTERVAL = 60.0
+# Entries used this recently are never evicted, as they may be in use
+GC_GRACE = 5 * 60.0
+# With GRYLA_JAR_STORE=1, gc moves jars into the class store instead of
+# deleting them, see `dehydrate_entry`
+JAR_STORE = os.environ.get("GRYLA_JAR_STORE", "0") not in ("", "0")
+
+
+# In offline mode, anything missing from the cache fails right away, unless
+# it can be read from a file:// mirror
+OFFLINE = os.environ.get("GRYLA_OFFLINE", "") not in ("", "0")
+
+# URL prefix rewrites, from an upstream base to a mirror base that is either
+# a file:// path or a local HTTP server, e.g.
+#   GRYLA_MIRRORS="https://piston-data.mojang.com/=file:///srv/mirror/piston-data/"
+MIRRORS: Dict[str, str] = parse_mirrors(os.environ.get("GRYLA_MIRRORS", ""))
+
+# Fallback for URLs no mirror prefix matches: fetch https://host/path from
+# MIRROR_ROOT/host/path, the layout `mcjar serve` exposes
+MIRROR_ROOT: Optional[str] = os.environ.get("GRYLA_MIRROR_ROOT") or None
+
+# Interchangeable bases for each logical source, including the upstream
+# itself. Requests go to the fastest healthy one, see `source_candidates`.
+# GRYLA_SOURCE_MIRRORS="UPSTREAM=BASE,BASE;..." replaces a source's list.
+SOURCE_MIRRORS: Dict[str, List[str]] = {
+    "https://piston-meta.mojang.com/": ["https://piston-meta.mojang.com/", "https://launchermeta.mojang.com/"],
+    "https://maven.fabricmc.net/": ["https://maven.fabricmc.net/"],
+    "https://repo.legacyfabric.net/": ["https://repo.legacyfabric.net/"],
+    "https://meta.omniarchive.uk/": ["https://meta.omniarchive.uk/"],
+}
+SOURCE_MIRRORS.update(
+    {
+        upstream: bases.split(",")
+        for upstream, bases in parse_mirrors(os.environ.get("GRYLA_SOURCE_MIRRORS", "")).items()
+    }
+)
+
+# Seconds to wait for a response before sending the same request to the
+# next best mirror as well, 0 to disable
+HEDGE_DELAY = float(os.environ.get("GRYLA_HEDGE_DELAY", 2))
+
+# Text-like entries are stored gzip compressed, see `open_cached`
+COMPRESS_ENTRIES = os.environ.get("GRYLA_COMPRESS", "1") != "0"
+COMPRESSED_SUFFIXES = (".json", ".txt", ".tiny", ".xml", ".htm", ".html", ".mappings")
+COMPRESS_MIN_SIZE = 4096
+# Appended to the name of the entries mcjar compressed. Upstream files
+# ending in a plain .gz, like Yarn's -tiny.gz, are kept and served as is.
+COMPRESSED_EXT = ".mcjar.gz"
+
+# How results are put at their output path, see `deliver_file`
+LINK_MODES = ["auto", "copy", "reflink", "hardlink", "symlink"]
+LINK_MODE = os.environ.get("GRYLA_LINK_MODE", "auto")
+# ioctl cloning a whole file on Linux (btrfs, XFS, bcachefs...)
+FICLONE = 0x40049409
 
 # --- HELPER FUNCTIONS ---
 
@@ -61,25 +230,33 @@ def get_storage_dir() -> str:
     raise RuntimeError(f"Cannot determine cache directory on {os_name}")
 
 
+# Created on the first cache write, so that importing this module or
+# running commands that never touch the cache stays free of disk work
 STORAGE_DIR = get_storage_dir()
-os.makedirs(STORAGE_DIR, exist_ok=True)
+
+
+# The BuildData clone is a single working tree, so only one Spigot
+# version can have it checked out at a time, see `cache_lock`
+BUILD_DATA_LOCK = "SPIGOT BUILD DATA"
 
 
 def get_spigot_build_data_path() -> str:
     data_path = join(STORAGE_DIR, "spigot_build_data")
     inner_path = join(data_path, "BuildData")
 
-    if not exists(inner_path):
-        os.makedirs(data_path, exist_ok=True)
-        print("Cloning Spigot BuildData...", file=sys.stderr)
-        subprocess.check_call(
-            [
-                "git",
-                "clone",
-                "https://hub.spigotmc.org/stash/scm/spigot/builddata.git",
-                inner_path,
-            ]
-        )
+    with cache_lock(BUILD_DATA_LOCK):
+        if not exists(inner_path):
+            check_online(SPIGOT_BUILD_DATA_GIT)
+            os.makedirs(data_path, exist_ok=True)
+            print("Cloning Spigot BuildData...", file=sys.stderr)
+            subprocess.check_call(
+                [
+                    "git",
+                    "clone",
+                    rewrite_url(SPIGOT_BUILD_DATA_GIT),
+                    inner_path,
+                ]
+            )
     return inner_path
 
 
@@ -94,6 +271,59 @@ def set_build_data(commit: str):
     return data
 
 
+def get_build_data_file(commit: str, path: str) -> bytes:
+    """ Reads a file from a BuildData commit without checking it out """
+    return subprocess.check_output(
+        ["git", "show", f"{commit}:{path}"],
+        cwd=get_spigot_build_data_path(),
+        stderr=subprocess.DEVNULL,
+    )
+
+
+def _reflink(src: str, dst: str):
+    """ Makes dst a copy-on-write clone of src, sharing its blocks """
+    if not sys.platform.startswith("linux"):
+        raise OSError(f"reflinks are not supported on {platform.system()}")
+    import fcntl
+
+    with open(src, "rb") as s, open(dst, "wb") as d:
+        fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+
+
+def deliver_file(src: str, dst: str, mode: Optional[str] = None) -> str:
+    """
+    Puts the content of src at dst as a copy-on-write clone, hard link,
+    symbolic link or plain copy, following mode (default: LINK_MODE). auto
+    tries a clone, then a copy: hard links share the inode of the cache
+    blob, so they are only made when asked for. dst is replaced, never
+    written in place, as it may be a link into the cache itself. Returns
+    the mode used.
+    """
+    mode = mode or LINK_MODE
+    if mode not in LINK_MODES:
+        raise ValueError(f"Unknown link mode '{mode}'")
+    tries = ["reflink", "copy"] if mode == "auto" else [mode]
+    tmp = join(dirname(abspath(dst)), f".{basename(dst)}.tmp")
+    for how in tries:
+        try:
+            if how == "reflink":
+                _reflink(src, tmp)
+            elif how == "hardlink":
+                os.link(src, tmp)
+            elif how == "symlink":
+                os.symlink(abspath(src), tmp)
+            else:
+                shutil.copyfile(src, tmp)
+            os.replace(tmp, dst)
+            return how
+        except OSError:
+            if os.path.lexists(tmp):
+                os.remove(tmp)
+            if how == tries[-1]:
+                raise
+    return mode
+
+
 def sizeof_fmt(num, suffix="B"):
     for unit in ("", "Ki", "Mi", "Gi", "Ti", "Pi", "Ei", "Zi"):
         if abs(num) < 1024.0:
@@ -102,388 +332,2387 @@ def sizeof_fmt(num, suffix="B"):
     return f"{num:.1f}Yi{suffix}"
 
 
-def download_file(url: str, outpath: str, output=True):
-    try:
-        resp = http.request("GET", url, preload_content=False, decode_content=False)
-        if resp.status != 200:
-            raise ConnectionError(f"ERROR: cannot fetch {url} (Status: {resp.status})")
+def get_http():
+    """ Returns the shared urllib3 PoolManager, creating it on first use """
+    global _http
+    if _http is None:
+        with _http_lock:
+            if _http is None:
+                # Deferred, as importing urllib3 costs more than the rest of
+                # this module together
+                import urllib3
 
-        total_str = resp.headers.get("Content-Length")
-        total_fmt = sizeof_fmt(int(total_str)) if total_str else None
-        ending = ("/" + total_fmt) if total_fmt else " downloaded"
-        last_write = ""
-
-        if output:
-            sys.stdout.write(last_write := "0" + ending)
-
-        cnt = 0
-        with open(outpath, "wb") as f:
-            for chunk in resp.stream():
-                cnt += len(chunk)
-                if output:
-                    s = "\r" + sizeof_fmt(cnt) + ending
-                    # Clear trailing characters if new string is shorter
-                    if len(last_write) > len(s):
-                        s += " " * (len(last_write) - len(s))
-                    last_write = s.strip()
-                    sys.stdout.write(s)
-                f.write(chunk)
-
-        if output:
-            sys.stdout.write("\nDownload completed!\n")
-    except Exception as e:
-        if exists(outpath):
-            os.remove(outpath)
-        raise e
-    finally:
-        if 'resp' in locals():
-            resp.release_conn()
+                # Pools are per host, and the scheduler never lets more
+                # connections than a host's limit be in use at once
+                _http = urllib3.PoolManager(maxsize=max([DEFAULT_HOST_LIMIT, *HOST_LIMITS.values()]))
+    return _http
 
 
-def get_cached_file(cache_key: str) -> Optional[str]:
-    cache_dir = join(STORAGE_DIR, cache_key)
-    if exists(cache_dir):
-        listing = os.listdir(cache_dir)
-        if len(listing) == 0:
-            return None
-        return join(cache_dir, listing[0])
-    return None
+class DownloadScheduler:
+    """
+    Central gate for every HTTP request: caps concurrent connections per
+    host, shares them fairly between jobs (round robin between the jobs
+    waiting on a host), and optionally enforces a global bytes/sec budget.
+    """
 
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.local = threading.local()
+        # host -> active connection count, and job -> waiting tickets
+        self.active: Dict[str, int] = {}
+        self.waiting: Dict[str, "OrderedDict[str, deque]"] = {}
+        self.rate_lock = threading.Lock()
+        self.next_send = 0.0
+        self.started = time.monotonic()
+        self.bytes_total = 0
+        self.recent: deque = deque()
+
+    # --- jobs ---
+
+    def current_job(self) -> str:
+        return getattr(self.local, "job", "default")
+
+    @contextmanager
+    def job(self, name: str):
+        """ Attributes requests made by this thread to the job name """
+        previous = getattr(self.local, "job", None)
+        self.local.job = name
+        try:
+            yield
+        finally:
+            self.local.job = previous
+
+    def run_as(self, name: str, func: Callable, *args, **kwargs):
+        with self.job(name):
+            return func(*args, **kwargs)
+
+    # --- connection slots ---
+
+    def limit(self, host: str) -> int:
+        return HOST_LIMITS.get(host, DEFAULT_HOST_LIMIT)
+
+    def acquire(self, host: str):
+        job = self.current_job()
+        ticket = object()
+        with self.cond:
+            queues = self.waiting.setdefault(host, OrderedDict())
+            queues.setdefault(job, deque()).append(ticket)
+            while True:
+                head_job, head = next(iter(queues.items()))
+                if head[0] is ticket and self.active.get(host, 0) < self.limit(host):
+                    break
+                self.cond.wait()
+
+            head.popleft()
+            del queues[head_job]
+            if head:
+                # Back of the line, so other jobs waiting on this host go first
+                queues[head_job] = head
+            self.active[host] = self.active.get(host, 0) + 1
+
+    def release(self, host: str):
+        with self.cond:
+            self.active[host] -= 1
+            self.cond.notify_all()
+
+    @contextmanager
+    def slot(self, url: str):
+        host = urllib.parse.urlsplit(url).netloc
+        self.acquire(host)
+        try:
+            yield
+        finally:
+            self.release(host)
+
+    # --- bandwidth ---
+
+    def account(self, nbytes: int):
+        """ Records nbytes received, sleeping as needed to stay under MAX_RATE """
+        now = time.monotonic()
+        delay = 0.0
+        with self.rate_lock:
+            self.bytes_total += nbytes
+            self.recent.append((now, nbytes))
+            while self.recent and now - self.recent[0][0] > 5:
+                self.recent.popleft()
+            if MAX_RATE:
+                self.next_send = max(self.next_send, now) + nbytes / MAX_RATE
+                delay = self.next_send - now
+        # Allow a short burst before throttling kicks in
+        if delay > 0.25:
+            time.sleep(delay)
+
+    # --- stats ---
+
+    def snapshot(self) -> dict:
+        """ Queue depth, active connections and throughput, to tune the limits """
+        now = time.monotonic()
+        with self.cond:
+            hosts = {
+                host: {
+                    "active": self.active.get(host, 0),
+                    "queued": sum(len(q) for q in self.waiting.get(host, {}).values()),
+                    "limit": self.limit(host),
+                }
+                for host in set(self.active) | set(self.waiting)
+            }
+        with self.rate_lock:
+            recent = sum(n for t, n in self.recent if now - t <= 5)
+            total = self.bytes_total
+        elapsed = max(now - self.started, 1e-9)
+        return {
+            "queued": sum(h["queued"] for h in hosts.values()),
+            "active": sum(h["active"] for h in hosts.values()),
+            "bytes": total,
+            "rate": recent / min(5.0, elapsed),
+            "average_rate": total / elapsed,
+            "hosts": hosts,
+        }
+
+
+SCHEDULER = DownloadScheduler()
+
+
+class _ScheduledResponse:
+    """ A streamed response holding a scheduler slot until its connection is released """
+
+    def __init__(self, resp, host: str):
+        self._resp = resp
+        self._host = host
+        self._released = False
+
+    def __getattr__(self, name):
+        return getattr(self._resp, name)
+
+    def stream(self, amt: int = 1 << 16):
+        for chunk in self._resp.stream(amt):
+            SCHEDULER.account(len(chunk))
+            yield chunk
+
+    def release_conn(self):
+        self._resp.release_conn()
+        if not self._released:
+            self._released = True
+            SCHEDULER.release(self._host)
+
+
+def http_request(method: str, url: str, started: Optional[threading.Event] = None, **kwargs):
+    """
+    `PoolManager.request` through the scheduler. Streamed responses
+    (preload_content=False) keep their host slot until release_conn().
+    started is set once the request has its slot and goes out.
+    """
+    host = urllib.parse.urlsplit(url).netloc
+    SCHEDULER.acquire(host)
+    if started is not None:
+        started.set()
+    start = time.monotonic()
+    try:
+        resp = get_http().request(method, url, **kwargs)
+    except BaseException:
+        MIRROR_HEALTH.record(host, time.monotonic() - start, False)
+        SCHEDULER.release(host)
+        raise
+    MIRROR_HEALTH.record(host, time.monotonic() - start, resp.status < 500 and resp.status != 429)
 
-def make_cache_file(cache_key: str, name: str) -> str:
-    cache_dir = join(STORAGE_DIR, cache_key)
+    if kwargs.get("preload_content", True):
+        SCHEDULER.account(len(resp.data or b""))
+        SCHEDULER.release(host)
+        return resp
+    return _ScheduledResponse(resp, host)
 
-    if exists(cache_dir) and len(os.listdir(cache_dir)) > 0:
-        # Should ideally check if specific file exists, but logic follows original
-        pass
 
-    if not exists(cache_dir):
-        os.mkdir(cache_dir)
+class DownloadError(ConnectionError):
+    def __init__(self, message: str, retryable: bool = True):
+        super().__init__(message)
+        self.retryable = retryable
 
-    return join(cache_dir, name)
 
+class MissingArtifactError(RuntimeError):
+    """ Raised for anything that would need the network in offline mode """
 
-def download_cached(url: str, file_name: str) -> str:
-    cache_key = sha1(url.encode("utf-8")).hexdigest()
+    def __init__(self, url: str, reason: str = "it is not cached and mcjar is offline"):
+        super().__init__(f"Missing artifact: {url} ({reason})")
+        self.url = url
 
-    if path := get_cached_file(cache_key):
-        return path
-    path = make_cache_file(cache_key, file_name)
 
-    print(f"Downloading: {file_name}")
-    download_file(url, path)
-    return path
+class MirrorHealth:
+    """
+    Rolling response latency (time to headers) and error rate per host,
+    used to rank interchangeable mirrors.
+    """
 
+    WINDOW = 20
+    # A mostly failing host is skipped for this long, then tried again
+    COOLDOWN = 60.0
 
-# Initialize tools
-CRF = download_cached(CFR_URL, "cfr.jar")
-REMAPPER = download_cached(REMAPPER_URL, "remapper.jar")
-VERSION_MANIFEST = download_cached(VERSION_MANIFEST_URL, "version_manifest.json")
-OMNI_VERSION_MANIFEST = download_cached(
-    OMNI_VERSION_MANIFEST_URL, "omni_version_manifest.json"
-)
-SPECIAL_SOURCE2 = download_cached(SPECIAL_SOURCE2_URL, "SpecialSource-2.jar")
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latency: Dict[str, float] = {}
+        self.outcomes: Dict[str, deque] = {}
+        self.failed_at: Dict[str, float] = {}
 
-MAPPINGIO = download_cached(MAPPINGIO_URL, "mapping-io-cli.jar")
+    def record(self, host: str, elapsed: float, ok: bool):
+        with self.lock:
+            if ok:
+                self._add_latency(host, elapsed)
+            else:
+                self.failed_at[host] = time.monotonic()
+            self.outcomes.setdefault(host, deque(maxlen=self.WINDOW)).append(ok)
 
+    def _add_latency(self, host: str, elapsed: float):
+        previous = self.latency.get(host)
+        self.latency[host] = elapsed if previous is None else 0.7 * previous + 0.3 * elapsed
 
-def _get_yarn_versions(url: str) -> List[str]:
-    cache_key = sha1(url.encode("utf-8")).hexdigest()
+    def record_slow(self, host: str, elapsed: float):
+        """ Counts a request still running after elapsed as at least that slow """
+        with self.lock:
+            self._add_latency(host, max(elapsed, self.latency.get(host, 0.0)))
 
-    if path := get_cached_file(cache_key):
-        with open(path, 'r') as f:
-            return json.load(f)
+    def error_rate(self, host: str) -> float:
+        outcomes = self.outcomes.get(host)
+        return outcomes.count(False) / len(outcomes) if outcomes else 0.0
 
-    resp = http.request("GET", url)
-    root = ET.fromstring(resp.data)
-    # Metadata XML structure: metadata -> versioning -> versions
-    versions_element = root.find("./versioning/versions")
-    if versions_element is None:
-        raise ValueError("Invalid Maven metadata XML")
-    
-    ret = [v.text for v in versions_element]
+    def healthy(self, host: str) -> bool:
+        return self.error_rate(host) < 0.5 or time.monotonic() - self.failed_at.get(host, 0) > self.COOLDOWN
 
-    with open(make_cache_file(cache_key, "maven-metadata.xml"), "w") as f:
-        json.dump(ret, f)
+    def rank(self, urls: List[str]) -> List[str]:
+        """ Healthy hosts first, fastest first. Unmeasured hosts get tried early to measure them. """
+        def score(url: str):
+            host = urllib.parse.urlsplit(url).netloc
+            return not self.healthy(host), self.latency.get(host, 0.0)
 
-    return cast(List[str], ret)
+        with self.lock:
+            return sorted(urls, key=score)
 
+    def snapshot(self) -> Dict[str, dict]:
+        with self.lock:
+            return {
+                host: {"latency": self.latency.get(host), "error_rate": self.error_rate(host)}
+                for host in set(self.outcomes) | set(self.latency)
+            }
 
-def get_modern_yarn_versions() -> List[str]:
-    return _get_yarn_versions(YARN_FABRIC_BASE + "maven-metadata.xml")
 
+MIRROR_HEALTH = MirrorHealth()
 
-def get_legacy_yarn_versions() -> List[str]:
-    return _get_yarn_versions(YARN_LEGACY_BASE + "maven-metadata.xml")
 
+def hedged_request(method: str, urls: List[str], **kwargs) -> Tuple[str, object]:
+    """
+    `http_request` to urls[0], also sent to urls[1] if it fails or has not
+    answered HEDGE_DELAY after it went out. Time spent waiting for a slot
+    in our own scheduler does not count, as it says nothing of the mirror.
+    Returns the first usable (url, response), the other one is closed once
+    it arrives.
+    """
+    if len(urls) < 2 or HEDGE_DELAY <= 0:
+        return urls[0], http_request(method, urls[0], **kwargs)
+
+    results: queue.Queue = queue.Queue()
+    job = SCHEDULER.current_job()
+    started = threading.Event()
+
+    def send(url: str, started: Optional[threading.Event] = None):
+        try:
+            results.put((url, SCHEDULER.run_as(job, http_request, method, url, started, **kwargs), None))
+        except BaseException as ex:
+            results.put((url, None, ex))
+        finally:
+            if started is not None:
+                started.set()
+
+    def discard(count: int):
+        for _ in range(count):
+            _, resp, _ = results.get()
+            if resp is not None:
+                resp.close()
+                resp.release_conn()
+
+    threading.Thread(target=send, args=(urls[0], started), daemon=True).start()
+    pending, hedged = 1, False
+    fallback = None
+    while pending:
+        if not hedged:
+            # The hedge clock starts once the request left our host queue
+            started.wait()
+        try:
+            url, resp, ex = results.get(timeout=None if hedged else HEDGE_DELAY)
+        except queue.Empty:
+            url, resp, ex = None, None, None
+        else:
+            pending -= 1
+            if resp is not None and resp.status < 500:
+                if pending:
+                    threading.Thread(target=discard, args=(pending,), daemon=True).start()
+                if fallback is not None and fallback[1] is not None:
+                    fallback[1].release_conn()
+                return url, resp
+            if fallback is not None and fallback[1] is not None:
+                fallback[1].release_conn()
+            fallback = (url, resp, ex)
+
+        if not hedged:
+            # Slow or failed: race the next best mirror
+            if ex is None and resp is None:
+                MIRROR_HEALTH.record_slow(urllib.parse.urlsplit(urls[0]).netloc, HEDGE_DELAY)
+            hedged = True
+            pending += 1
+            threading.Thread(target=send, args=(urls[1],), daemon=True).start()
+
+    url, resp, ex = fallback
+    if ex is not None:
+        raise ex
+    return url, resp
+
+
+def source_candidates(url: str) -> List[str]:
+    """
+    Where url can be fetched from, best first: its MIRRORS/MIRROR_ROOT
+    rewrite if it has one, else its SOURCE_MIRRORS ranked by MIRROR_HEALTH.
+    """
+    rewritten = rewrite_url(url)
+    if rewritten != url:
+        return [rewritten]
+    for upstream, bases in SOURCE_MIRRORS.items():
+        if url.startswith(upstream):
+            return MIRROR_HEALTH.rank([base + url[len(upstream):] for base in bases])
+    return [url]
 
-def get_piston_json_path(version_id: str):
-    cache_key = sha1(f"PISTON MANIFEST: '{version_id}'".encode("utf-8")).hexdigest()
-    if path := get_cached_file(cache_key):
-        return path
 
-    is_omni = False
-    if version_id.startswith("@omni@"):
-        is_omni = True
-        version_id = version_id[len("@omni@") :]
+def rewrite_url(url: str) -> str:
+    """ Maps an upstream URL to where it should actually be fetched from """
+    matches = [prefix for prefix in MIRRORS if url.startswith(prefix)]
+    if matches:
+        prefix = max(matches, key=len)
+        return MIRRORS[prefix] + url[len(prefix):]
 
-    manifest_path = OMNI_VERSION_MANIFEST if is_omni else VERSION_MANIFEST
-    with open(manifest_path, 'r') as f:
-        versions = json.load(f)["versions"]
+    if MIRROR_ROOT:
+        parsed = urllib.parse.urlsplit(url)
+        if parsed.scheme in ("http", "https"):
+            rest = parsed.path + (f"?{parsed.query}" if parsed.query else "")
+            return MIRROR_ROOT.rstrip("/") + "/" + parsed.netloc + rest
+    return url
 
-    version = next((v for v in versions if v["id"] == version_id), None)
-    if version is None:
-        raise IndexError("Unable to find version: " + version_id)
 
-    resp = http.request("GET", version["url"])
-    if resp.status != 200:
-        raise ConnectionError("Piston server error")
+def is_local_url(url: str) -> bool:
+    return url.startswith("file:")
 
-    path = make_cache_file(cache_key, "client.json")
-    with open(path, "wb") as f:
-        f.write(resp.data)
 
-    return path
+def local_url_path(url: str) -> str:
+    # urllib.request pulls in http.client and email, a third of the import time
+    from urllib.request import url2pathname
 
+    return url2pathname(urllib.parse.urlsplit(url).path)
 
-def get_piston_file(version_id: str, target: str) -> str:
-    cache_key = sha1(f"PISTON: '{version_id}' : {target}".encode("utf-8")).hexdigest()
-    if path := get_cached_file(cache_key):
-        return path
 
-    with open(get_piston_json_path(version_id)) as f:
-        downloads = json.load(f)["downloads"]
+def check_online(url: str):
+    """ Fails with MissingArtifactError if fetching url needs the network while offline """
+    if OFFLINE and not is_local_url(rewrite_url(url)):
+        raise MissingArtifactError(url)
 
-    if target.startswith("@omni@"):
-        target = target[len("@omni@") :]
-        
-    if target not in downloads:
-        raise IndexError(f"Unable to find '{target}' in {', '.join(downloads.keys())}")
-    
-    url = downloads[target]["url"]
-    path = make_cache_file(cache_key, url.split("/")[-1])
-    download_file(url, path)
-    return path
 
+def _transfer_errors() -> tuple:
+    """ Exceptions a download attempt can fail with """
+    from urllib3.exceptions import HTTPError
 
-def _yarn_search(versions: List[str], version_id: str) -> List[str]:
-    return sorted(
-        [v for v in versions if v.startswith(version_id + "+build")],
-        key=lambda x: x.split(".")[-1].zfill(3),
-    )
+    return (DownloadError, HTTPError, OSError)
 
 
-def get_most_recent_yarn_url(version_id: str) -> Optional[str]:
-    modern = _yarn_search(get_modern_yarn_versions(), version_id)
-    if len(modern):
-        ver = modern[-1]
-        return f"{YARN_FABRIC_BASE}{ver}/yarn-{ver}-tiny.gz"
+def _part_paths(outpath: str) -> Tuple[str, str]:
+    """
+    Sidecar files of an in-progress download: the partial body, and the
+    validator it was fetched against. Hidden, so cache lookups skip them.
+    """
+    folder, name = dirname(outpath), basename(outpath)
+    return join(folder, f".{name}.part"), join(folder, f".{name}.part.json")
 
-    legacy = _yarn_search(get_legacy_yarn_versions(), version_id)
-    if len(legacy):
-        ver = legacy[-1]
-        return f"{YARN_LEGACY_BASE}{ver}/yarn-{ver}-tiny.gz"
-    return None
 
+def _read_json_or_empty(path: str) -> dict:
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
 
-def get_most_recent_yarn(version_id: str) -> Optional[str]:
-    key = sha1(f"YARN MAPPING: {version_id}".encode("utf-8")).hexdigest()
 
-    if path := get_cached_file(key):
-        return path
-    url = get_most_recent_yarn_url(version_id)
-    if url is None:
-        return None
+def _strong_validator(headers) -> Optional[str]:
+    etag = headers.get("ETag")
+    # Weak validators cannot be used with If-Range
+    return etag if etag and not etag.startswith("W/") else headers.get("Last-Modified")
 
-    path = make_cache_file(key, url.split("/")[-1])
-    download_file(url, path)
-    return path
 
+class ProgressEvent(NamedTuple):
+    """ State of one transfer, sent to every sink in PROGRESS_SINKS """
+    kind: str  # "start", "progress", "done" or "failed"
+    id: int
+    name: str
+    url: str
+    bytes: int
+    total: Optional[int]
+    elapsed: float
+    rate: float  # bytes/sec over this transfer, resumed bytes excluded
+    eta: Optional[float]
 
-def get_mojang_txt(version_id: str, target: str) -> str:
-    return get_piston_file(version_id, target + "_mappings")
 
+class TerminalProgress:
+    """
+    Default progress sink. On a terminal, every in-flight transfer is shown
+    on one status line, redrawn at most every interval seconds. Finished
+    transfers get a line of their own.
+    """
 
-def get_mojang_tiny(version_id: str, target: str) -> str:
-    key = sha1(f"MOJANG TINY: '{version_id}' : '{target}'".encode("utf-8")).hexdigest()
+    def __init__(self, stream=None, interval: float = 0.2):
+        self.stream = stream
+        self.interval = interval
+        self.active: Dict[int, ProgressEvent] = {}
+        self.drawn = 0
+        self.last_draw = 0.0
+        self.lock = threading.Lock()
+
+    def __call__(self, event: ProgressEvent):
+        stream = self.stream or sys.stderr
+        tty = stream.isatty()
+        with self.lock:
+            if event.kind in ("start", "progress"):
+                self.active[event.id] = event
+                if not tty or time.monotonic() - self.last_draw < self.interval:
+                    return
+            else:
+                self.active.pop(event.id, None)
+                if tty:
+                    self._clear(stream)
+                size = sizeof_fmt(event.bytes)
+                if event.kind == "done":
+                    stream.write(f"Downloaded {event.name} ({size} in {event.elapsed:.1f}s)\n")
+                else:
+                    stream.write(f"Stopped {event.name} after {size}\n")
+                if not tty:
+                    stream.flush()
+                    return
+            self._draw(stream)
+
+    def _clear(self, stream):
+        if self.drawn:
+            stream.write("\r" + " " * self.drawn + "\r")
+            self.drawn = 0
+
+    def _draw(self, stream):
+        self.last_draw = time.monotonic()
+        parts = []
+        for ev in self.active.values():
+            done = f"{ev.bytes * 100 // ev.total}%" if ev.total else sizeof_fmt(ev.bytes)
+            eta = f" {ev.eta:.0f}s" if ev.eta is not None else ""
+            parts.append(f"{ev.name} {done}{eta}")
+        rate = sum(ev.rate for ev in self.active.values())
+        line = f"[{len(parts)}] {sizeof_fmt(rate)}/s  " + " | ".join(parts) if parts else ""
+        line = line[: shutil.get_terminal_size().columns - 1]
+        stream.write("\r" + line + " " * max(0, self.drawn - len(line)))
+        self.drawn = len(line)
+        stream.flush()
+
+
+class JsonProgress:
+    """ Progress sink writing events as JSON lines, at most one progress event per transfer per interval """
+
+    def __init__(self, stream=None, interval: float = 1.0):
+        self.stream = stream
+        self.interval = interval
+        self.last: Dict[int, float] = {}
+        self.lock = threading.Lock()
+
+    def __call__(self, event: ProgressEvent):
+        with self.lock:
+            if event.kind == "progress":
+                if event.elapsed - self.last.get(event.id, -self.interval) < self.interval:
+                    return
+                self.last[event.id] = event.elapsed
+            elif event.kind != "start":
+                self.last.pop(event.id, None)
+            stream = self.stream or sys.stderr
+            stream.write(json.dumps(event._asdict()) + "\n")
+            stream.flush()
+
+
+# Callables receiving a ProgressEvent for every start/end of a download,
+# and for its progress every PROGRESS_INTERVAL seconds
+PROGRESS_SINKS: List[Callable[[ProgressEvent], None]] = [TerminalProgress()]
+
+
+def add_progress_sink(sink: Callable[[ProgressEvent], None]):
+    PROGRESS_SINKS.append(sink)
+
+
+def remove_progress_sink(sink: Callable[[ProgressEvent], None]):
+    if sink in PROGRESS_SINKS:
+        PROGRESS_SINKS.remove(sink)
+
+
+_transfer_ids = itertools.count(1)
+
+
+class _Progress:
+    """
+    Thread safe byte counter of one transfer, reporting it to the progress
+    sinks. Use as a context manager, which reports the end of the transfer.
+    """
 
-    if path := get_cached_file(key):
-        return path
-    
-    path = make_cache_file(key, f"{version_id}-{target}.tiny")
-    mojmap = get_mojang_txt(version_id, target)
+    def __init__(self, name: str, url: str, total: Optional[int], initial: int = 0, output: bool = True):
+        self.id = next(_transfer_ids)
+        self.name = name
+        self.url = url
+        self.total = total
+        self.initial = initial
+        self.count = initial
+        self.output = output and bool(PROGRESS_SINKS)
+        self.started = time.monotonic()
+        self.last_emit = 0.0
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        self._emit("start")
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._emit("failed" if exc_type else "done")
+
+    def update(self, n: int):
+        with self.lock:
+            self.count += n
+            if not self.output:
+                return
+            now = time.monotonic()
+            # Events are throttled, as sinks format and print them
+            if now - self.last_emit < PROGRESS_INTERVAL:
+                return
+            self.last_emit = now
+        self._emit("progress")
+
+    def _emit(self, kind: str):
+        if not self.output:
+            return
+        elapsed = time.monotonic() - self.started
+        count = self.count
+        rate = (count - self.initial) / elapsed if elapsed > 0 else 0.0
+        eta = (self.total - count) / rate if self.total and rate else None
+        event = ProgressEvent(kind, self.id, self.name, self.url, count, self.total, elapsed, rate, eta)
+        for sink in list(PROGRESS_SINKS):
+            sink(event)
+
+
+def _transfer_name(part: str) -> str:
+    """ Name of the file a `.part` sidecar is downloading """
+    name = basename(part)[1 : -len(".part")]
+    return name[len(".tmp-"):] if name.startswith(".tmp-") else name
+
+
+def file_sha1(path: str) -> str:
+    digest = sha1()
+    with open(path, "rb") as f:
+        while chunk := f.read(1 << 20):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def content_sha1(path: str) -> str:
+    """ sha1 of what `open_cached` reads from path """
+    if not path.endswith(COMPRESSED_EXT):
+        return file_sha1(path)
+    digest = sha1()
+    with gzip.open(path, "rb") as f:
+        while chunk := f.read(1 << 20):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def open_cached(path: str, mode: str = "r"):
+    """
+    Opens a cache entry for reading, decompressing it on the fly when it is
+    stored compressed (as `<name>.mcjar.gz`).
+    """
+    if path.endswith(COMPRESSED_EXT):
+        return gzip.open(path, "rt" if mode == "r" else mode)
+    return open(path, mode)
 
-    # Convert TXT to Tiny V2
-    result = subprocess.run(
-        [
-            "java",
-            "-jar",
-            MAPPINGIO,
-            "convert",
-            mojmap,
-            path,
-            "TINY_2",
-        ],
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE
-    )
-
-    if result.returncode != 0:
-        print(result.stderr.decode(), file=sys.stderr)
-        sys.exit(1)
-    return path
 
+@contextmanager
+def materialized(path: str):
+    """
+    A plain file with the content of a cache entry, for external tools that
+    need a real path: the entry itself, or a temporary decompressed copy.
+    """
+    if not path.endswith(COMPRESSED_EXT):
+        yield path
+        return
+    with tempfile.TemporaryDirectory(prefix="mcjar-") as tmp_dir:
+        plain = join(tmp_dir, basename(path)[: -len(COMPRESSED_EXT)])
+        with gzip.open(path, "rb") as src, open(plain, "wb") as dst:
+            shutil.copyfileobj(src, dst, 1 << 20)
+        yield plain
+
+
+def _compress_file(src: str, dst: str):
+    """ Moves src to dst, gzip compressed """
+    part = join(dirname(dst), f".tmp-{basename(dst)}")
+    try:
+        with open(src, "rb") as f, open(part, "wb") as raw:
+            # No name or mtime in the header, so equal content compresses the same
+            with gzip.GzipFile(filename="", mode="wb", fileobj=raw, compresslevel=6, mtime=0) as out:
+                shutil.copyfileobj(f, out, 1 << 20)
+        os.replace(part, dst)
+    finally:
+        if exists(part):
+            os.remove(part)
+    os.remove(src)
+
+
+def _copy_local(path: str, part: str, output: bool) -> str:
+    """ Copies a file:// mirror entry into part, returning its sha1 """
+    digest = sha1()
+    with _Progress(_transfer_name(part), path, os.path.getsize(path), 0, output) as progress:
+        with open(path, "rb") as src, open(part, "wb") as dst:
+            while chunk := src.read(1 << 20):
+                progress.update(len(chunk))
+                digest.update(chunk)
+                dst.write(chunk)
+    return digest.hexdigest()
+
+
+def _download_attempt(
+    url: str,
+    part: str,
+    part_info: str,
+    output: bool,
+    conditional: Optional[dict] = None,
+    alternatives: Optional[List[str]] = None,
+) -> Optional[str]:
+    """
+    Downloads (or resumes) url into part, returning the sha1 of the whole
+    file, hashed as the chunks are written, or None if the server answered
+    the conditional headers with 304 Not Modified.
 
-def map_jar_with_tiny(
-    dst_jar_file_name: str,
-    src_jar: str,
-    mapping: str,
-    from_ns="official",
-    to_ns="named",
-    ignore_conflicts=False,
+    alternatives are mirrors of url the request is hedged to, see `hedged_request`.
+    """
+    info = _read_json_or_empty(part_info)
+
+    offset = 0
+    headers = dict(conditional or {})
+    resumable = info.get("url") == url and info.get("validator") and "segments" not in info
+    if exists(part) and resumable:
+        offset = os.path.getsize(part)
+        if offset:
+            headers["Range"] = f"bytes={offset}-"
+            # Only resume if the remote file is still the one we started on
+            headers["If-Range"] = info["validator"]
+
+    # A mirror's validator won't match If-Range, so it answers with the whole file
+    url, resp = hedged_request(
+        "GET", [url, *(alternatives or [])], headers=headers, preload_content=False, decode_content=False
+    )
+    digest = sha1()
+    try:
+        content_range = resp.headers.get("Content-Range", "")
+        if resp.status == 304 and conditional:
+            return None
+        if resp.status == 206 and content_range.startswith(f"bytes {offset}-"):
+            mode = "ab"
+            # Only the already downloaded prefix needs a read pass
+            with open(part, "rb") as f:
+                while chunk := f.read(1 << 20):
+                    digest.update(chunk)
+        elif resp.status == 200:
+            # Server ignored the range, or the file changed: start over
+            offset = 0
+            mode = "wb"
+            with open(part_info, "w") as f:
+                json.dump(
+                    {
+                        "url": url,
+                        "validator": _strong_validator(resp.headers),
+                        "etag": resp.headers.get("ETag"),
+                        "last_modified": resp.headers.get("Last-Modified"),
+                    },
+                    f,
+                )
+        elif resp.status in (206, 416):
+            os.remove(part)
+            raise DownloadError(f"ERROR: cannot resume {url}, restarting")
+        else:
+            raise DownloadError(
+                f"ERROR: cannot fetch {url} (Status: {resp.status})",
+                retryable=resp.status >= 500 or resp.status == 429,
+            )
+
+        total_str = resp.headers.get("Content-Length")
+        total = int(total_str) + offset if total_str else None
+        with _Progress(_transfer_name(part), url, total, offset, output) as progress:
+            with open(part, mode) as f:
+                for chunk in resp.stream():
+                    progress.update(len(chunk))
+                    digest.update(chunk)
+                    f.write(chunk)
+
+            if total is not None and progress.count != total:
+                raise DownloadError(f"ERROR: {url} ended after {progress.count} of {total} bytes")
+    finally:
+        resp.release_conn()
+    return digest.hexdigest()
+
+
+def _pwrite(fd: int, data: bytes, offset: int, lock: threading.Lock):
+    if hasattr(os, "pwrite"):
+        os.pwrite(fd, data, offset)
+        return
+    # No positional writes on Windows, emulate them with a shared seek
+    with lock:
+        os.lseek(fd, offset, os.SEEK_SET)
+        os.write(fd, data)
+
+
+def _fetch_segment(
+    url: str,
+    fd: int,
+    segment: List[int],
+    validator: str,
+    progress: _Progress,
+    stop: threading.Event,
+    changed: threading.Event,
+    seek_lock: threading.Lock,
 ):
-    key = sha1(
-        f"MAP_TINY: {(dst_jar_file_name, src_jar, mapping, from_ns, to_ns)}".encode(
-            "utf-8"
+    """
+    Downloads segment = [start, end, written] of url into fd, advancing
+    `written` as data lands so that an interrupted segment can resume.
+    """
+    for attempt in range(DOWNLOAD_RETRIES + 1):
+        pos = segment[0] + segment[2]
+        try:
+            resp = http_request(
+                "GET",
+                url,
+                headers={"Range": f"bytes={pos}-{segment[1] - 1}", "If-Range": validator},
+                preload_content=False,
+                decode_content=False,
+            )
+            try:
+                if resp.status == 200:
+                    changed.set()
+                    raise DownloadError(f"ERROR: {url} changed during download, restarting")
+                if resp.status != 206 or not resp.headers.get("Content-Range", "").startswith(f"bytes {pos}-"):
+                    raise DownloadError(
+                        f"ERROR: cannot fetch range of {url} (Status: {resp.status})",
+                        retryable=resp.status >= 500 or resp.status == 429,
+                    )
+                for chunk in resp.stream():
+                    if stop.is_set():
+                        return
+                    _pwrite(fd, chunk, segment[0] + segment[2], seek_lock)
+                    segment[2] += len(chunk)
+                    progress.update(len(chunk))
+            finally:
+                resp.release_conn()
+
+            if segment[0] + segment[2] != segment[1]:
+                raise DownloadError(f"ERROR: segment of {url} ended early")
+            return
+        except _transfer_errors() as e:
+            if attempt == DOWNLOAD_RETRIES or not getattr(e, "retryable", True) or stop.is_set() or changed.is_set():
+                raise e
+            time.sleep(DOWNLOAD_BACKOFF * 2 ** attempt)
+
+
+def _download_segmented(url: str, part: str, part_info: str, output: bool, segments: int) -> bool:
+    """
+    Downloads url as several byte ranges fetched concurrently, each written
+    in place into a preallocated `.part` file. Returns False, having done
+    nothing, when the server cannot serve ranges or the file is too small.
+    """
+    info = _read_json_or_empty(part_info)
+    if info.get("url") == url and "segments" not in info and exists(part):
+        # A single stream download is already underway, let it resume
+        return False
+
+    if info.get("url") == url and info.get("segments") and exists(part) and os.path.getsize(part) == info["size"]:
+        size, validator, ranges = info["size"], info["validator"], info["segments"]
+    else:
+        resp = http_request("HEAD", url)
+        size_str = resp.headers.get("Content-Length")
+        validator = _strong_validator(resp.headers)
+        if resp.status != 200 or resp.headers.get("Accept-Ranges") != "bytes" or not size_str or not validator:
+            return False
+
+        size = int(size_str)
+        count = min(segments, size // SEGMENT_MIN_SIZE)
+        if count < 2:
+            return False
+
+        step = -(-size // count)
+        ranges = [[start, min(start + step, size), 0] for start in range(0, size, step)]
+        with open(part, "wb") as f:
+            if hasattr(os, "posix_fallocate"):
+                os.posix_fallocate(f.fileno(), 0, size)
+            else:
+                f.truncate(size)
+
+    def save_state():
+        with open(part_info, "w") as f:
+            json.dump({"url": url, "validator": validator, "size": size, "segments": ranges}, f)
+
+    save_state()
+    progress = _Progress(_transfer_name(part), url, size, sum(r[2] for r in ranges), output)
+    stop, changed, seek_lock = threading.Event(), threading.Event(), threading.Lock()
+
+    fd = os.open(part, os.O_WRONLY | getattr(os, "O_BINARY", 0))
+    try:
+        with progress, ThreadPoolExecutor(max_workers=len(ranges)) as pool:
+            job = SCHEDULER.current_job()
+            futures = [
+                pool.submit(
+                    SCHEDULER.run_as, job, _fetch_segment, url, fd, seg, validator, progress, stop, changed, seek_lock
+                )
+                for seg in ranges
+                if seg[0] + seg[2] < seg[1]
+            ]
+            try:
+                for fut in as_completed(futures):
+                    fut.result()
+            except BaseException:
+                stop.set()
+                raise
+    except BaseException:
+        if changed.is_set():
+            os.remove(part_info)
+        else:
+            # Remember how far each segment got, so the next attempt resumes
+            save_state()
+        raise
+    finally:
+        os.close(fd)
+    return True
+
+
+def download_file(
+    url: str,
+    outpath: str,
+    output: Optional[bool] = None,
+    retries: int = DOWNLOAD_RETRIES,
+    segments: Optional[int] = None,
+    expected_sha1: Optional[str] = None,
+    expected_size: Optional[int] = None,
+    conditional: Optional[dict] = None,
+    mark: bool = True,
+) -> Optional[dict]:
+    """
+    Downloads url to outpath through a hidden `.part` sidecar, which is
+    only moved into place once complete. Failed attempts are retried with
+    exponential backoff, resuming with a Range request whenever the server
+    supports it, including across runs.
+
+    With segments > 1, large files served with `Accept-Ranges` are fetched
+    as that many concurrent byte ranges (default: DOWNLOAD_SEGMENTS).
+
+    When expected_sha1/expected_size are given, the file is checked against
+    them before being moved into place. The sha1 hashed while streaming is
+    recorded with `mark_verified`, so publishing the file does not read it
+    again, unless mark is False (for stores where the file name already is
+    its sha1).
+
+    conditional holds If-None-Match/If-Modified-Since headers for an
+    existing copy at outpath. Returns None when the server reports it as
+    unchanged, otherwise the new ETag/Last-Modified of the file.
+
+    url is fetched from its mirror when MIRRORS/MIRROR_ROOT has one, and
+    raises MissingArtifactError instead of using the network when OFFLINE.
+    Otherwise it goes to the best of its SOURCE_MIRRORS, failing over to
+    the next one on errors.
+    """
+    if output is None:
+        output = SHOW_PROGRESS
+    if segments is None:
+        segments = DOWNLOAD_SEGMENTS
+    part, part_info = _part_paths(outpath)
+
+    check_online(url)
+    source = rewrite_url(url)
+    if is_local_url(source) and not exists(local_url_path(source)):
+        raise MissingArtifactError(url, f"not found in mirror at {local_url_path(source)}")
+
+    for attempt in range(retries + 1):
+        source, *alternatives = source_candidates(url)
+        try:
+            if is_local_url(source):
+                digest = _copy_local(local_url_path(source), part, output)
+            elif not conditional and segments > 1 and _download_segmented(source, part, part_info, output, segments):
+                # Ranges land out of order, so they are hashed once complete
+                digest = file_sha1(part) if expected_sha1 else None
+            else:
+                digest = _download_attempt(source, part, part_info, output, conditional, alternatives)
+                if digest is None:
+                    for path in (part, part_info):
+                        if exists(path):
+                            os.remove(path)
+                    return None
+
+            size = os.path.getsize(part)
+            if expected_size is not None and size != expected_size:
+                os.remove(part)
+                raise DownloadError(f"ERROR: {url} is {size} bytes, expected {expected_size}")
+            if expected_sha1 is not None and digest != expected_sha1.lower():
+                os.remove(part)
+                raise DownloadError(f"ERROR: {url} has sha1 {digest}, expected {expected_sha1}")
+            break
+        except _transfer_errors() as e:
+            if attempt == retries or not getattr(e, "retryable", True):
+                # A partial body is kept for the next run to resume, unless
+                # the server refused the file or its content was wrong
+                if not getattr(e, "retryable", True) or not exists(part):
+                    for path in (part, part_info):
+                        if exists(path):
+                            os.remove(path)
+                raise e
+            if source_candidates(url)[0] != source:
+                print(f"Download of {source} failed ({e}), trying another mirror", file=sys.stderr)
+                continue
+            delay = DOWNLOAD_BACKOFF * 2 ** attempt
+            print(f"Download of {source} failed ({e}), retrying in {delay:.0f}s", file=sys.stderr)
+            time.sleep(delay)
+
+    info = _read_json_or_empty(part_info)
+    os.replace(part, outpath)
+    if exists(part_info):
+        os.remove(part_info)
+    if digest is not None and mark:
+        mark_verified(outpath, digest)
+    return {"etag": info.get("etag"), "last_modified": info.get("last_modified")}
+
+
+# Every cache entry is a STORAGE_DIR/<key>/<name> file, described by a row
+# of the SQLite index: where it came from, its size, hash, metadata,
+# creation and last access times, how long it took to produce and whether
+# gc must keep it.
+INDEX_SCHEMA = 6
+
+# Last access times are only written when older than this, in seconds
+ACCESS_RESOLUTION = 60.0
+
+_index_local = threading.local()
+_index_init_lock = threading.Lock()
+# Bumped when the cache is cleared, so threads reconnect to a new index
+_index_generation = 0
+
+
+def get_index_path() -> str:
+    return join(STORAGE_DIR, "index.sqlite")
+
+
+def _index():
+    """ This thread's connection to the cache index, created and migrated on first use """
+    conn = getattr(_index_local, "conn", None)
+    if conn is not None and _index_local.generation == _index_generation:
+        return conn
+
+    import sqlite3
+
+    os.makedirs(STORAGE_DIR, exist_ok=True)
+    # Autocommit, multi-statement changes use `index_transaction`
+    conn = sqlite3.connect(get_index_path(), timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    with _index_init_lock:
+        if conn.execute("PRAGMA user_version").fetchone()[0] < INDEX_SCHEMA:
+            _migrate_index(conn)
+    _index_local.conn = conn
+    _index_local.generation = _index_generation
+    return conn
+
+
+def _migrate_index(conn):
+    conn.execute("BEGIN IMMEDIATE")
+    sidecars = []
+    try:
+        # Another process may have migrated it first
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        if version < 1:
+            _create_entries_table(conn)
+        if version < 2:
+            conn.execute("ALTER TABLE entries ADD COLUMN pinned INTEGER NOT NULL DEFAULT 0")
+            # Seconds it took to produce the entry, unknown for existing ones
+            conn.execute("ALTER TABLE entries ADD COLUMN cost REAL")
+            conn.execute("UPDATE entries SET cost = 0 WHERE size IS NOT NULL")
+        if version < 3:
+            # Files found sound by `scrub_cache`, by path relative to STORAGE_DIR
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS scrubbed (
+                    path TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    mtime_ns INTEGER NOT NULL,
+                    checked REAL NOT NULL
+                )
+                """
+            )
+        if version < 4:
+            # Versions listed by each manifest, see `_refresh_catalog`
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS catalog (
+                    source TEXT NOT NULL,
+                    id TEXT NOT NULL,
+                    type TEXT,
+                    released REAL,
+                    url TEXT,
+                    position INTEGER NOT NULL,
+                    data TEXT NOT NULL,
+                    PRIMARY KEY (source, id)
+                ) WITHOUT ROWID
+                """
+            )
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS catalog_sources (
+                    source TEXT PRIMARY KEY,
+                    revision TEXT NOT NULL,
+                    loaded REAL NOT NULL
+                )
+                """
+            )
+        if version < 5:
+            # Files of the object store, with their last use, see `touch_objects`
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS objects (
+                    sha1 TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    accessed REAL NOT NULL
+                ) WITHOUT ROWID
+                """
+            )
+            conn.executemany(
+                "INSERT OR IGNORE INTO objects (sha1, size, accessed) VALUES (?, ?, ?)", _legacy_objects()
+            )
+        if 1 <= version < 6:
+            _rename_compressed_entries(conn)
+        if version < 1:
+            sidecars = [_import_legacy_entry(conn, key) for key in _legacy_entry_keys()]
+        conn.execute(f"PRAGMA user_version = {INDEX_SCHEMA}")
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+
+    # Only dropped once their content is safely in the index
+    for path in itertools.chain.from_iterable(sidecars):
+        if exists(path):
+            os.remove(path)
+
+
+def _create_entries_table(conn):
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS entries (
+            key TEXT PRIMARY KEY,
+            name TEXT NOT NULL,
+            origin TEXT,
+            size INTEGER,
+            sha1 TEXT,
+            verified_mtime_ns INTEGER,
+            meta TEXT NOT NULL DEFAULT '{}',
+            created REAL NOT NULL,
+            accessed REAL NOT NULL
         )
-    ).hexdigest()
+        """
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS entries_origin ON entries (origin)")
 
-    if path := get_cached_file(key):
-        return path
-    
-    dst_out = make_cache_file(key, dst_jar_file_name)
 
-    cmd = ["java", "-jar", REMAPPER, src_jar, dst_out, mapping, from_ns, to_ns]
-    if ignore_conflicts:
-        cmd.append("--ignoreconflicts")
+@contextmanager
+def index_transaction():
+    """ Runs the statements of the block on the cache index as one transaction """
+    conn = _index()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
 
-    p = subprocess.Popen(cmd)
-    if p.wait() != 0:
-        sys.exit(1)
-    return dst_out
 
+def _rename_compressed_entries(conn):
+    """
+    Entries used to be compressed as `<name>.gz`, which upstream .gz files
+    share. Those mcjar compressed get COMPRESSED_EXT, the others are hashed
+    again as they are, since their content was read decompressed.
+    """
+    for row in conn.execute("SELECT key, name FROM entries WHERE name LIKE '%.gz'").fetchall():
+        path = cache_path(row["key"], row["name"])
+        if not exists(path):
+            continue
+        plain_name = row["name"][: -len(".gz")]
+        if plain_name.endswith(COMPRESSED_SUFFIXES):
+            name = plain_name + COMPRESSED_EXT
+            os.replace(path, cache_path(row["key"], name))
+            conn.execute("UPDATE entries SET name = ? WHERE key = ?", (name, row["key"]))
+        else:
+            conn.execute(
+                "UPDATE entries SET sha1 = ?, verified_mtime_ns = ? WHERE key = ?",
+                (file_sha1(path), os.stat(path).st_mtime_ns, row["key"]),
+            )
 
-def map_ss_jar(
-    input_jar: str,
-    input_mappings: str,
-    dst_jar: str,
-    exclude: Optional[str] = None,
-    auto_lvt: bool = False,
-):
-    cmd = ["java", "-jar", SPECIAL_SOURCE2, "map"]
-    if auto_lvt:
-        cmd.extend(["--auto-lvt", "BASIC"])
-    if exclude is not None:
-        cmd.extend(["-e", exclude])
-    
-    cmd.extend(["-i", input_jar, "-m", input_mappings, "-o", dst_jar])
-    subprocess.check_call(cmd)
-    return dst_jar
 
+def _legacy_objects() -> List[Tuple[str, int, float]]:
+    """ (sha1, size, mtime) of the files already in the object store """
+    found = []
+    objects_dir = get_objects_dir()
+    if not exists(objects_dir):
+        return found
+    for folder in os.listdir(objects_dir):
+        if len(folder) != 2 or not os.path.isdir(join(objects_dir, folder)):
+            continue
+        for name in os.listdir(join(objects_dir, folder)):
+            if len(name) == 40:
+                st = os.stat(join(objects_dir, folder, name))
+                found.append((name, st.st_size, st.st_mtime))
+    return found
 
-def run_spigot_map_command(data_dir, cmd_str, *args):
+
+def is_cache_key(name: str) -> bool:
+    """ Whether name has the form of a cache key, a lowercase hex sha1 """
+    return len(name) == 40 and all(c in "0123456789abcdef" for c in name)
+
+
+def is_entry_name(name: str) -> bool:
+    """ Whether name can be the file of an entry: not hidden, and not a path """
+    return bool(name) and not name.startswith(".") and "/" not in name and "\\" not in name
+
+
+def _legacy_entry_keys() -> List[str]:
+    """ Entry directories in STORAGE_DIR, named after a sha1 """
+    if not exists(STORAGE_DIR):
+        return []
+    return [name for name in os.listdir(STORAGE_DIR) if is_cache_key(name)]
+
+
+def _import_legacy_entry(conn, cache_key: str) -> List[str]:
     """
-    Safely executes the java command provided in Spigot's build json.
-    Replaces {0}, {1}, etc with provided *args.
+    Indexes an entry made before the index existed, or by an older mcjar,
+    folding its `.meta.json` and `.verified` sidecars into its row.
+    Returns the sidecar files, which the caller removes once committed.
     """
-    if not cmd_str.startswith("java -jar BuildData/bin/SpecialSource"):
-         # Basic sanity check
-        raise ValueError(f"Unexpected map command: {cmd_str}")
+    cache_dir = join(STORAGE_DIR, cache_key)
+    try:
+        # Dotfiles hold metadata about the entry, not the entry itself
+        listing = [f for f in os.listdir(cache_dir) if not f.startswith(".")]
+    except OSError:
+        return []
+    if not listing:
+        return []
+
+    path = join(cache_dir, listing[0])
+    st = os.stat(path)
+    meta = _read_json_or_empty(join(cache_dir, ".meta.json"))
+    marker = _read_json_or_empty(_verified_path(path))
+    verified = marker.get("size") == st.st_size and marker.get("mtime_ns") == st.st_mtime_ns
+    conn.execute(
+        """
+        INSERT OR REPLACE INTO entries (key, name, origin, size, sha1, verified_mtime_ns, meta, created, accessed, cost)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 0)
+        """,
+        (
+            cache_key,
+            listing[0],
+            meta.get("url"),
+            st.st_size,
+            marker.get("sha1") if verified else None,
+            st.st_mtime_ns if verified else None,
+            json.dumps(meta),
+            st.st_mtime,
+            st.st_atime,
+        ),
+    )
+    return [join(cache_dir, ".meta.json"), _verified_path(path)]
 
-    # Use shlex to safely split command arguments honoring quotes
-    parts = shlex.split(cmd_str)
-    
-    # Replace placeholder {n} with actual args
-    final_cmd = []
-    for seg in parts:
-        if seg.startswith("{") and seg.endswith("}") and seg[1:-1].isdigit():
-            idx = int(seg[1:-1])
-            final_cmd.append(args[idx])
-        else:
-            final_cmd.append(seg)
 
-    print("Running map command:", " ".join(final_cmd))
-    subprocess.check_call(final_cmd, cwd=dirname(data_dir))
+def _entry_key(path: str) -> Optional[str]:
+    """ Key of the cache entry path belongs to, if it is one """
+    folder = dirname(abspath(path))
+    if dirname(folder) == abspath(STORAGE_DIR):
+        return basename(folder)
+    return None
 
 
-def map_mojang(version_id: str, target: str):
-    return map_jar_with_tiny(
-        f"{version_id}-{target}-moj-mapped.jar",
-        get_piston_file(version_id, target),
-        get_mojang_tiny(version_id, target),
-        # Mojang mappings often need target/source flipped relative to Tiny Remapper defaults
-        "target",
-        "source",
+def _verified_path(path: str) -> str:
+    return join(dirname(path), f".{basename(path)}.verified")
+
+
+def mark_verified(path: str, expected_sha1: str):
+    """
+    Records that path matched expected_sha1, tied to its current size and
+    mtime so that any later change to the file invalidates the marker.
+    Kept in the cache index for entries, in a sidecar file otherwise.
+    """
+    st = os.stat(path)
+    if key := _entry_key(path):
+        cur = _index().execute(
+            "UPDATE entries SET sha1 = ?, size = ?, verified_mtime_ns = ? WHERE key = ? AND name = ?",
+            (expected_sha1.lower(), st.st_size, st.st_mtime_ns, key, basename(path)),
+        )
+        if cur.rowcount:
+            return
+    with open(_verified_path(path), "w") as f:
+        json.dump({"sha1": expected_sha1.lower(), "size": st.st_size, "mtime_ns": st.st_mtime_ns}, f)
+
+
+def is_verified(path: str, expected_sha1: Optional[str] = None) -> bool:
+    """ Checks the marker left by `mark_verified`, without reading path """
+    marker = None
+    if key := _entry_key(path):
+        row = _index().execute(
+            "SELECT sha1, size, verified_mtime_ns FROM entries WHERE key = ? AND name = ?",
+            (key, basename(path)),
+        ).fetchone()
+        if row is not None:
+            marker = {"sha1": row["sha1"], "size": row["size"], "mtime_ns": row["verified_mtime_ns"]}
+    if marker is None:
+        marker = _read_json_or_empty(_verified_path(path))
+    try:
+        st = os.stat(path)
+    except OSError:
+        return False
+    return (
+        marker.get("sha1") is not None
+        and marker.get("size") == st.st_size
+        and marker.get("mtime_ns") == st.st_mtime_ns
+        and (expected_sha1 is None or marker.get("sha1") == expected_sha1.lower())
     )
 
 
-def map_yarn(version_id: str, target: str):
-    tiny = get_most_recent_yarn(version_id)
-    if tiny is None:
-        raise RuntimeError("Could not find yarn for version: " + version_id)
+def verify_file(path: str, expected_sha1: Optional[str], expected_size: Optional[int] = None) -> bool:
+    """
+    Checks path against its published hash and size, rehashing only when
+    there is no valid verified marker for it.
+    """
+    if expected_sha1 is None or is_verified(path, expected_sha1):
+        return True
+    # Compressed entries are checked on their content
+    if expected_size is not None and not path.endswith(COMPRESSED_EXT) and os.path.getsize(path) != expected_size:
+        return False
+    if content_sha1(path) != expected_sha1.lower():
+        return False
+    mark_verified(path, expected_sha1)
+    return True
 
-    return map_jar_with_tiny(
-        f"{version_id}-{target}-yarn-mapped.jar",
-        get_piston_file(version_id, target),
-        tiny,
-    )
 
+def get_cached_file(cache_key: str) -> Optional[str]:
+    conn = _index()
+    row = conn.execute("SELECT name, size, sha1, accessed FROM entries WHERE key = ?", (cache_key,)).fetchone()
+    if row is None:
+        if not exists(join(STORAGE_DIR, cache_key)):
+            return None
+        # Made by an older mcjar sharing this cache
+        sidecars = _import_legacy_entry(conn, cache_key)
+        for sidecar in sidecars:
+            if exists(sidecar):
+                os.remove(sidecar)
+        return get_cached_file(cache_key) if sidecars else None
+
+    path = join(STORAGE_DIR, cache_key, row["name"])
+    try:
+        st = os.stat(path)
+    except OSError:
+        if not (row["sha1"] and jar_store_has(row["sha1"])):
+            conn.execute("DELETE FROM entries WHERE key = ?", (cache_key,))
+            return None
+        st = _rehydrate_entry(cache_key, path, row["sha1"])
 
-def get_spigot_versions() -> Dict[str, str]:
-    spigot = download_cached(
-        "https://hub.spigotmc.org/versions/", "spigot_versions.htm"
-    )
-    with open(spigot, "r") as f:
-        lines = f.read().splitlines()
+    now = time.time()
+    if row["size"] != st.st_size or now - row["accessed"] > ACCESS_RESOLUTION:
+        conn.execute("UPDATE entries SET size = ?, accessed = ? WHERE key = ?", (st.st_size, now, cache_key))
+    if _recorded_keys is not None:
+        _recorded_keys.add(cache_key)
+    return path
 
-    # Ex: <a href="1.10.2.json">1.10.2.json</a>
-    files = [
-        line.split('"')[1]
-        for line in lines
-        if line.strip().startswith("<a href=") and ".json" in line
-    ]
 
-    return {
-        version: "https://hub.spigotmc.org/versions/" + version for version in files
-    }
+def cache_path(cache_key: str, name: str) -> str:
+    return join(STORAGE_DIR, cache_key, name)
 
 
-def map_spigot(spigot_version_id: str, force_piston_server_file: bool = False):
-    key = sha1(
-        f"MAP SPIGOT: {(spigot_version_id, force_piston_server_file)}".encode("utf-8")
-    ).hexdigest()
+@contextmanager
+def new_cache_file(cache_key: str, name: str, origin: Optional[str] = None):
+    """
+    Produces a cache entry, to be used under cache_lock(cache_key). Yields
+    a hidden temp path in the entry's directory, which is only renamed into
+    place and registered in the cache index once the block completes, so
+    a failed or killed producer never leaves a partial entry behind.
+    origin is the URL the entry is downloaded from, or the inputs it is
+    derived from.
+
+    Text-like entries end up compressed as `<name>.mcjar.gz`, so read entries
+    with `open_cached`, and locate them with `get_cached_file`.
+    """
+    _auto_gc()
+    path = cache_path(cache_key, name)
+    tmp = join(dirname(path), f".tmp-{name}")
+    os.makedirs(dirname(path), exist_ok=True)
+    # Left over by a killed run, tools may not overwrite it cleanly
+    if exists(tmp):
+        os.remove(tmp)
+
+    started = time.time()
+    try:
+        yield tmp
+        if not exists(tmp):
+            raise RuntimeError(f"{name} was not produced")
+    except BaseException:
+        for leftover in (tmp, _verified_path(tmp)):
+            if exists(leftover):
+                os.remove(leftover)
+        raise
+
+    # A hash checked while downloading moves along with the file
+    marker = _read_json_or_empty(_verified_path(tmp))
+    st = os.stat(tmp)
+    if marker.get("size") == st.st_size and marker.get("mtime_ns") == st.st_mtime_ns:
+        digest = marker["sha1"]
+    else:
+        digest = content_sha1(tmp)
 
-    if out_path := get_cached_file(key):
-        return out_path
-    
-    out_path = make_cache_file(key, "spigot_mapped.jar")
-    versions = get_spigot_versions()
+    if COMPRESS_ENTRIES and name.endswith(COMPRESSED_SUFFIXES) and st.st_size >= COMPRESS_MIN_SIZE:
+        name += COMPRESSED_EXT
+        path = cache_path(cache_key, name)
+        _compress_file(tmp, path)
+    else:
+        os.replace(tmp, path)
+    # The other form of the entry, if GRYLA_COMPRESS changed since it was made
+    stale = path[: -len(COMPRESSED_EXT)] if path.endswith(COMPRESSED_EXT) else path + COMPRESSED_EXT
+    if exists(stale):
+        os.remove(stale)
+
+    # Blobs hold the content as is, which compressed entries do not
+    st = os.stat(path) if path.endswith(COMPRESSED_EXT) else link_blob(path, digest)
+    now = time.time()
+    _index().execute(
+        """
+        INSERT INTO entries (key, name, origin, size, sha1, verified_mtime_ns, created, accessed, cost)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (key) DO UPDATE SET
+            name = excluded.name, origin = COALESCE(excluded.origin, origin), size = excluded.size,
+            sha1 = excluded.sha1, verified_mtime_ns = excluded.verified_mtime_ns,
+            created = excluded.created, accessed = excluded.accessed, cost = excluded.cost
+        """,
+        (
+            cache_key,
+            name,
+            origin,
+            st.st_size,
+            digest,
+            st.st_mtime_ns,
+            started,
+            now,
+            now - started,
+        ),
+    )
+    if exists(_verified_path(tmp)):
+        os.remove(_verified_path(tmp))
+    if _recorded_keys is not None:
+        _recorded_keys.add(cache_key)
 
-    if spigot_version_id + ".json" not in versions:
-         raise ValueError(f"Invalid spigot version: {spigot_version_id}")
 
-    initial_json_name = spigot_version_id + ".json"
-    url = versions[initial_json_name]
+# Keys of the entries used while recording, see `record_cache_keys`
+_recorded_keys: Optional[set] = None
 
-    with open(download_cached(url, initial_json_name), "r") as f:
-        ref = json.load(f)["refs"]["BuildData"]
 
-    data_path = set_build_data(ref)
+@contextmanager
+def record_cache_keys():
+    """ Collects the keys of every entry looked up or produced within the block """
+    global _recorded_keys
+    previous, _recorded_keys = _recorded_keys, set()
+    try:
+        yield _recorded_keys
+    finally:
+        _recorded_keys = previous
 
-    with open(join(data_path, "info.json")) as f:
-        info_json = json.load(f)
 
-    if "serverUrl" in info_json and not force_piston_server_file:
-        server_jar = download_cached(info_json["serverUrl"], "server.jar")
-    else:
-        server_jar = get_piston_file(info_json["minecraftVersion"], "server")
+# Entries with the same content share one file: each is a hard link to the
+# blob of its sha1 in the object store, see `link_blob`
 
-    with tempfile.TemporaryDirectory() as tmp_dir:
-        class_mapped = join(tmp_dir, "class_mapped.jar")
-        final_mapped = join(tmp_dir, "final_mapped.jar")
-        
-        # Tools version < 84 means manual SpecialSource mapping
-        if 84 > info_json.get("toolsVersion", 0):
+
+def link_blob(path: str, sha1_hex: str) -> os.stat_result:
+    """
+    Replaces path, an entry whose content has sha1_hex, by a hard link to
+    the blob with that content, storing it as the blob if there is none
+    yet. A blob whose content does not match sha1_hex is replaced by path
+    instead. Left as is where hard links are not supported. Returns the
+    stat of the resulting file.
+    """
+    blob = object_path(sha1_hex)
+    with cache_lock("OBJECT: " + sha1_hex.lower()):
+        try:
+            if exists(blob) and os.path.samefile(blob, path):
+                pass
+            elif exists(blob) and os.path.getsize(blob) == os.path.getsize(path) and content_hash(blob) == sha1_hex:
+                link = join(dirname(path), f".link-{basename(path)}")
+                if exists(link):
+                    os.remove(link)
+                os.link(blob, link)
+                os.replace(link, path)
+            else:
+                # Missing, or corrupt: path has just been hashed, the blob has not
+                os.makedirs(dirname(blob), exist_ok=True)
+                link = join(dirname(blob), f".link-{basename(blob)}")
+                if exists(link):
+                    os.remove(link)
+                os.link(path, link)
+                os.replace(link, blob)
+                record_object(sha1_hex, os.path.getsize(blob))
+        except OSError as ex:
+            print(f"Warning: cannot deduplicate {basename(path)} ({ex})", file=sys.stderr)
+    return os.stat(path)
+
+
+def discard_corrupt(path: str):
+    """
+    Deletes a cache file that failed verification, along with the blob it
+    is a link to, since they are the same corrupt file
+    """
+    blob = linked_blob(path)
+    os.remove(path)
+    if blob:
+        with cache_lock("OBJECT: " + basename(blob)):
+            try:
+                os.remove(blob)
+                forget_object(basename(blob))
+            except FileNotFoundError:
+                pass
+
+
+def linked_blob(path: str) -> Optional[str]:
+    """ The blob path is a hard link to, if any """
+    key = _entry_key(path)
+    row = key and _index().execute("SELECT sha1 FROM entries WHERE key = ?", (key,)).fetchone()
+    if not row or not row["sha1"]:
+        return None
+    blob = object_path(row["sha1"])
+    try:
+        return blob if os.path.samefile(blob, path) else None
+    except OSError:
+        return None
+
+
+def release_blob(blob: str):
+    """ Deletes blob once no entry links to it anymore """
+    with cache_lock("OBJECT: " + basename(blob)):
+        try:
+            if os.stat(blob).st_nlink == 1:
+                os.remove(blob)
+                forget_object(basename(blob))
+        except OSError:
+            pass
+
+
+def record_object(sha1_hex: str, size: int):
+    """ Registers a new file of the object store, so gc accounts for it """
+    _index().execute(
+        "INSERT OR REPLACE INTO objects (sha1, size, accessed) VALUES (?, ?, ?)", (sha1_hex.lower(), size, time.time())
+    )
+
+
+def touch_objects(sha1s: List[str]):
+    """ Records a use of the given objects, so gc ranks them like entries """
+    now = time.time()
+    _index().executemany(
+        "UPDATE objects SET accessed = ? WHERE sha1 = ? AND accessed < ?",
+        [(now, sha1_hex.lower(), now - ACCESS_RESOLUTION) for sha1_hex in sha1s],
+    )
+
+
+def forget_object(sha1_hex: str):
+    _index().execute("DELETE FROM objects WHERE sha1 = ?", (sha1_hex.lower(),))
+
+
+def derived_cache_key(inputs: str) -> str:
+    """
+    Key of an entry derived from other files, described by inputs. Files
+    are described by their `content_hash`, not their path, so the key holds
+    wherever they come from and wherever the cache lives.
+    """
+    return sha1(inputs.encode("utf-8")).hexdigest()
+
+
+_content_hashes: Dict[Tuple[str, int, int], str] = {}
+
+
+def content_hash(path: str) -> str:
+    """
+    sha1 of the content of path, see `content_sha1`. Cache entries have
+    theirs in the index, other files are hashed once per size and mtime.
+    """
+    st = os.stat(path)
+    if key := _entry_key(path):
+        row = _index().execute(
+            "SELECT sha1, verified_mtime_ns FROM entries WHERE key = ? AND name = ?", (key, basename(path))
+        ).fetchone()
+        if row is not None and row["sha1"] and row["verified_mtime_ns"] == st.st_mtime_ns:
+            return row["sha1"]
+    memo = (abspath(path), st.st_size, st.st_mtime_ns)
+    if memo not in _content_hashes:
+        _content_hashes[memo] = content_sha1(path)
+    return _content_hashes[memo]
+
+
+def cache_entries(pattern: Optional[str] = None, sort: str = "accessed") -> list:
+    """ Index rows whose name, origin or key contains pattern, most relevant first """
+    order = {
+        "accessed": "accessed DESC",
+        "created": "created DESC",
+        "size": "size DESC",
+        "name": "name",
+    }[sort]
+    query = "SELECT * FROM entries"
+    params: tuple = ()
+    if pattern:
+        query += " WHERE name LIKE ? OR origin LIKE ? OR key LIKE ?"
+        params = (f"%{pattern}%", f"%{pattern}%", f"{pattern}%")
+    return _index().execute(f"{query} ORDER BY {order}", params).fetchall()
+
+
+def find_cache_entry(query: str):
+    """ Index row matching a key, a unique key prefix, an origin or a path """
+    conn = _index()
+    if os.sep in query and (key := _entry_key(query)):
+        query = key
+    rows = conn.execute(
+        "SELECT * FROM entries WHERE key = ? OR origin = ? ORDER BY accessed DESC", (query, query)
+    ).fetchall()
+    if not rows and len(query) >= 4:
+        rows = conn.execute("SELECT * FROM entries WHERE key LIKE ?", (query + "%",)).fetchall()
+        if len(rows) > 1:
+            raise ValueError(f"'{query}' matches {len(rows)} entries")
+    return rows[0] if rows else None
+
+
+_cache_locks: Dict[str, threading.RLock] = {}
+_cache_locks_guard = threading.Lock()
+# Key -> [fd, depth] of the lock files held by this process
+_lock_files: Dict[str, list] = {}
+
+if os.name == "nt":
+    import msvcrt
+
+    def _try_lock_fd(fd: int) -> bool:
+        try:
+            msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+            return True
+        except OSError:
+            return False
+
+    def _lock_fd(fd: int):
+        while not _try_lock_fd(fd):
+            time.sleep(0.1)
+
+    def _unlock_fd(fd: int):
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+
+else:
+    import fcntl
+
+    def _try_lock_fd(fd: int) -> bool:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except BlockingIOError:
+            return False
+
+    def _lock_fd(fd: int):
+        fcntl.flock(fd, fcntl.LOCK_EX)
+
+    def _unlock_fd(fd: int):
+        fcntl.flock(fd, fcntl.LOCK_UN)
+
+
+def _lock_file_path(cache_key: str) -> str:
+    name = cache_key if len(cache_key) == 40 else sha1(cache_key.encode("utf-8")).hexdigest()
+    return join(STORAGE_DIR, ".locks", name)
+
+
+def _is_lock_file(fd: int, path: str) -> bool:
+    """ Whether fd is still the file at path, which its last holder may have removed """
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return False
+    fst = os.fstat(fd)
+    return (st.st_dev, st.st_ino) == (fst.st_dev, fst.st_ino)
+
+
+def _open_lock_file(cache_key: str, blocking: bool) -> Optional[int]:
+    """ Locks the lock file of cache_key, returning its fd, or None if busy and not blocking """
+    path = _lock_file_path(cache_key)
+    os.makedirs(dirname(path), exist_ok=True)
+    waiting = False
+    while True:
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if not _try_lock_fd(fd):
+                if not blocking:
+                    os.close(fd)
+                    return None
+                if not waiting:
+                    print(f"Waiting for another mcjar process to finish {cache_key[:40]}...", file=sys.stderr)
+                    waiting = True
+                _lock_fd(fd)
+            # Windows cannot remove open files, see `_close_lock_file`
+            if os.name == "nt" or _is_lock_file(fd, path):
+                return fd
+            _unlock_fd(fd)
+            os.close(fd)
+        except BaseException:
+            os.close(fd)
+            raise
+
+
+def _close_lock_file(cache_key: str, fd: int):
+    """
+    Releases a lock file, removing it so that .locks does not keep one file
+    per key ever locked. It is removed while still locked, so processes
+    waiting on it notice and lock a new file instead.
+    """
+    path = _lock_file_path(cache_key)
+    if os.name != "nt":
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+    _unlock_fd(fd)
+    os.close(fd)
+    if os.name == "nt":
+        try:
+            # Fails while another process has it open
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def _prune_lock_files():
+    """ Removes the lock files left by earlier versions, which kept them """
+    folder = join(STORAGE_DIR, ".locks")
+    if os.name == "nt" or not exists(folder):
+        return
+    for name in os.listdir(folder):
+        path = join(folder, name)
+        try:
+            fd = os.open(path, os.O_RDWR)
+        except OSError:
+            continue
+        try:
+            if _try_lock_fd(fd):
+                if _is_lock_file(fd, path):
+                    os.remove(path)
+                _unlock_fd(fd)
+        finally:
+            os.close(fd)
+
+
+@contextmanager
+def cache_lock(cache_key: str, blocking: bool = True):
+    """
+    Serializes the producers of a single cache entry, so that concurrent
+    jobs needing the same artifact wait for the first one instead of
+    writing over each other. This holds across processes too, through a
+    lock file in STORAGE_DIR/.locks. Re-entrant within a thread.
+
+    With blocking=False, yields False instead of waiting when another
+    thread or process holds it.
+    """
+    with _cache_locks_guard:
+        lock = _cache_locks.setdefault(cache_key, threading.RLock())
+    if not lock.acquire(blocking):
+        yield False
+        return
+    try:
+        held = _lock_files.get(cache_key)
+        if held is None:
+            fd = _open_lock_file(cache_key, blocking)
+            if fd is None:
+                yield False
+                return
+            held = _lock_files[cache_key] = [fd, 0]
+        held[1] += 1
+        try:
+            yield True
+        finally:
+            held[1] -= 1
+            if not held[1]:
+                del _lock_files[cache_key]
+                _close_lock_file(cache_key, held[0])
+    finally:
+        lock.release()
+
+
+def pin_cache_entry(cache_key: str, pinned: bool = True):
+    """ Pinned entries are never evicted by `gc_cache` """
+    _index().execute("UPDATE entries SET pinned = ? WHERE key = ?", (int(pinned), cache_key))
+
+
+def rebuild_cost(row, mtime: float) -> float:
+    """
+    Estimated seconds to recreate an entry: how long producing it took,
+    and at least a refetch for downloads, or a JVM run for derived files.
+    """
+    measured = row["cost"] if row["cost"] is not None else max(mtime - row["created"], 0.0)
+    if (row["origin"] or "").startswith(("http:", "https:", "file:")):
+        return max(measured, 0.2 + (row["size"] or 0) / (5 << 20))
+    return max(measured, 10.0)
+
+
+def _gc_victims(budget: float, grace: float) -> list:
+    """
+    (row, size) of the entries and objects to evict, least valuable first.
+    Object rows are those of the `objects` table, without a key. Jars in
+    the class store count with their share of it, see `jar_store_shares`.
+    """
+    now = time.time()
+    total = 0
+    shares = jar_store_shares()
+    # Entries sharing a blob or stored jar only free its space once all of
+    # them are gone. Pinned ones come first: they hold theirs for good,
+    # uncounted.
+    links: Dict[tuple, int] = {}
+    candidates = []
+    for row in _index().execute("SELECT * FROM entries ORDER BY pinned DESC"):
+        held = []
+        try:
+            st = os.stat(join(STORAGE_DIR, row["key"], row["name"]))
+            held.append(((st.st_dev, st.st_ino), st.st_size))
+            mtime = st.st_mtime
+        except OSError:
+            mtime = row["created"]
+        if row["sha1"] in shares:
+            held.append((("jar", row["sha1"]), shares[row["sha1"]]))
+        # Lost, and rebuilt from nothing by `get_cached_file`
+        if not held:
+            continue
+        for link, size in held:
+            if link not in links and not row["pinned"]:
+                total += size
+            links[link] = links.get(link, 0) + 1
+        if row["pinned"] or now - max(row["accessed"], row["created"]) < grace:
+            continue
+        # Cheap entries nobody used for long go first
+        value = rebuild_cost(row, mtime) / (now - row["accessed"] + 60)
+        candidates.append((value, row, held))
+
+    # Objects no entry links to: libraries, assets and released blobs
+    for row in _index().execute("SELECT * FROM objects"):
+        try:
+            st = os.stat(object_path(row["sha1"]))
+        except OSError:
+            continue
+        inode = (st.st_dev, st.st_ino)
+        if inode in links:
+            continue
+        total += st.st_size
+        links[inode] = 1
+        if now - row["accessed"] < grace:
+            continue
+        value = (0.2 + st.st_size / (5 << 20)) / (now - row["accessed"] + 60)
+        candidates.append((value, row, [(inode, st.st_size)]))
+
+    victims = []
+    for _, row, held in sorted(candidates, key=lambda c: c[0]):
+        if total <= budget:
+            break
+        victims.append((row, sum(size for _, size in held)))
+        for link, size in held:
+            links[link] -= 1
+            if not links[link]:
+                total -= size
+    return victims
+
+
+_gc_lock = threading.Lock()
+_last_gc = float("-inf")
+
+
+def gc_cache(budget: Optional[float] = None, dry_run: bool = False, grace: float = GC_GRACE) -> List[Tuple[str, int]]:
+    """
+    Evicts unpinned entries and objects until they fit in budget bytes
+    (default: CACHE_BUDGET), ranked by rebuild cost per second since their
+    last use. Objects that entries link to only go with the entries.
+    Entries used within grace seconds, or being produced, are kept. Jars
+    are only moved to the class store when JAR_STORE is set.
+    Returns the (path, size) of the evicted entries.
+    """
+    global _last_gc
+    if budget is None:
+        budget = CACHE_BUDGET
+    if budget is None:
+        return []
+
+    _last_gc = time.monotonic()
+    evicted = []
+    for row, size in _gc_victims(budget, grace):
+        if "key" not in row.keys():
+            path = object_path(row["sha1"])
+            if dry_run or _evict_object(row):
+                evicted.append((path, size))
+            continue
+        path = join(STORAGE_DIR, row["key"], row["name"])
+        if dry_run:
+            evicted.append((path, size))
+            continue
+
+        with cache_lock(row["key"], blocking=False) as locked:
+            if not locked:
+                continue
+            if JAR_STORE and path.endswith(".jar") and dehydrate_entry(row["key"]):
+                evicted.append((path, size))
+                continue
+            blob = exists(path) and linked_blob(path)
+            # Unless another process used it since
+            cur = _index().execute(
+                "DELETE FROM entries WHERE key = ? AND accessed = ? AND pinned = 0", (row["key"], row["accessed"])
+            )
+            if not cur.rowcount:
+                continue
+            shutil.rmtree(join(STORAGE_DIR, row["key"]), ignore_errors=True)
+            if blob:
+                release_blob(blob)
+        evicted.append((path, size))
+    if evicted and not dry_run:
+        prune_jar_store()
+    if not dry_run:
+        _prune_lock_files()
+    return evicted
+
+
+def _evict_object(row) -> bool:
+    """ Deletes an object, unless it is being fetched or was used since it was picked """
+    with cache_lock("OBJECT: " + row["sha1"], blocking=False) as locked:
+        if not locked:
+            return False
+        cur = _index().execute("DELETE FROM objects WHERE sha1 = ? AND accessed = ?", (row["sha1"], row["accessed"]))
+        if not cur.rowcount:
+            return False
+        try:
+            os.remove(object_path(row["sha1"]))
+        except FileNotFoundError:
+            pass
+        return True
+
+
+def _auto_gc():
+    """ Runs `gc_cache` at most every GC_INTERVAL seconds, when there is a budget """
+    if CACHE_BUDGET is None or time.monotonic() - _last_gc < GC_INTERVAL:
+        return
+    if _gc_lock.acquire(blocking=False):
+        try:
+            gc_cache()
+        finally:
+            _gc_lock.release()
+
+
+def read_cache_meta(cache_key: str) -> dict:
+    row = _index().execute("SELECT meta FROM entries WHERE key = ?", (cache_key,)).fetchone()
+    return json.loads(row["meta"]) if row else {}
+
+
+def write_cache_meta(cache_key: str, meta: dict):
+    _index().execute(
+        "UPDATE entries SET meta = ?, origin = COALESCE(?, origin) WHERE key = ?",
+        (json.dumps(meta), meta.get("url"), cache_key),
+    )
+
+
+def _revalidate_cached(cache_key: str, url: str, path: str) -> str:
+    """
+    Refreshes a cached download with a conditional request, so that an
+    unchanged file costs a single 304 round trip. Falls back to the cached
+    copy if the server cannot be reached.
+    """
+    meta = read_cache_meta(cache_key)
+    headers = {}
+    if meta.get("etag"):
+        headers["If-None-Match"] = meta["etag"]
+    if meta.get("last_modified"):
+        headers["If-Modified-Since"] = meta["last_modified"]
+
+    name = basename(path)[: -len(COMPRESSED_EXT)] if path.endswith(COMPRESSED_EXT) else basename(path)
+    fresh = join(dirname(path), f".new-{name}")
+    blob = linked_blob(path)
+    try:
+        validators = download_file(url, fresh, output=False, retries=1, conditional=headers)
+    except _transfer_errors() as e:
+        print(f"Warning: cannot revalidate {name} ({e}), using cached copy", file=sys.stderr)
+        return path
+
+    if validators is not None:
+        # Changed upstream, so published like a new download
+        with new_cache_file(cache_key, name, url) as tmp:
+            os.replace(fresh, tmp)
+            if exists(_verified_path(fresh)):
+                os.replace(_verified_path(fresh), _verified_path(tmp))
+        if blob:
+            release_blob(blob)
+        path = get_cached_file(cache_key) or path
+        meta.update(validators)
+    meta.update(url=url, fetched=time.time())
+    write_cache_meta(cache_key, meta)
+    return path
+
+
+def url_cache_key(url: str) -> str:
+    return sha1(url.encode("utf-8")).hexdigest()
+
+
+def download_cached(
+    url: str,
+    file_name: str,
+    expected_sha1: Optional[str] = None,
+    expected_size: Optional[int] = None,
+    ttl: Optional[float] = None,
+) -> str:
+    """
+    Downloads url into the cache once. Entries with a ttl (in seconds) are
+    revalidated against the server once they are older than it, or on
+    their next use when REFRESH_MANIFESTS is set.
+    """
+    cache_key = url_cache_key(url)
+
+    with cache_lock(cache_key):
+        if path := get_cached_file(cache_key):
+            if ttl is not None:
+                if OFFLINE and not is_local_url(rewrite_url(url)):
+                    return path
+                checked = max(read_cache_meta(cache_key).get("fetched", 0), _revalidated_at.get(cache_key, 0))
+                if time.time() - checked >= ttl or (REFRESH_MANIFESTS and cache_key not in _revalidated_at):
+                    _revalidated_at[cache_key] = time.time()
+                    return _revalidate_cached(cache_key, url, path)
+                return path
+            if verify_file(path, expected_sha1, expected_size):
+                return path
+            print(f"Cached {file_name} is corrupt, downloading it again", file=sys.stderr)
+            discard_corrupt(path)
+        check_online(url)
+        with new_cache_file(cache_key, file_name, url) as tmp:
+            print(f"Downloading: {file_name}")
+            validators = download_file(url, tmp, expected_sha1=expected_sha1, expected_size=expected_size)
+        write_cache_meta(cache_key, dict(validators or {}, url=url, fetched=time.time()))
+        return get_cached_file(cache_key)
+
+
+def get_version_manifest() -> str:
+    return download_cached(VERSION_MANIFEST_URL, "version_manifest.json", ttl=MANIFEST_TTL)
+
+
+def get_omni_version_manifest() -> str:
+    return download_cached(
+        OMNI_VERSION_MANIFEST_URL, "omni_version_manifest.json", ttl=MANIFEST_TTL
+    )
+
+
+# --- TOOLS ---
+# Every tool is resolved, and downloaded if needed, on its first use
+
+_tool_paths: Dict[str, str] = {}
+
+
+def tool_sha1(url: str, fetch: bool = True) -> Optional[str]:
+    """
+    Pinned sha1 of a tool jar, from TOOL_SHA1S or the checksum file in
+    TOOL_SHA1_URLS. That one is downloaded once unless fetch is False, and
+    pinned along with the jar. None when there is no pin to check against.
+    """
+    if url in TOOL_SHA1S:
+        return TOOL_SHA1S[url]
+    sha1_url = TOOL_SHA1_URLS.get(url)
+    if sha1_url is None:
+        return None
+    key = url_cache_key(sha1_url)
+    path = get_cached_file(key)
+    if path is None:
+        if not fetch:
+            return None
+        try:
+            path = download_cached(sha1_url, basename(urllib.parse.urlsplit(sha1_url).path))
+        except MissingArtifactError:
+            # Offline, so the jar can only be the one recorded in the cache
+            return None
+    pin_cache_entry(key)
+    with open_cached(path) as f:
+        # Maven writes the hash alone, sha1sum adds the file name
+        digest = (f.read().split() or [""])[0].lower()
+    if not is_cache_key(digest):
+        raise ValueError(f"{sha1_url} does not hold a sha1")
+    return digest
+
+
+def _get_tool(url: str, file_name: str) -> str:
+    path = _tool_paths.get(url)
+    if path is None or not exists(path):
+        path = _tool_paths[url] = download_cached(url, file_name, tool_sha1(url))
+        pin_cache_entry(url_cache_key(url))
+    return path
+
+
+def get_cfr() -> str:
+    return _get_tool(CFR_URL, "cfr.jar")
+
+
+def get_remapper() -> str:
+    return _get_tool(REMAPPER_URL, "remapper.jar")
+
+
+def get_special_source2() -> str:
+    return _get_tool(SPECIAL_SOURCE2_URL, "SpecialSource-2.jar")
+
+
+def run_tool(cmd: List[str], cwd: Optional[str] = None, capture: bool = False) -> subprocess.CompletedProcess:
+    """
+    Runs a tool command, with its stdout/stderr captured if capture. At
+    most TOOL_JOBS tools run at once, later ones wait for a slot. Within
+    the async API, the process is run by the event loop with
+    asyncio.create_subprocess_exec.
+    """
+    with _tool_slots:
+        loop = getattr(_async_context, "loop", None)
+        if loop is not None:
+            import asyncio
+
+            return asyncio.run_coroutine_threadsafe(_run_tool_async(cmd, cwd, capture), loop).result()
+
+        pipe = subprocess.PIPE if capture else None
+        return subprocess.run(cmd, cwd=cwd, stdout=pipe, stderr=pipe)
+
+
+def get_mappingio() -> str:
+    return _get_tool(MAPPINGIO_URL, "mapping-io-cli.jar")
+
+
+# Module attributes that used to be resolved at import time
+_LAZY_ATTRIBUTES = {
+    "http": get_http,
+    "CRF": get_cfr,
+    "REMAPPER": get_remapper,
+    "SPECIAL_SOURCE2": get_special_source2,
+    "MAPPINGIO": get_mappingio,
+    "VERSION_MANIFEST": get_version_manifest,
+    "OMNI_VERSION_MANIFEST": get_omni_version_manifest,
+}
+
+
+def __getattr__(name: str):
+    if name in _LAZY_ATTRIBUTES:
+        return _LAZY_ATTRIBUTES[name]()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def _get_yarn_versions(url: str) -> List[str]:
+    with open_cached(download_cached(url, "maven-metadata.xml", ttl=MANIFEST_TTL), "rb") as f:
+        data = f.read()
+
+    # Older caches stored the parsed version list instead of the XML
+    if data.lstrip().startswith(b"["):
+        return json.loads(data)
+
+    root = ET.fromstring(data)
+    # Metadata XML structure: metadata -> versioning -> versions
+    versions_element = root.find("./versioning/versions")
+    if versions_element is None:
+        raise ValueError("Invalid Maven metadata XML")
+
+    return cast(List[str], [v.text for v in versions_element])
+
+
+def get_modern_yarn_versions() -> List[str]:
+    return _get_yarn_versions(YARN_FABRIC_BASE + "maven-metadata.xml")
+
+
+def get_legacy_yarn_versions() -> List[str]:
+    return _get_yarn_versions(YARN_LEGACY_BASE + "maven-metadata.xml")
+
+
+def get_piston_json_path(version_id: str):
+    cache_key = derived_cache_key(f"PISTON MANIFEST: '{version_id}'")
+    with cache_lock(cache_key):
+        if path := get_cached_file(cache_key):
+            return path
+
+        source = "piston"
+        if version_id.startswith("@omni@"):
+            source = "omni"
+            version_id = version_id[len("@omni@") :]
+
+        version = catalog_version(source, version_id)
+        if version is None:
+            raise IndexError("Unable to find version: " + version_id)
+
+        with new_cache_file(cache_key, "client.json", version["url"]) as tmp:
+            download_file(version["url"], tmp, output=False)
+        write_cache_meta(cache_key, {"url": version["url"]})
+        return get_cached_file(cache_key)
+
+
+def piston_file_cache_key(version_id: str, target: str) -> str:
+    return derived_cache_key(f"PISTON: '{version_id}' : {target}")
+
+
+def get_piston_file(version_id: str, target: str) -> str:
+    cache_key = piston_file_cache_key(version_id, target)
+    with cache_lock(cache_key):
+        cached = get_cached_file(cache_key)
+        if cached and is_verified(cached):
+            return cached
+
+        with open_cached(get_piston_json_path(version_id)) as f:
+            downloads = json.load(f)["downloads"]
+
+        if target.startswith("@omni@"):
+            target = target[len("@omni@") :]
+
+        if target not in downloads:
+            raise IndexError(f"Unable to find '{target}' in {', '.join(downloads.keys())}")
+
+        entry = downloads[target]
+        if cached:
+            # Entries from before verification existed are checked once
+            if verify_file(cached, entry.get("sha1"), entry.get("size")):
+                return cached
+            print(f"Cached {basename(cached)} is corrupt, downloading it again", file=sys.stderr)
+            discard_corrupt(cached)
+
+        url = entry["url"]
+        name = url.split("/")[-1]
+        with new_cache_file(cache_key, name, url) as tmp:
+            download_file(url, tmp, expected_sha1=entry.get("sha1"), expected_size=entry.get("size"))
+        write_cache_meta(cache_key, {"url": url})
+        return get_cached_file(cache_key)
+
+
+def _yarn_search(versions: List[str], version_id: str) -> List[str]:
+    return sorted(
+        [v for v in versions if v.startswith(version_id + "+build")],
+        key=lambda x: x.split(".")[-1].zfill(3),
+    )
+
+
+def get_most_recent_yarn_url(version_id: str) -> Optional[str]:
+    modern = _yarn_search(get_modern_yarn_versions(), version_id)
+    if len(modern):
+        ver = modern[-1]
+        return f"{YARN_FABRIC_BASE}{ver}/yarn-{ver}-tiny.gz"
+
+    legacy = _yarn_search(get_legacy_yarn_versions(), version_id)
+    if len(legacy):
+        ver = legacy[-1]
+        return f"{YARN_LEGACY_BASE}{ver}/yarn-{ver}-tiny.gz"
+    return None
+
+
+def yarn_cache_key(version_id: str) -> str:
+    return derived_cache_key(f"YARN MAPPING: {version_id}")
+
+
+def get_most_recent_yarn(version_id: str) -> Optional[str]:
+    key = yarn_cache_key(version_id)
+
+    with cache_lock(key):
+        if path := get_cached_file(key):
+            return path
+        url = get_most_recent_yarn_url(version_id)
+        if url is None:
+            return None
+
+        name = url.split("/")[-1]
+        with new_cache_file(key, name, url) as tmp:
+            download_file(url, tmp)
+        write_cache_meta(key, {"url": url})
+        return get_cached_file(key)
+
+
+def get_mojang_txt(version_id: str, target: str) -> str:
+    return get_piston_file(version_id, target + "_mappings")
+
+
+def get_mojang_tiny(version_id: str, target: str) -> str:
+    mojmap = get_mojang_txt(version_id, target)
+    inputs = f"MOJANG TINY: {(content_hash(mojmap), 'TINY_2', MAPPINGIO_URL)}"
+    key = derived_cache_key(inputs)
+
+    with cache_lock(key):
+        if path := get_cached_file(key):
+            return path
+
+        name = f"{version_id}-{target}.tiny"
+        with new_cache_file(key, name, inputs) as tmp, materialized(mojmap) as mojmap:
+            # Convert TXT to Tiny V2
+            result = run_tool(
+                [
+                    "java",
+                    "-jar",
+                    get_mappingio(),
+                    "convert",
+                    mojmap,
+                    tmp,
+                    "TINY_2",
+                ],
+                capture=True,
+            )
+
+            if result.returncode != 0:
+                print(result.stderr.decode(), file=sys.stderr)
+                raise RuntimeError(f"Failed to convert Mojang mappings for {version_id} {target}")
+        return get_cached_file(key)
+
+
+def map_jar_with_tiny(
+    dst_jar_file_name: str,
+    src_jar: str,
+    mapping: str,
+    from_ns="official",
+    to_ns="named",
+    ignore_conflicts=False,
+):
+    inputs = "MAP_TINY: " + str(
+        (dst_jar_file_name, content_hash(src_jar), content_hash(mapping), from_ns, to_ns, ignore_conflicts, REMAPPER_URL)
+    )
+    key = derived_cache_key(inputs)
+
+    with cache_lock(key):
+        if path := get_cached_file(key):
+            return path
+
+        with new_cache_file(key, dst_jar_file_name, inputs) as dst_out:
+            cmd = ["java", "-jar", get_remapper(), src_jar, dst_out, mapping, from_ns, to_ns]
+            if ignore_conflicts:
+                cmd.append("--ignoreconflicts")
+
+            if run_tool(cmd).returncode != 0:
+                raise RuntimeError(f"Failed to remap {basename(src_jar)}")
+        return cache_path(key, dst_jar_file_name)
+
+
+def map_ss_jar(
+    input_jar: str,
+    input_mappings: str,
+    dst_jar: str,
+    exclude: Optional[str] = None,
+    auto_lvt: bool = False,
+):
+    cmd = ["java", "-jar", get_special_source2(), "map"]
+    if auto_lvt:
+        cmd.extend(["--auto-lvt", "BASIC"])
+    if exclude is not None:
+        cmd.extend(["-e", exclude])
+    
+    cmd.extend(["-i", input_jar, "-m", input_mappings, "-o", dst_jar])
+    run_tool(cmd).check_returncode()
+    return dst_jar
+
+
+def run_spigot_map_command(data_dir, cmd_str, *args):
+    """
+    Safely executes the java command provided in Spigot's build json.
+    Replaces {0}, {1}, etc with provided *args.
+    """
+    if not cmd_str.startswith("java -jar BuildData/bin/SpecialSource"):
+         # Basic sanity check
+        raise ValueError(f"Unexpected map command: {cmd_str}")
+
+    # Use shlex to safely split command arguments honoring quotes
+    parts = shlex.split(cmd_str)
+    
+    # Replace placeholder {n} with actual args
+    final_cmd = []
+    for seg in parts:
+        if seg.startswith("{") and seg.endswith("}") and seg[1:-1].isdigit():
+            idx = int(seg[1:-1])
+            final_cmd.append(args[idx])
+        else:
+            final_cmd.append(seg)
+
+    print("Running map command:", " ".join(final_cmd))
+    run_tool(final_cmd, cwd=dirname(data_dir)).check_returncode()
+
+
+def map_mojang(version_id: str, target: str):
+    return map_jar_with_tiny(
+        f"{version_id}-{target}-moj-mapped.jar",
+        get_piston_file(version_id, target),
+        get_mojang_tiny(version_id, target),
+        # Mojang mappings often need target/source flipped relative to Tiny Remapper defaults
+        "target",
+        "source",
+    )
+
+
+def map_yarn(version_id: str, target: str):
+    tiny = get_most_recent_yarn(version_id)
+    if tiny is None:
+        raise RuntimeError("Could not find yarn for version: " + version_id)
+
+    return map_jar_with_tiny(
+        f"{version_id}-{target}-yarn-mapped.jar",
+        get_piston_file(version_id, target),
+        tiny,
+    )
+
+
+def get_spigot_version_list() -> str:
+    return download_cached(
+        "https://hub.spigotmc.org/versions/", "spigot_versions.htm", ttl=MANIFEST_TTL
+    )
+
+
+def get_spigot_versions() -> Dict[str, str]:
+    _refresh_catalog("spigot")
+    rows = _index().execute("SELECT id, url FROM catalog WHERE source = 'spigot' ORDER BY position")
+    return {row["id"] + ".json": row["url"] for row in rows}
+
+
+def map_spigot(spigot_version_id: str, force_piston_server_file: bool = False):
+    found = catalog_version("spigot", spigot_version_id)
+
+    if found is None:
+         raise ValueError(f"Invalid spigot version: {spigot_version_id}")
+
+    initial_json_name = spigot_version_id + ".json"
+    url = found["url"]
+
+    with open_cached(download_cached(url, initial_json_name)) as f:
+        ref = json.load(f)["refs"]["BuildData"]
+
+    # Read info.json straight from the commit, so the server jar can be
+    # fetched without holding the shared BuildData checkout
+    info_json = json.loads(get_build_data_file(ref, "info.json"))
+
+    if "serverUrl" in info_json and not force_piston_server_file:
+        server_jar = download_cached(info_json["serverUrl"], "server.jar")
+    else:
+        server_jar = get_piston_file(info_json["minecraftVersion"], "server")
+
+    # The BuildData commit pins the mappings and the commands run on them
+    inputs = f"MAP SPIGOT: {(content_hash(server_jar), ref, SPECIAL_SOURCE2_URL)}"
+    key = derived_cache_key(inputs)
+
+    with cache_lock(key):
+        if out_path := get_cached_file(key):
+            return out_path
+
+        with new_cache_file(key, "spigot_mapped.jar", inputs) as tmp:
+            with cache_lock(BUILD_DATA_LOCK):
+                data_path = set_build_data(ref)
+                _map_spigot_jar(data_path, info_json, server_jar, tmp)
+
+    return cache_path(key, "spigot_mapped.jar")
+
+
+def _map_spigot_jar(data_path: str, info_json: dict, server_jar: str, out_path: str):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        class_mapped = join(tmp_dir, "class_mapped.jar")
+        final_mapped = join(tmp_dir, "final_mapped.jar")
+        
+        # Tools version < 84 means manual SpecialSource mapping
+        if 84 > info_json.get("toolsVersion", 0):
             map_ss_jar(
                 server_jar,
                 join(data_path, "mappings", info_json["classMappings"]),
@@ -494,7 +2723,7 @@ def map_spigot(spigot_version_id: str, force_piston_server_file: bool = False):
                 join(data_path, "mappings", info_json["memberMappings"]),
                 out_path,
             )
-            return out_path
+            return
         
         # Modern Spigot handling via command strings in JSON
         run_spigot_map_command(
@@ -505,124 +2734,1860 @@ def map_spigot(spigot_version_id: str, force_piston_server_file: bool = False):
             class_mapped, # Out
         )
 
-        if "memberMappings" in info_json:
-            run_spigot_map_command(
-                data_path,
-                info_json["memberMapCommand"],
-                class_mapped, # In
-                join(data_path, "mappings", info_json["memberMappings"]),
-                out_path,  # Out
-            )
+        if "memberMappings" in info_json:
+            run_spigot_map_command(
+                data_path,
+                info_json["memberMapCommand"],
+                class_mapped, # In
+                join(data_path, "mappings", info_json["memberMappings"]),
+                out_path,  # Out
+            )
+        else:
+            print("Warning: This version lacks member mappings!", file=sys.stderr)
+            shutil.copy(class_mapped, out_path)
+
+        if "finalMapCommand" in info_json:
+            # We need to map from 'out_path' to a temp file, then move back
+            run_spigot_map_command(
+                data_path,
+                info_json["finalMapCommand"],
+                out_path, # In
+                join(data_path, "mappings", info_json["accessTransforms"]),
+                join(data_path, "mappings", info_json["classMappings"]),
+                final_mapped, # Out
+            )
+            shutil.copy(final_mapped, out_path)
+
+
+def get_retromcp_version_list() -> str:
+    return download_cached(
+        "https://mcphackers.org/versionsV3/versions.json", "versions.json", ttl=MANIFEST_TTL
+    )
+
+
+def get_retromcp_versions() -> list[dict]:
+    with open_cached(get_retromcp_version_list()) as f:
+        return json.load(f)
+
+
+def get_retromcp_version(version_id: str):
+    version = catalog_version("retromcp", version_id)
+    if version is None:
+        raise IndexError(f"Could not find version {version_id} in RetroMCP")
+    return version
+
+
+def get_retromcp_mapping_from_zip(zip_file: str) -> str:
+    inputs = f"RETROMCP ZIP: {content_hash(zip_file)}"
+    key = derived_cache_key(inputs)
+    with cache_lock(key):
+        if path := get_cached_file(key):
+            return path
+
+        with new_cache_file(key, "mappings.tiny", inputs) as mappings:
+            with zipfile.ZipFile(zip_file, "r") as zp:
+                # ZipFile.extract requires a directory path usually, or careful handling
+                source = zp.open("mappings.tiny")
+                with open(mappings, "wb") as target:
+                    shutil.copyfileobj(source, target)
+        return get_cached_file(key)
+
+
+def get_tiny2_namespaces(tiny_file : str) -> List[str]:
+    with open_cached(tiny_file) as f:
+        header = f.readline()
+        if not header.startswith("tiny"):
+             raise ValueError("Not a valid tiny file")
+        return [ns.strip() for ns in header.split('\t')[3:]]
+
+
+def map_retromcp(
+    version_id: str,
+    target: str,
+    from_ns=None,
+    to_ns=None,
+) -> str:
+    found_version = get_retromcp_version(version_id)
+    rzip = download_cached(found_version["resources"], "resources.zip")
+    
+    v_json_path = download_cached(found_version["url"], "client.json")
+    with open_cached(v_json_path) as f:
+        version_json = json.load(f)
+
+    if target not in version_json["downloads"]:
+        raise IndexError(
+            f"Could not find target: '{target}' in {version_id}, options are: {', '.join(version_json['downloads'].keys())}"
+        )
+
+    jar_entry = version_json["downloads"][target]
+    jar_download = jar_entry["url"]
+    jar_fname = jar_download.split("/")[-1]
+    jar = download_cached(jar_download, jar_fname, jar_entry.get("sha1"), jar_entry.get("size"))
+    
+    tiny = get_retromcp_mapping_from_zip(rzip)
+    namespaces = get_tiny2_namespaces(tiny)
+
+    if from_ns is None:
+        from_ns = "official" if 'official' in namespaces else target
+    if from_ns not in namespaces:
+        raise ValueError(f"Namespace '{from_ns}' not found, options: {', '.join(namespaces)}")
+
+    if to_ns is None:
+        to_ns = "named"
+    if to_ns not in namespaces:
+        raise ValueError(f"Namespace '{to_ns}' not found, options: {', '.join(namespaces)}")
+
+    return map_jar_with_tiny(
+        "mapped-" + jar_fname,
+        jar,
+        tiny,
+        from_ns=from_ns,
+        to_ns=to_ns,
+        ignore_conflicts=True,
+    )
+
+
+
+
+# --- VERSION CATALOG ---
+# Every version listed by the piston, Omni, RetroMCP and Spigot manifests,
+# in the `catalog` table of the cache index. A source is reloaded when its
+# manifest's sha1 changes, so lookups and queries never parse a manifest.
+
+
+class CatalogVersion(NamedTuple):
+    source: str
+    id: str
+    type: Optional[str]
+    released: Optional[float]  # Unix time
+    url: Optional[str]
+
+
+def _manifest_catalog(path: str):
+    with open_cached(path) as f:
+        for version in json.load(f)["versions"]:
+            yield version["id"], version.get("type"), version.get("releaseTime"), version["url"], version
+
+
+def _retromcp_catalog(path: str):
+    with open_cached(path) as f:
+        for version in json.load(f):
+            yield version["id"], version.get("type"), version.get("releaseTime"), version.get("url"), version
+
+
+def _spigot_catalog(path: str):
+    with open_cached(path) as f:
+        lines = f.read().splitlines()
+
+    # Ex: <a href="1.10.2.json">1.10.2.json</a>
+    for line in lines:
+        if line.strip().startswith("<a href=") and ".json" in line:
+            file_name = line.split('"')[1]
+            version_id = file_name.removesuffix(".json")
+            url = "https://hub.spigotmc.org/versions/" + file_name
+            yield version_id, None, None, url, {"id": version_id, "url": url}
+
+
+# Source name: (manifest getter, parser of its versions)
+CATALOG_SOURCES = {
+    "piston": (get_version_manifest, _manifest_catalog),
+    "omni": (get_omni_version_manifest, _manifest_catalog),
+    "retromcp": (get_retromcp_version_list, _retromcp_catalog),
+    "spigot": (get_spigot_version_list, _spigot_catalog),
+}
+
+# Spigot lists no dates, its versions take those of the piston version with the same id
+_CATALOG_RELEASED = "COALESCE(c.released, p.released)"
+_CATALOG_FROM = "FROM catalog c LEFT JOIN catalog p ON p.source = 'piston' AND p.id = c.id WHERE c.source = ?"
+
+
+def _release_time(text: Optional[str]) -> Optional[float]:
+    if not text:
+        return None
+    try:
+        return datetime.fromisoformat(text.replace("Z", "+00:00")).timestamp()
+    except ValueError:
+        return None
+
+
+def _refresh_catalog(source: str):
+    """ Fetches the manifest of source, reloading its versions if it changed since they were """
+    get_manifest, parse = CATALOG_SOURCES[source]
+    path = get_manifest()
+    revision = content_hash(path)
+    row = _index().execute("SELECT revision FROM catalog_sources WHERE source = ?", (source,)).fetchone()
+    if row is not None and row["revision"] == revision:
+        return
+
+    rows = [
+        (source, version_id, version_type, _release_time(released), url, position, json.dumps(data))
+        for position, (version_id, version_type, released, url, data) in enumerate(parse(path))
+    ]
+    with index_transaction() as conn:
+        conn.execute("DELETE FROM catalog WHERE source = ?", (source,))
+        # The first listing of an id wins, as it did when manifests were scanned
+        conn.executemany(
+            "INSERT OR IGNORE INTO catalog (source, id, type, released, url, position, data) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            rows,
+        )
+        conn.execute(
+            "INSERT OR REPLACE INTO catalog_sources (source, revision, loaded) VALUES (?, ?, ?)",
+            (source, revision, time.time()),
+        )
+
+
+def catalog_version(source: str, version_id: str) -> Optional[dict]:
+    """ Entry of version_id in the manifest of source, as listed there """
+    _refresh_catalog(source)
+    row = _index().execute("SELECT data FROM catalog WHERE source = ? AND id = ?", (source, version_id)).fetchone()
+    return json.loads(row["data"]) if row is not None else None
+
+
+def _catalog_released(source: str, version_id: str) -> float:
+    row = _index().execute(
+        f"SELECT {_CATALOG_RELEASED} AS released {_CATALOG_FROM} AND c.id = ?", (source, version_id)
+    ).fetchone()
+    if row is None:
+        raise IndexError("Unable to find version: " + version_id)
+    if row["released"] is None:
+        raise ValueError(f"Version {version_id} has no release time")
+    return row["released"]
+
+
+def query_versions(
+    source: str = "piston",
+    version_type: Optional[str] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+) -> List[CatalogVersion]:
+    """
+    Versions of source, oldest first. Only those of version_type, e.g.
+    "release" or "snapshot", and released between the since and until
+    versions, both included, when given.
+    """
+    _refresh_catalog(source)
+    if source == "spigot":
+        _refresh_catalog("piston")
+
+    query = f"SELECT c.source, c.id, c.type, {_CATALOG_RELEASED} AS released, c.url {_CATALOG_FROM}"
+    params: list = [source]
+    if version_type is not None:
+        query += " AND c.type = ?"
+        params.append(version_type)
+    for bound, op in ((since, ">="), (until, "<=")):
+        if bound is not None:
+            query += f" AND {_CATALOG_RELEASED} {op} ?"
+            params.append(_catalog_released(source, bound))
+    # Manifests list the newest versions first
+    query += f" ORDER BY {_CATALOG_RELEASED}, c.position DESC"
+    return [CatalogVersion(*row) for row in _index().execute(query, params)]
+
+
+def latest_version(source: str = "piston", version_type: Optional[str] = None) -> Optional[CatalogVersion]:
+    """ The newest version of source, of version_type if given """
+    found = query_versions(source, version_type)
+    return found[-1] if found else None
+
+
+def clear_gryla_cache():
+    global _index_generation
+    if exists(STORAGE_DIR):
+        shutil.rmtree(STORAGE_DIR)
+    _index_generation += 1
+
+
+# --- ASYNC ---
+
+# Each call of the async API runs on a thread of its own, with no cap on
+# how many are in flight: downloads wait for the scheduler's per-host
+# slots, and JVM tools for TOOL_JOBS, in the event loop's subprocesses.
+_async_context = threading.local()
+_inflight: Dict[tuple, object] = {}
+
+
+async def _run_tool_async(cmd: List[str], cwd: Optional[str], capture: bool) -> subprocess.CompletedProcess:
+    import asyncio
+
+    pipe = asyncio.subprocess.PIPE if capture else None
+    proc = await asyncio.create_subprocess_exec(*cmd, cwd=cwd, stdout=pipe, stderr=pipe)
+    stdout, stderr = await proc.communicate()
+    return subprocess.CompletedProcess(cmd, cast(int, proc.returncode), stdout, stderr)
+
+
+def _start_in_thread(loop, func: Callable, args: tuple, kwargs: dict):
+    """ Runs func on a new thread, returning a future of loop for its result """
+    fut = loop.create_future()
+
+    def settle(result, ex):
+        if fut.cancelled():
+            return
+        if ex is not None:
+            fut.set_exception(ex)
+        else:
+            fut.set_result(result)
+
+    def run():
+        _async_context.loop = loop
+        try:
+            result, ex = func(*args, **kwargs), None
+        except BaseException as caught:
+            result, ex = None, caught
+        try:
+            loop.call_soon_threadsafe(settle, result, ex)
+        except RuntimeError:
+            # The loop was closed while this ran, nobody is waiting anymore
+            pass
+
+    threading.Thread(target=run, name=f"mcjar-async-{getattr(func, '__name__', 'call')}", daemon=True).start()
+    return fut
+
+
+async def run_async(func: Callable, *args, **kwargs):
+    """
+    Awaitable version of any blocking mcjar function, e.g.
+    `await run_async(map_yarn, "1.20.1", "client")`, run on a thread of
+    its own. Identical concurrent calls with hashable arguments share a
+    single run, and cancelling one waiter leaves it running for the others.
+    """
+    import asyncio
+
+    loop = asyncio.get_running_loop()
+    key = (loop, func, args, tuple(sorted(kwargs.items())))
+    try:
+        fut = _inflight.get(key)
+    except TypeError:
+        # Unhashable arguments, e.g. lists, are never shared
+        return await _start_in_thread(loop, func, args, kwargs)
+    if fut is None:
+        fut = _start_in_thread(loop, func, args, kwargs)
+        _inflight[key] = fut
+        fut.add_done_callback(lambda _: _inflight.pop(key, None))
+    return await asyncio.shield(fut)
+
+
+async def get_piston_file_async(version_id: str, target: str) -> str:
+    return await run_async(get_piston_file, version_id, target)
+
+
+async def get_most_recent_yarn_async(version_id: str) -> Optional[str]:
+    return await run_async(get_most_recent_yarn, version_id)
+
+
+async def map_mojang_async(version_id: str, target: str) -> str:
+    return await run_async(map_mojang, version_id, target)
+
+
+async def map_yarn_async(version_id: str, target: str) -> str:
+    return await run_async(map_yarn, version_id, target)
+
+
+async def map_spigot_async(spigot_version_id: str, force_piston_server_file: bool = False) -> str:
+    return await run_async(map_spigot, spigot_version_id, force_piston_server_file)
+
+
+async def map_retromcp_async(version_id: str, target: str, from_ns=None, to_ns=None) -> str:
+    return await run_async(map_retromcp, version_id, target, from_ns, to_ns)
+
+
+async def build_artifact_async(command: str, version: str, side: str, mappings: str = "yarn") -> Optional[str]:
+    return await run_async(build_artifact, command, version, side, mappings)
+
+
+# --- PREFETCH ---
+class PrefetchItem(NamedTuple):
+    label: str
+    url: str
+    size: Optional[int]
+    cached: bool
+    fetch: Callable[[], object]
+
+
+def _download_item(label: str, url: str, file_name: str, entry: Optional[dict] = None) -> PrefetchItem:
+    """ An artifact fetched through `download_cached` """
+    entry = entry or {}
+    return PrefetchItem(
+        label,
+        url,
+        entry.get("size"),
+        get_cached_file(url_cache_key(url)) is not None,
+        partial(download_cached, url, file_name, entry.get("sha1"), entry.get("size")),
+    )
+
+
+def _plan_version(version: str, sides: List[str], mapping: str) -> List[PrefetchItem]:
+    items = []
+
+    if mapping in ("vanilla", "yarn", "mojang"):
+        with open_cached(get_piston_json_path(version)) as f:
+            downloads = json.load(f)["downloads"]
+
+        targets = list(sides)
+        if mapping == "mojang":
+            targets += [side + "_mappings" for side in sides]
+
+        for target in targets:
+            if target not in downloads:
+                print(f"Warning: {version} has no '{target}' download", file=sys.stderr)
+                continue
+            entry = downloads[target]
+            items.append(PrefetchItem(
+                f"{version} {target}",
+                entry["url"],
+                entry.get("size"),
+                get_cached_file(piston_file_cache_key(version, target)) is not None,
+                partial(get_piston_file, version, target),
+            ))
+
+    if mapping == "yarn":
+        url = get_most_recent_yarn_url(version)
+        if url is None:
+            print(f"Warning: Could not find yarn for version: {version}", file=sys.stderr)
         else:
-            print("Warning: This version lacks member mappings!", file=sys.stderr)
-            shutil.copy(class_mapped, out_path)
+            items.append(PrefetchItem(
+                f"{version} yarn",
+                url,
+                None,
+                get_cached_file(yarn_cache_key(version)) is not None,
+                partial(get_most_recent_yarn, version),
+            ))
+
+    if mapping == "libraries":
+        items.extend(_object_item(obj) for obj in plan_libraries(version))
+
+    if mapping == "assets":
+        _, objects = plan_assets(version)
+        items.extend(_object_item(obj) for obj in objects)
+
+    if mapping == "retromcp":
+        found = get_retromcp_version(version)
+        items.append(_download_item(f"{version} RetroMCP resources", found["resources"], "resources.zip"))
+        with open_cached(download_cached(found["url"], "client.json")) as f:
+            downloads = json.load(f)["downloads"]
+        for side in sides:
+            if side in downloads:
+                url = downloads[side]["url"]
+                items.append(_download_item(f"{version} {side} (RetroMCP)", url, url.split("/")[-1], downloads[side]))
+
+    if mapping == "spigot":
+        found = catalog_version("spigot", version)
+        if found is None:
+            raise ValueError(f"Invalid spigot version: {version}")
+        items.append(_download_item(f"{version} Spigot build info", found["url"], version + ".json"))
+
+    return items
+
+
+def _tool_item(label: str, url: str, file_name: str) -> PrefetchItem:
+    """ A tool jar, pinned like `_get_tool` does, so gc keeps it for offline runs """
+    item = _download_item(label, url, file_name, {"sha1": tool_sha1(url, fetch=False)})
+    if item.cached:
+        pin_cache_entry(url_cache_key(url))
+    return item._replace(fetch=partial(_get_tool, url, file_name))
+
+
+def plan_prefetch(
+    versions: List[str], sides: List[str], mappings: List[str], max_workers: int = DEFAULT_JOBS
+) -> Tuple[List[PrefetchItem], List[str]]:
+    """
+    Lists every artifact needed to get/remap versions with the given
+    mappings ("vanilla" for plain jars). Version metadata needed to know
+    what to fetch, such as piston JSONs, is fetched into the cache along
+    the way. Returns the items and the errors met while planning.
+    """
+    items = [
+        _tool_item("CFR", CFR_URL, "cfr.jar"),
+        _tool_item("Tiny Remapper", REMAPPER_URL, "remapper.jar"),
+    ]
+    if "mojang" in mappings:
+        items.append(_tool_item("mapping-io", MAPPINGIO_URL, "mapping-io-cli.jar"))
+    if "spigot" in mappings:
+        items.append(_tool_item("SpecialSource-2", SPECIAL_SOURCE2_URL, "SpecialSource-2.jar"))
+        build_data = join(STORAGE_DIR, "spigot_build_data", "BuildData")
+        items.append(PrefetchItem(
+            "Spigot BuildData", SPIGOT_BUILD_DATA_GIT,
+            None, exists(build_data), get_spigot_build_data_path,
+        ))
+
+    errors = []
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+        futures = {
+            pool.submit(_plan_version, v, sides, m): (v, m) for v in versions for m in mappings
+        }
+        for fut in as_completed(futures):
+            try:
+                items.extend(fut.result())
+            except Exception as ex:
+                version, mapping = futures[fut]
+                errors.append(f"{version} ({mapping}): {ex}")
+
+    # Drop duplicates, e.g. a jar shared by several mapping types or versions
+    unique = {}
+    for item in items:
+        unique.setdefault(item.url, item)
+    return list(unique.values()), errors
+
+
+def remote_size(url: str) -> Optional[int]:
+    """ Content-Length of url from a HEAD request, if the server reports it """
+    source = source_candidates(url)[0]
+    if is_local_url(source):
+        path = local_url_path(source)
+        return os.path.getsize(path) if exists(path) else None
+    if OFFLINE:
+        return None
+    try:
+        resp = http_request("HEAD", source)
+    except _transfer_errors():
+        return None
+    size = resp.headers.get("Content-Length")
+    return int(size) if resp.status == 200 and size else None
+
+
+def prefetch(items: List[PrefetchItem], max_workers: int = DEFAULT_JOBS, quiet: bool = False) -> List[str]:
+    """ Fetches every missing item concurrently, returning the errors met """
+    errors = []
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+        futures = {
+            pool.submit(SCHEDULER.run_as, item.label, item.fetch): item
+            for item in items
+            if not item.cached
+        }
+        for fut in as_completed(futures):
+            item = futures[fut]
+            try:
+                fut.result()
+                if not quiet:
+                    print(f"Fetched: {item.label}")
+            except Exception as ex:
+                errors.append(f"{item.label}: {ex}")
+    return errors
+
+
+def print_prefetch_plan(items: List[PrefetchItem], max_workers: int = DEFAULT_JOBS):
+    missing = [item for item in items if not item.cached]
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+        sizes = list(pool.map(lambda i: i.size if i.size is not None else remote_size(i.url), missing))
+
+    for item, size in zip(missing, sizes):
+        print(f"{sizeof_fmt(size) if size is not None else '?':>10}  {item.label}  {item.url}")
+
+    known = [size for size in sizes if size is not None]
+    unknown = len(sizes) - len(known)
+    print(
+        f"Would fetch {len(missing)} file(s), {sizeof_fmt(sum(known))}"
+        + (f" + {unknown} of unknown size" if unknown else "")
+        + f" ({len(items) - len(missing)} already cached)"
+    )
 
-        if "finalMapCommand" in info_json:
-            # We need to map from 'out_path' to a temp file, then move back
-            run_spigot_map_command(
-                data_path,
-                info_json["finalMapCommand"],
-                out_path, # In
-                join(data_path, "mappings", info_json["accessTransforms"]),
-                join(data_path, "mappings", info_json["classMappings"]),
-                final_mapped, # Out
-            )
-            shutil.copy(final_mapped, out_path)
-            
-    return out_path
 
+# --- LIBRARIES AND ASSETS ---
 
-def get_retromcp_versions() -> list[dict]:
-    with open(
-        download_cached(
-            "https://mcphackers.org/versionsV3/versions.json", "versions.json"
-        )
-    ) as f:
-        return json.load(f)
+ASSETS_BASE = "https://resources.download.minecraft.net/"
 
 
-def get_retromcp_version(version_id: str):
-    for version in get_retromcp_versions():
-        if version_id == version["id"]:
-            return version
-    raise IndexError(f"Could not find version {version_id} in RetroMCP")
+class StoreObject(NamedTuple):
+    """ A file of the content-addressed store, and where it goes in a launcher layout """
+    path: str
+    url: str
+    sha1: str
+    size: Optional[int]
 
 
-def get_retromcp_mapping_from_zip(zip_file: str) -> str:
-    key = sha1(f"RETROMCP ZIP: {zip_file}".encode("utf-8")).hexdigest()
-    if path := get_cached_file(key):
-        return path
+def get_objects_dir() -> str:
+    return join(STORAGE_DIR, "objects")
 
-    mappings = make_cache_file(key, "mappings.tiny")
-    with urllib3.zipfile.ZipFile(zip_file, "r") as zp:
-        # ZipFile.extract requires a directory path usually, or careful handling
-        source = zp.open("mappings.tiny")
-        with open(mappings, "wb") as target:
-            shutil.copyfileobj(source, target)
-    return mappings
 
+def object_path(sha1_hex: str) -> str:
+    sha1_hex = sha1_hex.lower()
+    return join(get_objects_dir(), sha1_hex[:2], sha1_hex)
 
-def get_tiny2_namespaces(tiny_file : str) -> List[str]:
-    with open(tiny_file, 'r') as f:
-        header = f.readline()
-        if not header.startswith("tiny"):
-             raise ValueError("Not a valid tiny file")
-        return [ns.strip() for ns in header.split('\t')[3:]]
 
+def get_object(url: str, sha1_hex: str, size: Optional[int] = None) -> str:
+    """
+    Path of the object with the given sha1 in the store, downloaded from
+    url if missing. Objects are only moved in place once their hash has
+    been checked, so files shared by many versions are fetched once.
+    """
+    path = object_path(sha1_hex)
+    with cache_lock("OBJECT: " + sha1_hex.lower()):
+        if exists(path):
+            touch_objects([sha1_hex])
+            return path
+        os.makedirs(dirname(path), exist_ok=True)
+        download_file(url, path, output=False, expected_sha1=sha1_hex, expected_size=size, mark=False)
+        record_object(sha1_hex, os.path.getsize(path))
+    _auto_gc()
+    return path
 
-def map_retromcp(
-    version_id: str,
-    target: str,
-    from_ns=None,
-    to_ns=None,
-) -> str:
-    found_version = get_retromcp_version(version_id)
-    rzip = download_cached(found_version["resources"], "resources.zip")
-    
-    v_json_path = download_cached(found_version["url"], "client.json")
-    with open(v_json_path) as f:
-        version_json = json.load(f)
 
-    if target not in version_json["downloads"]:
-        raise IndexError(
-            f"Could not find target: '{target}' in {version_id}, options are: {', '.join(version_json['downloads'].keys())}"
+def _object_item(obj: StoreObject) -> PrefetchItem:
+    return PrefetchItem(obj.path, obj.url, obj.size, exists(object_path(obj.sha1)), partial(get_object, obj.url, obj.sha1, obj.size))
+
+
+def current_os_name() -> str:
+    """ The OS name used by version JSON rules """
+    return {"Windows": "windows", "Darwin": "osx"}.get(platform.system(), "linux")
+
+
+def _rules_allow(rules: Optional[List[dict]], os_name: Optional[str]) -> bool:
+    """ Evaluates version JSON rules, os_name=None allowing every OS """
+    if not rules:
+        return True
+    allowed = False
+    for rule in rules:
+        if "features" in rule:
+            continue
+        wanted = rule.get("os", {}).get("name")
+        if os_name is None and wanted is not None and rule["action"] == "disallow":
+            # Only excludes that OS
+            continue
+        if wanted is None or os_name is None or wanted == os_name:
+            allowed = rule["action"] == "allow"
+    return allowed
+
+
+def plan_libraries(version_id: str, os_name: Optional[str] = None) -> List[StoreObject]:
+    """
+    Libraries of a version, natives included, for os_name (default: this
+    OS, "all" for every OS). Paths are relative to a maven `libraries` dir.
+    """
+    if os_name is None:
+        os_name = current_os_name()
+    every_os = os_name == "all"
+
+    with open_cached(get_piston_json_path(version_id)) as f:
+        libraries = json.load(f).get("libraries", [])
+
+    objects = []
+    for lib in libraries:
+        if not _rules_allow(lib.get("rules"), None if every_os else os_name):
+            continue
+        downloads = lib.get("downloads", {})
+        artifacts = [downloads["artifact"]] if "artifact" in downloads else []
+
+        natives = lib.get("natives", {})
+        classifiers = downloads.get("classifiers", {})
+        for native_os, classifier in natives.items():
+            if every_os or native_os == os_name:
+                classifier = classifier.replace("${arch}", "64")
+                if classifier in classifiers:
+                    artifacts.append(classifiers[classifier])
+
+        for artifact in artifacts:
+            if artifact.get("url") and artifact.get("sha1"):
+                objects.append(StoreObject(artifact["path"], artifact["url"], artifact["sha1"], artifact.get("size")))
+    return objects
+
+
+def plan_assets(version_id: str) -> Tuple[str, List[StoreObject]]:
+    """
+    Asset index id of a version, and its assets with paths relative to an
+    `assets` dir. The index itself is fetched into the store to read it.
+    """
+    with open_cached(get_piston_json_path(version_id)) as f:
+        index = json.load(f).get("assetIndex")
+    if index is None:
+        raise IndexError(f"{version_id} has no asset index")
+
+    index_path = get_object(index["url"], index["sha1"], index.get("size"))
+    objects = [StoreObject(f"indexes/{index['id']}.json", index["url"], index["sha1"], index.get("size"))]
+    with open(index_path) as f:
+        assets = json.load(f)["objects"]
+
+    for asset in assets.values():
+        hash_ = asset["hash"]
+        path = f"{hash_[:2]}/{hash_}"
+        objects.append(StoreObject("objects/" + path, ASSETS_BASE + path, hash_, asset.get("size")))
+    return index["id"], objects
+
+
+def export_objects(objects: List[StoreObject], dest: str) -> int:
+    """
+    Lays out store objects under dest at their paths, linked as
+    `deliver_file` does. Returns how many files were added.
+    """
+    added = 0
+    for obj in objects:
+        out = join(dest, *obj.path.split("/"))
+        if exists(out):
+            continue
+        os.makedirs(dirname(out), exist_ok=True)
+        deliver_file(object_path(obj.sha1), out)
+        added += 1
+    return added
+
+
+def fetch_objects(objects: List[StoreObject], max_workers: int = DEFAULT_JOBS) -> List[str]:
+    """ Fetches every missing object concurrently, returning the errors met """
+    unique = {obj.sha1: _object_item(obj) for obj in objects}
+    missing = [item for item in unique.values() if not item.cached]
+    touch_objects([sha1_hex for sha1_hex, item in unique.items() if item.cached])
+    if missing:
+        print(f"Fetching {len(missing)} of {len(unique)} file(s)", file=sys.stderr)
+    return prefetch(missing, max_workers, quiet=True)
+
+
+# --- SCRUB ---
+# `scrub_cache` rehashes every file of the cache and compares it with the
+# sha1 it should have. Bad files are moved to STORAGE_DIR/quarantine, and
+# sound ones are remembered by size and mtime so that the next scrub can
+# skip them.
+
+
+def get_quarantine_dir() -> str:
+    return join(STORAGE_DIR, "quarantine")
+
+
+class ScrubResult(NamedTuple):
+    path: str
+    status: str  # "ok", "skipped", "corrupt" or "busy"
+    reason: Optional[str] = None
+
+
+def _published_sha1s() -> Dict[str, str]:
+    """ sha1 of each download URL, as published by the cached version JSONs or pinned """
+    published = {}
+    for row in _index().execute("SELECT key, name FROM entries WHERE name IN ('client.json', 'client.json.mcjar.gz')"):
+        try:
+            with open_cached(cache_path(row["key"], row["name"])) as f:
+                downloads = json.load(f).get("downloads", {})
+        except (OSError, ValueError, EOFError):
+            # Caught by the scrub of the JSON itself
+            continue
+        for entry in downloads.values():
+            if isinstance(entry, dict) and entry.get("url") and entry.get("sha1"):
+                published[entry["url"]] = entry["sha1"].lower()
+    published.update(TOOL_SHA1S)
+    for url in TOOL_SHA1_URLS:
+        try:
+            if digest := tool_sha1(url, fetch=False):
+                published[url] = digest
+        except (OSError, ValueError, EOFError):
+            # Caught by the scrub of the checksum file itself
+            continue
+    return published
+
+
+def _scrub_known(rel: str, size: int, mtime_ns: int) -> bool:
+    row = _index().execute("SELECT size, mtime_ns FROM scrubbed WHERE path = ?", (rel,)).fetchone()
+    return row is not None and row["size"] == size and row["mtime_ns"] == mtime_ns
+
+
+def _scrub_passed(rel: str, size: int, mtime_ns: int):
+    _index().execute(
+        "INSERT OR REPLACE INTO scrubbed (path, size, mtime_ns, checked) VALUES (?, ?, ?, ?)",
+        (rel, size, mtime_ns, time.time()),
+    )
+
+
+def _quarantine(path: str, rel: str, info: dict):
+    """ Moves a bad file out of the cache, next to a note saying why """
+    folder = get_quarantine_dir()
+    os.makedirs(folder, exist_ok=True)
+    name = rel.replace("/", "-").replace(os.sep, "-")
+    os.replace(path, join(folder, name))
+    with open(join(folder, name + ".json"), "w") as f:
+        json.dump(dict(info, path=rel, quarantined=time.time()), f, indent=1)
+    _index().execute("DELETE FROM scrubbed WHERE path = ?", (rel,))
+
+
+def _scrub_entry(row, published: Optional[str], full: bool) -> ScrubResult:
+    """ Checks one entry against its recorded sha1, and the published one for downloads """
+    path = cache_path(row["key"], row["name"])
+    rel = f"{row['key']}/{row['name']}"
+    with cache_lock(row["key"], blocking=False) as locked:
+        if not locked:
+            return ScrubResult(path, "busy")
+        try:
+            st = os.stat(path)
+        except OSError:
+            return _scrub_stored_jar(row, path, full)
+        if not full and _scrub_known(rel, st.st_size, st.st_mtime_ns):
+            return ScrubResult(path, "skipped")
+
+        digest = content_sha1(path)
+        reason = None
+        if row["sha1"] and digest != row["sha1"]:
+            reason = f"sha1 is {digest}, {row['sha1']} was recorded"
+        elif published and digest != published:
+            reason = f"sha1 is {digest}, {published} is published"
+        if reason is None:
+            if not row["sha1"]:
+                # Made before hashes were recorded, this one becomes the reference
+                _index().execute(
+                    "UPDATE entries SET sha1 = ?, verified_mtime_ns = ? WHERE key = ?",
+                    (digest, st.st_mtime_ns, row["key"]),
+                )
+            _scrub_passed(rel, st.st_size, st.st_mtime_ns)
+            return ScrubResult(path, "ok")
+
+        # A blob shares the bad content, so it goes too
+        blob = linked_blob(path)
+        _quarantine(path, rel, {"origin": row["origin"], "expected": published or row["sha1"], "reason": reason})
+        if blob:
+            try:
+                os.remove(blob)
+                forget_object(basename(blob))
+            except FileNotFoundError:
+                # The object scrub got to it first
+                pass
+        _index().execute("DELETE FROM entries WHERE key = ?", (row["key"],))
+        shutil.rmtree(join(STORAGE_DIR, row["key"]), ignore_errors=True)
+        return ScrubResult(path, "corrupt", reason)
+
+
+def _scrub_stored_jar(row, path: str, full: bool) -> ScrubResult:
+    """ Checks that a dehydrated entry still rebuilds to its sha1 """
+    if not (row["sha1"] and jar_store_has(row["sha1"])):
+        return ScrubResult(path, "skipped")
+    # Stored jars never change, so any earlier pass stands
+    rel = f"jars.sqlite/{row['sha1']}"
+    if not full and _scrub_known(rel, 0, 0):
+        return ScrubResult(path, "skipped")
+    try:
+        digest = jar_store_sha1(row["sha1"])
+    except (IndexError, zlib.error) as ex:
+        digest = str(ex)
+    if digest == row["sha1"]:
+        _scrub_passed(rel, 0, 0)
+        return ScrubResult(path, "ok")
+
+    reason = f"class store rebuilds it as {digest}"
+    _jar_db().execute("DELETE FROM jars WHERE sha1 = ?", (row["sha1"],))
+    _index().execute("DELETE FROM entries WHERE key = ?", (row["key"],))
+    return ScrubResult(path, "corrupt", reason)
+
+
+def _scrub_object(path: str, full: bool) -> ScrubResult:
+    """ Checks that a store object is named after its sha1 """
+    rel = os.path.relpath(path, STORAGE_DIR).replace(os.sep, "/")
+    sha1_hex = basename(path)
+    with cache_lock("OBJECT: " + sha1_hex, blocking=False) as locked:
+        if not locked:
+            return ScrubResult(path, "busy")
+        try:
+            st = os.stat(path)
+        except OSError:
+            return ScrubResult(path, "skipped")
+        if not full and _scrub_known(rel, st.st_size, st.st_mtime_ns):
+            return ScrubResult(path, "skipped")
+        digest = file_sha1(path)
+        if digest == sha1_hex:
+            _scrub_passed(rel, st.st_size, st.st_mtime_ns)
+            return ScrubResult(path, "ok")
+        reason = f"sha1 is {digest}"
+        _quarantine(path, rel, {"expected": sha1_hex, "reason": reason})
+        forget_object(sha1_hex)
+        return ScrubResult(path, "corrupt", reason)
+
+
+def scrub_cache(
+    pattern: Optional[str] = None, full: bool = False, max_workers: Optional[int] = None
+) -> List[ScrubResult]:
+    """
+    Rehashes the cache entries matching pattern, and the whole object store
+    without one, on a thread pool (hashing runs outside the GIL). Entries
+    are checked against their recorded sha1, which downloads had verified
+    against the published one, and piston downloads against the cached
+    version JSONs too. Tool jars are checked against their `tool_sha1`
+    where they are pinned. Files unchanged since they last passed are skipped
+    unless full. Bad files are quarantined and their entries dropped, so
+    they are fetched or rebuilt on their next use.
+    """
+    published = _published_sha1s()
+    jobs = [
+        partial(_scrub_entry, row, published.get(row["origin"] or ""), full) for row in cache_entries(pattern)
+    ]
+    objects_dir = get_objects_dir()
+    if pattern is None and exists(objects_dir):
+        for folder in sorted(os.listdir(objects_dir)):
+            for name in sorted(os.listdir(join(objects_dir, folder))):
+                if len(name) == 40:
+                    jobs.append(partial(_scrub_object, join(objects_dir, folder, name), full))
+
+    with ThreadPoolExecutor(max_workers=max_workers or os.cpu_count() or 1) as pool:
+        return list(pool.map(lambda job: job(), jobs))
+
+
+# --- CACHE BUNDLES ---
+# A bundle is a tar stream of manifest.json, describing its entries, then
+# entries/<key>/<name> for each of them. Keys do not depend on where the
+# cache lives, so bundles restore on any machine.
+
+BUNDLE_FORMAT = 1
+
+
+def bundle_keys(jobs: List[Tuple[str, str, str, str]], max_workers: int = DEFAULT_JOBS) -> Tuple[set, List[str]]:
+    """
+    Keys of every entry the `build_artifact` jobs need, producing those
+    missing first. Returns them with the errors met.
+    """
+    errors = []
+    with record_cache_keys() as keys:
+        for (_, version, side, _), _, ex in run_jobs(jobs, max_workers):
+            if ex is not None:
+                errors.append(f"{version} {side}: {ex}")
+    return keys, errors
+
+
+def pack_cache(keys: List[str], stream) -> Tuple[int, int]:
+    """
+    Writes the entries with the given keys to stream as a bundle, without
+    seeking, so stream can be a pipe. Returns how many entries and bytes
+    were packed.
+    """
+    entries = []
+    for key in sorted(set(keys)):
+        row = _index().execute("SELECT * FROM entries WHERE key = ?", (key,)).fetchone()
+        if row is None or get_cached_file(key) is None:
+            continue
+        path = cache_path(key, row["name"])
+        entries.append(
+            {
+                "key": key,
+                "name": row["name"],
+                "origin": row["origin"],
+                "size": os.path.getsize(path),
+                "sha1": content_hash(path),
+                "cost": row["cost"],
+                "pinned": bool(row["pinned"]),
+                "meta": json.loads(row["meta"]),
+            }
         )
 
-    jar_download = version_json["downloads"][target]["url"]
-    jar_fname = jar_download.split("/")[-1]
-    jar = download_cached(jar_download, jar_fname)
-    
-    tiny = get_retromcp_mapping_from_zip(rzip)
-    namespaces = get_tiny2_namespaces(tiny)
+    manifest = json.dumps({"format": BUNDLE_FORMAT, "created": time.time(), "entries": entries}, indent=1).encode()
+    with tarfile.open(fileobj=stream, mode="w|") as tar:
+        info = tarfile.TarInfo("manifest.json")
+        info.size, info.mtime = len(manifest), int(time.time())
+        tar.addfile(info, io.BytesIO(manifest))
+
+        for entry in entries:
+            info = tarfile.TarInfo(f"entries/{entry['key']}/{entry['name']}")
+            with open(cache_path(entry["key"], entry["name"]), "rb") as f:
+                st = os.fstat(f.fileno())
+                if st.st_size != entry["size"]:
+                    raise RuntimeError(f"{entry['name']} changed while packing")
+                info.size, info.mtime = st.st_size, int(st.st_mtime)
+                tar.addfile(info, f)
+    return len(entries), sum(entry["size"] for entry in entries)
+
+
+def _restore_entry(entry: dict, staged: str):
+    """ Checks a file extracted from a bundle and publishes it as its entry """
+    try:
+        digest = content_sha1(staged)
+        if digest != entry["sha1"]:
+            raise ValueError(f"{entry['name']} does not match its sha1 (expected {entry['sha1']}, got {digest})")
+        with cache_lock(entry["key"]):
+            with new_cache_file(entry["key"], entry["name"], entry.get("origin")) as tmp:
+                os.replace(staged, tmp)
+                mark_verified(tmp, digest)
+            write_cache_meta(entry["key"], entry.get("meta") or {})
+            _index().execute(
+                "UPDATE entries SET cost = COALESCE(?, cost), pinned = ? WHERE key = ?",
+                (entry.get("cost"), int(entry.get("pinned", False)), entry["key"]),
+            )
+    finally:
+        if exists(staged):
+            os.remove(staged)
 
-    if from_ns is None:
-        from_ns = "official" if 'official' in namespaces else target
-    if from_ns not in namespaces:
-        raise ValueError(f"Namespace '{from_ns}' not found, options: {', '.join(namespaces)}")
 
-    if to_ns is None:
-        to_ns = "named"
-    if to_ns not in namespaces:
-        raise ValueError(f"Namespace '{to_ns}' not found, options: {', '.join(namespaces)}")
+def _is_bundle_entry(entry: dict) -> bool:
+    """ Whether a bundle manifest entry names a file inside its own entry directory """
+    key, name, sha1_hex = entry.get("key"), entry.get("name"), entry.get("sha1")
+    if not (isinstance(key, str) and isinstance(name, str) and isinstance(sha1_hex, str)):
+        return False
+    return is_cache_key(key) and is_entry_name(name) and is_cache_key(sha1_hex)
 
-    return map_jar_with_tiny(
-        "mapped-" + jar_fname,
-        jar,
-        tiny,
-        from_ns=from_ns,
-        to_ns=to_ns,
-        ignore_conflicts=True,
+
+def unpack_cache(stream, max_workers: int = DEFAULT_JOBS) -> Tuple[int, int, List[str]]:
+    """
+    Imports a bundle read from stream, skipping the entries already cached.
+    Files are extracted in order while the previous ones are hashed and
+    published on a thread pool. Returns how many entries were added and
+    skipped, and the errors met.
+    """
+    added, skipped, errors = 0, 0, []
+    os.makedirs(STORAGE_DIR, exist_ok=True)
+    staging = tempfile.mkdtemp(prefix=".unpack-", dir=STORAGE_DIR)
+
+    with tarfile.open(fileobj=stream, mode="r|*") as tar, ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+        entries = None
+        futures = []
+        for member in tar:
+            if entries is None:
+                if member.name != "manifest.json":
+                    raise ValueError("Not an mcjar cache bundle: it does not start with manifest.json")
+                manifest = json.load(tar.extractfile(member))
+                if manifest.get("format") != BUNDLE_FORMAT:
+                    raise ValueError(f"Unsupported bundle format {manifest.get('format')}")
+                # Only entries the manifest describes are read, named after
+                # their key and name there rather than the member path
+                entries = {}
+                for entry in manifest["entries"]:
+                    if _is_bundle_entry(entry):
+                        entries[f"entries/{entry['key']}/{entry['name']}"] = entry
+                    else:
+                        errors.append(f"Invalid bundle entry {entry.get('key')!r}/{entry.get('name')!r}")
+                continue
+
+            entry = entries.get(member.name)
+            if entry is None or not member.isfile():
+                continue
+            path = get_cached_file(entry["key"])
+            if path and basename(path) == entry["name"] and is_verified(path, entry["sha1"]):
+                skipped += 1
+                continue
+
+            # Named like the entry, so compressed ones are hashed on their content
+            staged = join(staging, f"{entry['key']}-{entry['name']}")
+            with open(staged, "wb") as f:
+                shutil.copyfileobj(tar.extractfile(member), f)
+            futures.append(pool.submit(_restore_entry, entry, staged))
+
+        for fut in futures:
+            try:
+                fut.result()
+                added += 1
+            except Exception as ex:
+                errors.append(str(ex))
+
+    shutil.rmtree(staging, ignore_errors=True)
+    return added, skipped, errors
+
+
+# --- JAR STORE ---
+# Jars of nearby versions share most of their classes. The class store
+# (STORAGE_DIR/jars.sqlite) keeps the compressed data of each distinct zip
+# entry once, plus per jar its layout and the remaining bytes (headers and
+# central directory), so jars can be rebuilt byte for byte on demand.
+
+_jar_db_local = threading.local()
+
+
+def get_jar_store_path() -> str:
+    return join(STORAGE_DIR, "jars.sqlite")
+
+
+def _jar_db():
+    """ This thread's connection to the class store, created on first use """
+    conn = getattr(_jar_db_local, "conn", None)
+    if conn is not None and _jar_db_local.generation == _index_generation:
+        return conn
+
+    import sqlite3
+
+    os.makedirs(STORAGE_DIR, exist_ok=True)
+    conn = sqlite3.connect(get_jar_store_path(), timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("CREATE TABLE IF NOT EXISTS chunks (hash TEXT PRIMARY KEY, data BLOB NOT NULL)")
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS jars (
+            sha1 TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            layout BLOB NOT NULL,
+            gaps BLOB NOT NULL,
+            created REAL NOT NULL
+        )
+        """
     )
+    _jar_db_local.conn = conn
+    _jar_db_local.generation = _index_generation
+    return conn
+
+
+def _jar_spans(path: str) -> List[Tuple[int, zipfile.ZipInfo]]:
+    """ Offset of the compressed data of each zip entry, in file order """
+    spans = []
+    with zipfile.ZipFile(path) as zf, open(path, "rb") as f:
+        for info in zf.infolist():
+            f.seek(info.header_offset)
+            header = f.read(30)
+            if len(header) < 30 or header[:4] != b"PK\x03\x04":
+                raise ValueError(f"Bad local header for {info.filename} in {basename(path)}")
+            name_length, extra_length = struct.unpack("<HH", header[26:30])
+            spans.append((info.header_offset + 30 + name_length + extra_length, info))
+    spans.sort(key=lambda span: span[0])
+
+    end = 0
+    for start, info in spans:
+        if start < end:
+            raise ValueError(f"Overlapping entries in {basename(path)}")
+        end = start + info.compress_size
+    return spans
+
+
+def jar_store_has(sha1_hex: str) -> bool:
+    if not exists(get_jar_store_path()):
+        return False
+    return _jar_db().execute("SELECT 1 FROM jars WHERE sha1 = ?", (sha1_hex,)).fetchone() is not None
+
+
+def jar_store_add(path: str, sha1_hex: Optional[str] = None) -> str:
+    """ Adds a jar to the class store, returning its sha1 """
+    sha1_hex = sha1_hex or file_sha1(path)
+    if jar_store_has(sha1_hex):
+        return sha1_hex
+
+    spans = _jar_spans(path)
+    db = _jar_db()
+    layout = []
+    gaps = io.BytesIO()
+    with open(path, "rb") as f:
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            for start, info in spans:
+                gaps.write(f.read(start - f.tell()))
+                data = f.read(info.compress_size)
+                chunk = sha1(data).hexdigest()
+                db.execute("INSERT OR IGNORE INTO chunks (hash, data) VALUES (?, ?)", (chunk, data))
+                layout.append([info.filename, start, info.compress_size, chunk, info.CRC, info.file_size, info.compress_type])
+            gaps.write(f.read())
+            db.execute(
+                "INSERT OR IGNORE INTO jars (sha1, size, layout, gaps, created) VALUES (?, ?, ?, ?, ?)",
+                (
+                    sha1_hex,
+                    f.tell(),
+                    zlib.compress(json.dumps(layout).encode()),
+                    zlib.compress(gaps.getvalue()),
+                    time.time(),
+                ),
+            )
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+    return sha1_hex
+
+
+def _jar_layout(sha1_hex: str) -> Tuple[list, bytes]:
+    row = _jar_db().execute("SELECT layout, gaps FROM jars WHERE sha1 = ?", (sha1_hex,)).fetchone()
+    if row is None:
+        raise IndexError(f"No jar {sha1_hex} in the class store")
+    return json.loads(zlib.decompress(row["layout"])), zlib.decompress(row["gaps"])
+
+
+def _jar_chunk(chunk: str) -> bytes:
+    row = _jar_db().execute("SELECT data FROM chunks WHERE hash = ?", (chunk,)).fetchone()
+    if row is None:
+        raise IndexError(f"Class store chunk {chunk} is missing")
+    return row["data"]
+
+
+def _jar_pieces(sha1_hex: str):
+    """ The bytes of a stored jar, in order """
+    layout, gaps = _jar_layout(sha1_hex)
+    pos = gap = 0
+    for _, start, length, chunk, *_ in layout:
+        yield gaps[gap : gap + start - pos]
+        gap += start - pos
+        yield _jar_chunk(chunk)
+        pos = start + length
+    yield gaps[gap:]
+
+
+def jar_store_sha1(sha1_hex: str) -> str:
+    """ sha1 of the jar the class store would rebuild """
+    digest = sha1()
+    for piece in _jar_pieces(sha1_hex):
+        digest.update(piece)
+    return digest.hexdigest()
+
+
+def rebuild_jar(sha1_hex: str, dest: str) -> str:
+    """ Writes a jar from the class store to dest, checking its sha1 """
+    part = join(dirname(abspath(dest)), f".{basename(dest)}.part")
+    digest = sha1()
+    try:
+        with open(part, "wb") as f:
+            for piece in _jar_pieces(sha1_hex):
+                digest.update(piece)
+                f.write(piece)
+        if digest.hexdigest() != sha1_hex:
+            raise ValueError(f"Rebuilt {basename(dest)} does not match its sha1")
+        os.replace(part, dest)
+    finally:
+        if exists(part):
+            os.remove(part)
+    return dest
+
+
+def jar_manifest(sha1_hex: str) -> List[dict]:
+    """
+    The entries of a stored jar, for tools that read classes straight from
+    the store with `read_jar_entry` instead of a rebuilt jar.
+    """
+    return [
+        {"name": name, "crc": crc, "size": size, "compressed_size": length, "method": method, "chunk": chunk}
+        for name, _, length, chunk, crc, size, method in _jar_layout(sha1_hex)[0]
+    ]
 
 
+def read_jar_entry(sha1_hex: str, name: str) -> bytes:
+    """ The uncompressed content of one entry of a stored jar """
+    for entry in jar_manifest(sha1_hex):
+        if entry["name"] == name:
+            data = _jar_chunk(entry["chunk"])
+            if entry["method"] == zipfile.ZIP_DEFLATED:
+                data = zlib.decompress(data, -15)
+            elif entry["method"] != zipfile.ZIP_STORED:
+                raise ValueError(f"Unsupported compression method {entry['method']} for {name}")
+            if zlib.crc32(data) != entry["crc"]:
+                raise ValueError(f"{name} does not match its CRC")
+            return data
+    raise IndexError(f"No entry {name} in jar {sha1_hex}")
 
 
-def clear_gryla_cache():
-    shutil.rmtree(STORAGE_DIR)
+def dehydrate_entry(cache_key: str) -> bool:
+    """
+    Moves a jar entry into the class store, leaving its index row so that
+    `get_cached_file` rebuilds it on its next use. To be used under
+    cache_lock(cache_key). Returns whether the entry was moved.
+    """
+    row = _index().execute("SELECT name FROM entries WHERE key = ?", (cache_key,)).fetchone()
+    if row is None or not row["name"].endswith(".jar"):
+        return False
+    path = cache_path(cache_key, row["name"])
+    if not exists(path):
+        return False
+    digest = content_hash(path)
+    try:
+        jar_store_add(path, digest)
+    except (zipfile.BadZipFile, ValueError) as ex:
+        print(f"Warning: cannot store {row['name']} by class ({ex})", file=sys.stderr)
+        return False
+    # Only let go of the file once it is known to come back identical
+    if jar_store_sha1(digest) != digest:
+        raise RuntimeError(f"Class store cannot rebuild {row['name']}")
+
+    blob = linked_blob(path)
+    os.remove(path)
+    if blob:
+        release_blob(blob)
+    _index().execute("UPDATE entries SET sha1 = ?, verified_mtime_ns = NULL WHERE key = ?", (digest, cache_key))
+    return True
+
+
+def _rehydrate_entry(cache_key: str, path: str, sha1_hex: str) -> os.stat_result:
+    """ Rebuilds a dehydrated entry at path """
+    with cache_lock(cache_key):
+        if not exists(path):
+            rebuild_jar(sha1_hex, path)
+            st = link_blob(path, sha1_hex)
+            _index().execute(
+                "UPDATE entries SET size = ?, verified_mtime_ns = ? WHERE key = ?",
+                (st.st_size, st.st_mtime_ns, cache_key),
+            )
+        return os.stat(path)
+
+
+def prune_jar_store() -> int:
+    """ Drops the stored jars no cache entry refers to anymore, and their unshared chunks """
+    if not exists(get_jar_store_path()):
+        return 0
+    referenced = {row["sha1"] for row in _index().execute("SELECT sha1 FROM entries WHERE sha1 IS NOT NULL")}
+    db = _jar_db()
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        dropped = [row["sha1"] for row in db.execute("SELECT sha1 FROM jars") if row["sha1"] not in referenced]
+        if dropped:
+            db.executemany("DELETE FROM jars WHERE sha1 = ?", [(sha,) for sha in dropped])
+            used = set()
+            for row in db.execute("SELECT layout FROM jars"):
+                used.update(entry[3] for entry in json.loads(zlib.decompress(row["layout"])))
+            db.execute("CREATE TEMP TABLE IF NOT EXISTS used_chunks (hash TEXT PRIMARY KEY)")
+            db.execute("DELETE FROM used_chunks")
+            db.executemany("INSERT INTO used_chunks (hash) VALUES (?)", [(chunk,) for chunk in used])
+            db.execute("DELETE FROM chunks WHERE hash NOT IN (SELECT hash FROM used_chunks)")
+    except BaseException:
+        db.execute("ROLLBACK")
+        raise
+    db.execute("COMMIT")
+    if dropped:
+        import sqlite3
+
+        # Gives the freed pages back, unless another process is using it
+        try:
+            db.execute("VACUUM")
+        except sqlite3.OperationalError:
+            pass
+    return len(dropped)
+
+
+def jar_store_shares() -> Dict[str, int]:
+    """
+    Bytes of the class store each stored jar accounts for: its layout and
+    gaps, and its part of every chunk, split evenly among the jars using it.
+    """
+    if not exists(get_jar_store_path()):
+        return {}
+    db = _jar_db()
+    chunk_sizes = {row["hash"]: row["size"] for row in db.execute("SELECT hash, LENGTH(data) AS size FROM chunks")}
+    layouts = {}
+    users: Dict[str, int] = {}
+    for row in db.execute("SELECT sha1, LENGTH(layout) + LENGTH(gaps) AS skeleton, layout FROM jars"):
+        chunks = {entry[3] for entry in json.loads(zlib.decompress(row["layout"]))}
+        layouts[row["sha1"]] = (row["skeleton"], chunks)
+        for chunk in chunks:
+            users[chunk] = users.get(chunk, 0) + 1
+    return {
+        sha1_hex: skeleton + sum(chunk_sizes.get(chunk, 0) // users[chunk] for chunk in chunks)
+        for sha1_hex, (skeleton, chunks) in layouts.items()
+    }
+
+
+def jar_store_stats() -> dict:
+    """ Jars and bytes in the class store, against the size of the jars themselves """
+    if not exists(get_jar_store_path()):
+        return {"jars": 0, "jar_bytes": 0, "chunks": 0, "stored_bytes": 0}
+    db = _jar_db()
+    jars, jar_bytes, skeleton = db.execute(
+        "SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(LENGTH(layout) + LENGTH(gaps)), 0) FROM jars"
+    ).fetchone()
+    chunks, chunk_bytes = db.execute("SELECT COUNT(*), COALESCE(SUM(LENGTH(data)), 0) FROM chunks").fetchone()
+    return {"jars": jars, "jar_bytes": jar_bytes, "chunks": chunks, "stored_bytes": skeleton + chunk_bytes}
+
+
+# --- SERVE ---
+class CacheUrlIndex:
+    """
+    Maps upstream URLs to the cache entries downloaded from them. Entries
+    made by `download_cached` are found directly from their key, the rest
+    through the origin URL recorded in the cache index.
+    """
+
+    def count(self) -> int:
+        return _index().execute("SELECT COUNT(*) FROM entries WHERE origin LIKE 'http%'").fetchone()[0]
+
+    def lookup(self, url: str) -> Optional[str]:
+        if path := get_cached_file(url_cache_key(url)):
+            return path
+        row = _index().execute(
+            "SELECT key FROM entries WHERE origin = ? ORDER BY accessed DESC LIMIT 1", (url,)
+        ).fetchone()
+        return get_cached_file(row["key"]) if row else None
+
+
+def _mirror_handler(index: CacheUrlIndex, pull_through: bool):
+    import mimetypes
+    from email.utils import formatdate, parsedate_to_datetime
+    from http.server import BaseHTTPRequestHandler
+
+    class CacheMirrorHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        server_version = "GrylaMirror"
+
+        def do_GET(self):
+            self.serve(send_body=True)
+
+        def do_HEAD(self):
+            self.serve(send_body=False)
+
+        def resolve(self) -> Optional[str]:
+            # /<host>/<path> mirrors https://<host>/<path>
+            host, _, rest = self.path.lstrip("/").partition("/")
+            urls = [f"https://{host}/{rest}", f"http://{host}/{rest}"]
+            for url in urls:
+                if path := index.lookup(url):
+                    return path
+            if pull_through and is_pullable(urls[0]) and not OFFLINE:
+                # Unquoted after the split, so that %2F cannot smuggle in a path
+                name = urllib.parse.unquote(urllib.parse.urlsplit(urls[0]).path.split("/")[-1]) or "index"
+                if not is_entry_name(name):
+                    return None
+                try:
+                    return download_cached(urls[0], name)
+                except (MissingArtifactError, *_transfer_errors()):
+                    return None
+            return None
+
+        def send_empty(self, status: int, headers: Optional[dict] = None):
+            self.send_response(status)
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def serve(self, send_body: bool):
+            path = self.resolve()
+            if path is None:
+                self.send_empty(404)
+                return
+
+            st = os.stat(path)
+            etag = f'"{st.st_size:x}-{st.st_mtime_ns:x}"'
+            last_modified = formatdate(st.st_mtime, usegmt=True)
+            validators = {"ETag": etag, "Last-Modified": last_modified}
+
+            if self.not_modified(etag, st.st_mtime):
+                self.send_empty(304, validators)
+                return
+
+            # Compressed entries are served as their content
+            with materialized(path) as plain:
+                self.send_file(plain, validators, send_body)
+
+        def send_file(self, path: str, validators: dict, send_body: bool):
+            etag, last_modified = validators["ETag"], validators["Last-Modified"]
+            st = os.stat(path)
+            start, end = 0, st.st_size
+            status = 200
+            range_header = self.headers.get("Range")
+            if_range = self.headers.get("If-Range")
+            if range_header and (if_range is None or if_range in (etag, last_modified)):
+                parsed = _parse_range(range_header, st.st_size)
+                if parsed is None:
+                    self.send_empty(416, {"Content-Range": f"bytes */{st.st_size}"})
+                    return
+                start, end = parsed
+                status = 206
+
+            self.send_response(status)
+            self.send_header("Content-Type", mimetypes.guess_type(path)[0] or "application/octet-stream")
+            self.send_header("Content-Length", str(end - start))
+            self.send_header("Accept-Ranges", "bytes")
+            for name, value in validators.items():
+                self.send_header(name, value)
+            if status == 206:
+                self.send_header("Content-Range", f"bytes {start}-{end - 1}/{st.st_size}")
+            self.end_headers()
+
+            if send_body and end > start:
+                with open(path, "rb") as f:
+                    # Zero-copy where the platform has sendfile
+                    self.connection.sendfile(f, start, end - start)
+
+        def not_modified(self, etag: str, mtime: float) -> bool:
+            if_none_match = self.headers.get("If-None-Match")
+            if if_none_match is not None:
+                return etag in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*"
+            if_modified_since = self.headers.get("If-Modified-Since")
+            if if_modified_since:
+                try:
+                    return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+                except (TypeError, ValueError):
+                    return False
+            return False
+
+        def log_message(self, format, *args):
+            if SHOW_PROGRESS:
+                super().log_message(format, *args)
+
+    return CacheMirrorHandler
+
+
+def _parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """ Parses a single 'bytes=' range into [start, end), None if unsatisfiable """
+    unit, _, spec = header.partition("=")
+    if unit.strip() != "bytes" or "," in spec:
+        return None
+    first, _, last = spec.strip().partition("-")
+    try:
+        if first == "":
+            length = int(last)
+            if length <= 0:
+                return None
+            return max(0, size - length), size
+        start = int(first)
+        end = min(int(last) + 1, size) if last else size
+    except ValueError:
+        return None
+    if start >= size or end <= start:
+        return None
+    return start, end
+
+
+# What `serve --pull-through` will download when it is missing from the
+# cache: the upstream folders mcjar fetches from, and its tool jars.
+# Anything else gets a 404, so the server is no open proxy to these hosts.
+MIRROR_PULL_PREFIXES = (
+    "https://piston-meta.mojang.com/mc/game/",
+    "https://piston-meta.mojang.com/v1/packages/",
+    "https://launchermeta.mojang.com/mc/game/",
+    "https://launchermeta.mojang.com/v1/packages/",
+    "https://piston-data.mojang.com/v1/objects/",
+    "https://launcher.mojang.com/v1/objects/",
+    "https://meta.omniarchive.uk/",
+    YARN_FABRIC_BASE,
+    YARN_LEGACY_BASE,
+    "https://mcphackers.org/versionsV3/",
+    "https://hub.spigotmc.org/versions/",
+)
+MIRROR_PULL_URLS = {CFR_URL, REMAPPER_URL, SPECIAL_SOURCE2_URL, MAPPINGIO_URL, *TOOL_SHA1_URLS.values()}
+
+
+def is_pullable(url: str) -> bool:
+    """ Whether `serve --pull-through` may fetch url, see MIRROR_PULL_PREFIXES """
+    if url in MIRROR_PULL_URLS:
+        return True
+    parsed = urllib.parse.urlsplit(url)
+    segments = urllib.parse.unquote(parsed.path).split("/")
+    if parsed.query or "." in segments or ".." in segments:
+        return False
+    return url.startswith(MIRROR_PULL_PREFIXES)
+
+
+def serve_cache(host: str = "0.0.0.0", port: int = 8080, pull_through: bool = False):
+    """
+    Serves the cache over HTTP, each entry under /<host>/<path> of the URL
+    it was downloaded from, so that other mcjar instances can use this one
+    with `--mirror-root http://<this machine>:<port>/`.
+    """
+    from http.server import ThreadingHTTPServer
+
+    index = CacheUrlIndex()
+    server = ThreadingHTTPServer((host, port), _mirror_handler(index, pull_through))
+    server.daemon_threads = True
+    print(f"Serving {STORAGE_DIR} ({index.count()} indexed entries) on http://{host}:{port}/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
 
 
 # --- MAIN ---
+SIDES = ("client", "server")
+
+
+def build_artifact(command: str, version: str, side: str, mappings: str = "yarn") -> Optional[str]:
+    """
+    Resolves one `get`/`remap` job to its path in the cache
+    """
+    if command == "get":
+        return get_piston_file(version, side)
+
+    if mappings == "yarn":
+        return map_yarn(version, side)
+    if mappings == "mojang":
+        return map_mojang(version, side)
+    if mappings == "spigot":
+        return map_spigot(version)
+    if mappings == "retromcp":
+        return map_retromcp(version, side)
+    return None
+
+
+def split_versions_and_sides(targets: List[str]) -> Tuple[List[str], List[str]]:
+    versions = [t for t in targets if t not in SIDES]
+    sides = [t for t in SIDES if t in targets]
+    return versions, sides or ["client"]
+
+
+def run_jobs(jobs: List[Tuple[str, str, str, str]], max_workers: int):
+    """
+    Runs `build_artifact` jobs over a bounded thread pool, yielding
+    (job, result_path, exception) as each one finishes. Downloads of one
+    job overlap with the JVM remapping steps of the others.
+    """
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+        futures = {
+            pool.submit(SCHEDULER.run_as, f"{job[1]} {job[2]}", build_artifact, *job): job
+            for job in jobs
+        }
+        for fut in as_completed(futures):
+            try:
+                yield futures[fut], fut.result(), None
+            except Exception as ex:
+                yield futures[fut], None, ex
+
+
+def add_download_args(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=DEFAULT_JOBS,
+        help=f"Number of jars processed concurrently (default: {DEFAULT_JOBS})",
+    )
+    parser.add_argument(
+        "--segments",
+        type=int,
+        default=DOWNLOAD_SEGMENTS,
+        help="Download large files as this many concurrent byte ranges, "
+        f"when the server supports it (default: {DOWNLOAD_SEGMENTS})",
+    )
+    parser.add_argument(
+        "--refresh",
+        action="store_true",
+        help="Revalidate version manifests and listings now instead of after "
+        f"their TTL ({MANIFEST_TTL:.0f}s, set by GRYLA_MANIFEST_TTL)",
+    )
+    parser.add_argument(
+        "--offline",
+        action="store_true",
+        default=OFFLINE,
+        help="Never use the network: serve everything from the cache or a file:// "
+        "mirror, failing on missing artifacts (also set by GRYLA_OFFLINE=1)",
+    )
+    parser.add_argument(
+        "--mirror",
+        action="append",
+        default=[],
+        metavar="UPSTREAM=MIRROR",
+        help="Fetch URLs starting with UPSTREAM from MIRROR instead, a file:// "
+        "path or local HTTP server (repeatable, added to GRYLA_MIRRORS)",
+    )
+    parser.add_argument(
+        "--mirror-root",
+        default=MIRROR_ROOT,
+        help="Fetch https://host/path from MIRROR_ROOT/host/path when no --mirror "
+        "matches, e.g. a `mcjar serve` instance (also set by GRYLA_MIRROR_ROOT)",
+    )
+    parser.add_argument(
+        "--max-rate",
+        type=parse_size,
+        default=os.environ.get("GRYLA_MAX_RATE"),
+        metavar="BYTES",
+        help="Cap total download bandwidth, e.g. 5M for 5 MiB/s (also set by GRYLA_MAX_RATE)",
+    )
+    parser.add_argument(
+        "--progress",
+        choices=["auto", "json", "none"],
+        default=os.environ.get("GRYLA_PROGRESS", "auto"),
+        help="How to report download progress: a status line on terminals, JSON "
+        "lines on stderr for CI logs, or nothing (also set by GRYLA_PROGRESS)",
+    )
+    parser.add_argument(
+        "--stats",
+        action="store_true",
+        help="Print per-host queue depth and download throughput when done",
+    )
+
+
+def print_download_stats():
+    stats = SCHEDULER.snapshot()
+    print(
+        f"Downloaded {sizeof_fmt(stats['bytes'])} at {sizeof_fmt(stats['average_rate'])}/s average, "
+        f"{sizeof_fmt(stats['rate'])}/s over the last 5s",
+        file=sys.stderr,
+    )
+    health = MIRROR_HEALTH.snapshot()
+    for host, info in sorted(stats["hosts"].items()):
+        latency = health.get(host, {}).get("latency")
+        print(
+            f"  {host}: {info['active']} active, {info['queued']} queued, limit {info['limit']}"
+            + (f", {latency * 1000:.0f}ms latency" if latency is not None else "")
+            + f", {health.get(host, {}).get('error_rate', 0):.0%} errors",
+            file=sys.stderr,
+        )
+
+
+def _format_time(timestamp: Optional[float]) -> str:
+    return time.strftime("%Y-%m-%d %H:%M", time.localtime(timestamp)) if timestamp else "-"
+
+
+def run_cache_command(args: argparse.Namespace) -> int:
+    """ Runs the cache subcommands, returning the exit code """
+    if args.cache_command == "ls":
+        rows = cache_entries(args.pattern, args.sort)
+        for row in rows:
+            size = sizeof_fmt(row["size"]) if row["size"] is not None else "?"
+            print(f"{row['key'][:12]}  {size:>9}  {_format_time(row['accessed'])}  {row['name']}  {row['origin'] or ''}")
+        total = sum(row["size"] or 0 for row in rows)
+        unique = sum({row["sha1"] or row["key"]: row["size"] or 0 for row in rows}.values())
+        print(f"{len(rows)} entries, {sizeof_fmt(total)} ({sizeof_fmt(unique)} unique)", file=sys.stderr)
+        return 0
+
+    if args.cache_command == "pack":
+        return pack_command(args)
+
+    if args.cache_command == "unpack":
+        with nullcontext(sys.stdin.buffer) if args.bundle == "-" else open(args.bundle, "rb") as stream:
+            added, skipped, errors = unpack_cache(stream, args.jobs)
+        for error in errors:
+            print(f"Error: {error}", file=sys.stderr)
+        print(f"{added} entries added, {skipped} already cached", file=sys.stderr)
+        return 1 if errors else 0
+
+    if args.cache_command == "verify":
+        results = scrub_cache(args.pattern, args.full, args.jobs)
+        for result in results:
+            if result.status == "corrupt":
+                print(f"Quarantined {result.path}: {result.reason}")
+            elif result.status == "busy":
+                print(f"Skipped {result.path}: in use", file=sys.stderr)
+        counts = {status: sum(r.status == status for r in results) for status in ("ok", "skipped", "corrupt", "busy")}
+        print(
+            f"{counts['ok']} checked, {counts['skipped']} unchanged since the last scrub, "
+            f"{counts['corrupt']} quarantined, {counts['busy']} in use",
+            file=sys.stderr,
+        )
+        return 1 if counts["corrupt"] else 0
+
+    if args.cache_command == "dehydrate":
+        moved = 0
+        for row in cache_entries(args.pattern):
+            if not row["name"].endswith(".jar"):
+                continue
+            with cache_lock(row["key"]):
+                if dehydrate_entry(row["key"]):
+                    print(f"Moved {row['name']} ({row['origin'] or row['key']})")
+                    moved += 1
+        stats = jar_store_stats()
+        print(
+            f"{moved} jars moved. Class store: {stats['jars']} jars of {sizeof_fmt(stats['jar_bytes'])} "
+            f"in {sizeof_fmt(stats['stored_bytes'])}",
+            file=sys.stderr,
+        )
+        return 0
+
+    if args.cache_command == "gc":
+        if args.max_size is None:
+            print("Error: no size budget, pass --max-size or set GRYLA_CACHE_SIZE", file=sys.stderr)
+            return 1
+        evicted = gc_cache(args.max_size, args.dry_run)
+        for path, size in evicted:
+            print(f"{'Would evict' if args.dry_run else 'Evicted'} {sizeof_fmt(size):>9}  {path}")
+        print(f"{len(evicted)} entries, {sizeof_fmt(sum(size for _, size in evicted))}", file=sys.stderr)
+        return 0
+
+    try:
+        row = find_cache_entry(args.entry)
+    except ValueError as ex:
+        print(f"Error: {ex}", file=sys.stderr)
+        return 1
+    if row is None:
+        print(f"Error: no cache entry matches '{args.entry}'", file=sys.stderr)
+        return 1
+
+    if args.cache_command in ("pin", "unpin"):
+        pin_cache_entry(row["key"], args.cache_command == "pin")
+        return 0
+
+    path = join(STORAGE_DIR, row["key"], row["name"])
+    if args.cache_command == "manifest":
+        if not row["name"].endswith(".jar"):
+            print(f"Error: {row['name']} is not a jar", file=sys.stderr)
+            return 1
+        digest = row["sha1"] if row["sha1"] and jar_store_has(row["sha1"]) else None
+        if digest is None:
+            with cache_lock(row["key"]):
+                digest = jar_store_add(get_cached_file(row["key"]) or path, row["sha1"])
+        json.dump({"sha1": digest, "name": row["name"], "entries": jar_manifest(digest)}, sys.stdout, indent=1)
+        print()
+        return 0
+
+    if exists(path):
+        state = ""
+    else:
+        state = " (in the class store)" if row["sha1"] and jar_store_has(row["sha1"]) else " (missing)"
+    print(f"key:       {row['key']}")
+    print(f"path:      {path}{state}")
+    print(f"origin:    {row['origin'] or '-'}")
+    size = f"{sizeof_fmt(row['size'])} ({row['size']} bytes)" if row["size"] is not None else "?"
+    print(f"size:      {size}")
+    print(f"sha1:      {row['sha1'] or '-'}{' (verified)' if row['sha1'] and is_verified(path) else ''}")
+    print(f"created:   {_format_time(row['created'])}")
+    print(f"accessed:  {_format_time(row['accessed'])}")
+    print(f"pinned:    {'yes' if row['pinned'] else 'no'}")
+    if path.endswith(COMPRESSED_EXT):
+        print("stored:    gzip compressed")
+    if exists(path) and linked_blob(path):
+        print(f"blob:      {object_path(row['sha1'])} ({os.stat(path).st_nlink} links)")
+    if exists(path):
+        print(f"rebuild:   ~{rebuild_cost(row, os.path.getmtime(path)):.1f}s")
+    for name, value in json.loads(row["meta"]).items():
+        print(f"{name + ':':<10} {value}")
+    return 0
+
+
+def pack_command(args: argparse.Namespace) -> int:
+    """ Runs `cache pack`, returning the exit code """
+    if args.output == "-":
+        stdout = sys.stdout.buffer
+        # Keep status messages out of the bundle
+        with redirect_stdout(sys.stderr):
+            return _pack_command(args, lambda: nullcontext(stdout))
+    return _pack_command(args, lambda: open(args.output, "wb"))
+
+
+def _pack_command(args: argparse.Namespace, open_output: Callable) -> int:
+    keys = set()
+    errors = []
+    if args.targets:
+        versions, sides = split_versions_and_sides(args.targets)
+        jobs = []
+        for mapping in args.mappings:
+            command = "get" if mapping == "vanilla" else "remap"
+            # Spigot only ever produces a server jar
+            for side in ["server"] if mapping == "spigot" else sides:
+                jobs += [(command, version, side, mapping) for version in versions]
+        keys, errors = bundle_keys(jobs, args.jobs)
+    for pattern in args.match:
+        keys.update(row["key"] for row in cache_entries(pattern))
+    if not args.targets and not args.match:
+        keys.update(row["key"] for row in cache_entries())
+
+    for error in errors:
+        print(f"Error: {error}", file=sys.stderr)
+    if errors:
+        return 1
+    with open_output() as stream:
+        count, size = pack_cache(sorted(keys), stream)
+    print(f"Packed {count} entries, {sizeof_fmt(size)}", file=sys.stderr)
+    return 0
+
+
+def versions_command(args: argparse.Namespace) -> int:
+    """ Runs the versions command, returning the exit code """
+    stdout = sys.stdout
+    # Keep status messages out of the version list
+    with redirect_stdout(sys.stderr):
+        try:
+            found = query_versions(args.source, args.type, args.since, args.until)
+        except (IndexError, ValueError, MissingArtifactError, *_transfer_errors()) as ex:
+            print(f"Error: {ex}", file=sys.stderr)
+            return 1
+    if args.latest:
+        found = found[-1:]
+    for version in found:
+        if args.quiet:
+            print(version.id, file=stdout)
+        else:
+            released = time.strftime("%Y-%m-%d", time.gmtime(version.released)) if version.released else "-"
+            print(f"{version.id}  {version.type or '-'}  {released}", file=stdout)
+    return 0 if found else 1
+
+
+def fetch_version_files(args: argparse.Namespace) -> int:
+    """ Runs the libraries/assets commands, returning the exit code """
+    planned: Dict[str, List[StoreObject]] = {}
+    errors = []
+    for version in args.versions:
+        try:
+            if args.command == "libraries":
+                planned[version] = plan_libraries(version, args.os)
+            else:
+                planned[version] = plan_assets(version)[1]
+        except Exception as ex:
+            errors.append(f"{version}: {ex}")
+
+    errors += fetch_objects([obj for objects in planned.values() for obj in objects], args.jobs)
+    for error in errors:
+        print(f"Error: {error}", file=sys.stderr)
+    if errors:
+        return 1
+
+    for version, objects in planned.items():
+        if args.output:
+            added = export_objects(objects, args.output)
+            print(f"{version}: {len(objects)} file(s) in {args.output} ({added} new)")
+        elif args.command == "libraries":
+            classpath = os.pathsep.join(object_path(obj.sha1) for obj in objects)
+            print(f"{version}: {classpath}" if len(planned) > 1 else classpath)
+        else:
+            print(f"{version}: {len(objects)} file(s) in {get_objects_dir()}")
+    return 0
+
+
 def main():
+    global SHOW_PROGRESS, DOWNLOAD_SEGMENTS, REFRESH_MANIFESTS, OFFLINE, MIRROR_ROOT, MAX_RATE, LINK_MODE
+
     parser = argparse.ArgumentParser(
         description="Gryla McJar.py: Minecraft JAR Downloader & Remapper"
     )
@@ -630,76 +4595,300 @@ def main():
 
     _ = subparsers.add_parser("clear_cache", help="Clear the Gryla cache")
 
+    # Subcommand: cache
+    cache_parser = subparsers.add_parser("cache", help="Inspect the Gryla cache")
+    cache_commands = cache_parser.add_subparsers(dest="cache_command", required=True)
+    ls_parser = cache_commands.add_parser("ls", help="List cache entries")
+    ls_parser.add_argument("pattern", nargs="?", help="Only list entries whose name, origin or key contains this")
+    ls_parser.add_argument(
+        "-s",
+        "--sort",
+        choices=["accessed", "created", "size", "name"],
+        default="accessed",
+        help="Sort order, most recent or largest first (default: accessed)",
+    )
+    info_parser = cache_commands.add_parser("info", help="Show everything known about a cache entry")
+    info_parser.add_argument("entry", help="Key (or a unique prefix of it), origin URL or path of the entry")
+    gc_parser = cache_commands.add_parser(
+        "gc", help="Evict the least valuable entries until the cache fits its size budget"
+    )
+    gc_parser.add_argument(
+        "--max-size",
+        type=parse_size,
+        default=CACHE_BUDGET,
+        metavar="BYTES",
+        help="Size budget, e.g. 20G (default: GRYLA_CACHE_SIZE)",
+    )
+    gc_parser.add_argument("-n", "--dry-run", action="store_true", help="Only list what would be evicted")
+    for pin_command, pin_help in (("pin", "Never evict an entry"), ("unpin", "Let gc evict an entry again")):
+        pin_parser = cache_commands.add_parser(pin_command, help=pin_help)
+        pin_parser.add_argument("entry", help="Key (or a unique prefix of it), origin URL or path of the entry")
+    verify_parser = cache_commands.add_parser(
+        "verify", help="Rehash cached files, quarantining the ones that do not match their sha1"
+    )
+    verify_parser.add_argument(
+        "pattern", nargs="?", help="Only check entries whose name, origin or key contains this (skips objects)"
+    )
+    verify_parser.add_argument(
+        "--full", action="store_true", help="Also rehash files unchanged since they last passed"
+    )
+    verify_parser.add_argument(
+        "-j", "--jobs", type=int, default=os.cpu_count() or 1, help="Files hashed concurrently (default: CPU count)"
+    )
+    dehydrate_parser = cache_commands.add_parser(
+        "dehydrate", help="Move jars into the class store, which keeps classes shared between versions once"
+    )
+    dehydrate_parser.add_argument("pattern", nargs="?", help="Only move jars whose name, origin or key contains this")
+    manifest_parser = cache_commands.add_parser(
+        "manifest", help="Print the entries of a jar in the class store as JSON, adding it if needed"
+    )
+    manifest_parser.add_argument("entry", help="Key (or a unique prefix of it), origin URL or path of the entry")
+
+    targets_help = (
+        "Minecraft Version(s) (e.g. 1.20.1 or @omni@b1.7.3), optionally followed "
+        "by the side(s) to process: client and/or server (default: client)"
+    )
+    output_help = "Output file path, or a directory when processing several jars"
+    link_mode_help = (
+        "How to put results at their output path: a copy-on-write clone, a hard "
+        "link or a symlink to the cache, or a copy. auto tries a clone, then a "
+        "copy (default: auto, also set by GRYLA_LINK_MODE). Hard linked results "
+        "must not be edited in place, and symlinks break once the cache entry "
+        "is evicted."
+    )
+    mapping_choices = ["yarn", "mojang", "spigot", "retromcp"]
 
-    # Subcommand: get (raw download)
-    get_parser = subparsers.add_parser("get", help="Download a vanilla JAR")
-    get_parser.add_argument(
-        "version", help="Minecraft Version (e.g. 1.20.1 or @omni@b1.7.3)"
+    pack_parser = cache_commands.add_parser(
+        "pack", help="Export cache entries as a bundle, e.g. to warm up CI runners (default: everything)"
+    )
+    pack_parser.add_argument(
+        "targets",
+        nargs="*",
+        metavar="version [side]",
+        help="Pack everything needed to build these, producing what is missing first. " + targets_help,
+    )
+    pack_parser.add_argument(
+        "-m",
+        "--mappings",
+        choices=["vanilla"] + mapping_choices,
+        nargs="+",
+        default=["vanilla"],
+        help="Mapping types to pack for, 'vanilla' meaning plain jars (default: vanilla)",
     )
-    get_parser.add_argument(
-        "side",
-        choices=["client", "server"],
-        nargs="?",
-        default="client",
-        help="Side (client or server, default: client)",
+    pack_parser.add_argument(
+        "--match",
+        action="append",
+        default=[],
+        metavar="PATTERN",
+        help="Also pack the entries whose name, origin or key contains PATTERN",
     )
-    get_parser.add_argument("-o", "--output", help="Output file path")
+    pack_parser.add_argument("-o", "--output", required=True, help="Bundle file to write, or - for stdout")
+    add_download_args(pack_parser)
+    unpack_parser = cache_commands.add_parser("unpack", help="Import a bundle made by 'cache pack'")
+    unpack_parser.add_argument("bundle", help="Bundle file, or - for stdin")
+    unpack_parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=DEFAULT_JOBS,
+        help=f"Number of files verified concurrently (default: {DEFAULT_JOBS})",
+    )
+
+    # Subcommand: get (raw download)
+    get_parser = subparsers.add_parser("get", help="Download vanilla JAR(s)")
+    get_parser.add_argument("targets", nargs="+", metavar="version [side]", help=targets_help)
+    get_parser.add_argument("-o", "--output", help=output_help)
+    get_parser.add_argument("--link-mode", choices=LINK_MODES, default=LINK_MODE, help=link_mode_help)
+    add_download_args(get_parser)
 
     # Subcommand: remap
     remap_parser = subparsers.add_parser(
-        "remap", help="Download and remap a JAR to named mappings"
-    )
-    remap_parser.add_argument(
-        "version", help="Minecraft Version (e.g. 1.20.1 or @omni@b1.7.3)"
-    )
-    # Re-adding side here explicitly so it's bound to the subcommand
-    remap_parser.add_argument(
-        "side",
-        choices=["client", "server"],
-        nargs="?",
-        default="client",
-        help="Side (client or server, default: client)",
+        "remap", help="Download and remap JAR(s) to named mappings"
     )
+    remap_parser.add_argument("targets", nargs="+", metavar="version [side]", help=targets_help)
     remap_parser.add_argument(
         "-m",
         "--mappings",
-        choices=["yarn", "mojang", "spigot", "retromcp"],
+        choices=mapping_choices,
         default="yarn",
         help="Mappings type (default: yarn)",
     )
-    remap_parser.add_argument("-o", "--output", help="Output file path")
+    remap_parser.add_argument("-o", "--output", help=output_help)
+    remap_parser.add_argument("--link-mode", choices=LINK_MODES, default=LINK_MODE, help=link_mode_help)
+    add_download_args(remap_parser)
+
+    # Subcommand: prefetch
+    prefetch_parser = subparsers.add_parser(
+        "prefetch", help="Download everything needed for the given versions ahead of time"
+    )
+    prefetch_parser.add_argument("targets", nargs="+", metavar="version [side]", help=targets_help)
+    prefetch_parser.add_argument(
+        "-m",
+        "--mappings",
+        choices=["vanilla"] + mapping_choices + ["libraries", "assets"],
+        nargs="+",
+        default=["vanilla"],
+        help="Mapping types to prepare for, 'vanilla' meaning plain jars, or "
+        "the versions' libraries/assets (default: vanilla)",
+    )
+    prefetch_parser.add_argument(
+        "-n",
+        "--dry-run",
+        action="store_true",
+        help="Only list what would be fetched and its total size. Version "
+        "metadata needed to know that is still fetched into the cache.",
+    )
+    add_download_args(prefetch_parser)
+
+    # Subcommand: libraries
+    libraries_parser = subparsers.add_parser(
+        "libraries", help="Download the libraries of version(s) and print their classpath"
+    )
+    libraries_parser.add_argument("versions", nargs="+", metavar="version")
+    libraries_parser.add_argument(
+        "--os",
+        choices=["linux", "osx", "windows", "all"],
+        default=current_os_name(),
+        help="OS to pick libraries and natives for (default: this one)",
+    )
+    libraries_parser.add_argument(
+        "-o", "--output", help="Lay the libraries out in this maven-style directory instead"
+    )
+    add_download_args(libraries_parser)
+
+    # Subcommand: assets
+    assets_parser = subparsers.add_parser("assets", help="Download the assets of version(s)")
+    assets_parser.add_argument("versions", nargs="+", metavar="version")
+    assets_parser.add_argument(
+        "-o", "--output", help="Lay the assets out in this directory, as indexes/ and objects/"
+    )
+    add_download_args(assets_parser)
+
+    # Subcommand: versions
+    versions_parser = subparsers.add_parser("versions", help="List the versions known to a manifest, oldest first")
+    versions_parser.add_argument(
+        "-s",
+        "--source",
+        choices=list(CATALOG_SOURCES),
+        default="piston",
+        help="Manifest to list the versions of (default: piston)",
+    )
+    versions_parser.add_argument("-t", "--type", help="Only list versions of this type, e.g. release or snapshot")
+    versions_parser.add_argument("--since", metavar="VERSION", help="Only list versions released since this one")
+    versions_parser.add_argument("--until", metavar="VERSION", help="Only list versions released up to this one")
+    versions_parser.add_argument("--latest", action="store_true", help="Only print the newest matching version")
+    versions_parser.add_argument("-q", "--quiet", action="store_true", help="Only print version ids")
+    add_download_args(versions_parser)
+
+    # Subcommand: serve
+    serve_parser = subparsers.add_parser(
+        "serve", help="Serve the cache over HTTP as a mirror for other mcjar instances"
+    )
+    serve_parser.add_argument("--host", default="0.0.0.0", help="Address to bind (default: 0.0.0.0)")
+    serve_parser.add_argument("-p", "--port", type=int, default=8080, help="Port to bind (default: 8080)")
+    serve_parser.add_argument(
+        "--pull-through",
+        action="store_true",
+        help="Download artifacts missing from the cache from their upstream on request",
+    )
+    serve_parser.add_argument("-q", "--quiet", action="store_true", help="Do not log requests")
 
     args = parser.parse_args()
 
-    result_path = None
     if args.command == "clear_cache":
         clear_gryla_cache()   
         sys.exit(0)
-    try:
 
-        if args.command == "get":
-            result_path = get_piston_file(args.version, args.side)
-
-        elif args.command == "remap":
-            if args.mappings == "yarn":
-                result_path = map_yarn(args.version, args.side)
-            elif args.mappings == "mojang":
-                result_path = map_mojang(args.version, args.side)
-            elif args.mappings == "spigot":
-                if args.side == "client":
-                     print("Warning: Spigot mappings typically only apply to server.", file=sys.stderr)
-                result_path = map_spigot(args.version)
-            elif args.mappings == "retromcp":
-                result_path = map_retromcp(args.version, args.side)
-
-        if result_path:
-            output_dest = args.output or basename(result_path)
+    try:
+        # Packing may need to download and remap, set up below
+        if args.command == "cache" and args.cache_command != "pack":
+            sys.exit(run_cache_command(args))
+
+        if args.command == "serve":
+            SHOW_PROGRESS = not args.quiet
+            serve_cache(args.host, args.port, args.pull_through)
+            sys.exit(0)
+
+        DOWNLOAD_SEGMENTS = args.segments
+        REFRESH_MANIFESTS = args.refresh
+        OFFLINE = args.offline
+        MIRROR_ROOT = args.mirror_root
+        MAX_RATE = args.max_rate
+        LINK_MODE = getattr(args, "link_mode", LINK_MODE)
+        if args.progress != "auto":
+            PROGRESS_SINKS[:] = [JsonProgress()] if args.progress == "json" else []
+        if args.stats:
+            atexit.register(print_download_stats)
+        try:
+            MIRRORS.update(parse_mirrors(" ".join(args.mirror)))
+        except ValueError as ex:
+            parser.error(str(ex))
+
+        if args.command in ("libraries", "assets"):
+            sys.exit(fetch_version_files(args))
+        if args.command == "versions":
+            sys.exit(versions_command(args))
+        if args.command == "cache":
+            sys.exit(run_cache_command(args))
+        versions, sides = split_versions_and_sides(args.targets)
+        if not versions:
+            parser.error("at least one version is required")
+
+        if args.command == "prefetch":
+            items, errors = plan_prefetch(versions, sides, args.mappings, args.jobs)
+            if args.dry_run:
+                print_prefetch_plan(items, args.jobs)
+            else:
+                errors += prefetch(items, args.jobs)
+            for error in errors:
+                print(f"Error: {error}", file=sys.stderr)
+            sys.exit(1 if errors else 0)
+
+        mappings = getattr(args, "mappings", "yarn")
+        if mappings == "spigot":
+            if "client" in sides:
+                print("Warning: Spigot mappings typically only apply to server.", file=sys.stderr)
+            # Spigot only ever produces a server jar
+            sides = ["server"]
+
+        jobs = [(args.command, version, side, mappings) for version in versions for side in sides]
+        batch = len(jobs) > 1
+
+        if batch:
+            if args.output and exists(args.output) and not os.path.isdir(args.output):
+                parser.error("--output must be a directory when processing several jars")
+            if args.output:
+                os.makedirs(args.output, exist_ok=True)
+
+        failed = 0
+        for (_, version, side, _), result_path, ex in run_jobs(jobs, args.jobs):
+            if ex is not None:
+                failed += 1
+                print(f"Error: {version} {side}: {ex}" if batch else f"Error: {ex}", file=sys.stderr)
+                continue
+            if not result_path:
+                continue
+
+            name = basename(result_path)
+            if batch:
+                label = version.replace("@omni@", "omni-")
+                if label not in name:
+                    name = f"{label}-{name}" if side in name else f"{label}-{side}-{name}"
+
+            output_dest = args.output or name
             if os.path.isdir(output_dest):
-                output_dest = join(output_dest, basename(result_path))
+                output_dest = join(output_dest, name)
 
             print(f"Copying result to: {output_dest}")
-            shutil.copyfile(result_path, output_dest)
-            print("Done.")
+            try:
+                deliver_file(result_path, output_dest)
+            except OSError as ex:
+                failed += 1
+                print(f"Error: {ex}", file=sys.stderr)
+
+        if failed:
+            sys.exit(1)
+        print("Done.")
 
     except Exception as ex:
         print(f"Error: {ex}", file=sys.stderr)
@@ -0,0 +1,228 @@
+"""
+Shared fixtures: an isolated cache for each test, a local stand-in for
+the upstream servers that supports ranges, validators, slow responses and
+dropped connections, and a piston manifest served by it.
+"""
+import hashlib
+import io
+import itertools
+import json
+import sys
+import threading
+import time
+import zipfile
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from os.path import abspath, dirname, join
+
+import pytest
+
+sys.path.insert(0, join(dirname(dirname(abspath(__file__))), "scripts"))
+
+import mcjar  # noqa: E402
+
+
+class StandInServer:
+    """
+    Serves files from memory. Records every request, and can cut the body
+    of the next responses for a path after a number of bytes, fail them
+    with a status, or delay them.
+    """
+
+    def __init__(self):
+        self.files = {}
+        self.requests = []
+        self.cut_after = {}
+        self.fail = {}
+        self.delay = 0.0
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), _make_handler(self))
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def url(self, path: str) -> str:
+        return f"http://127.0.0.1:{self.httpd.server_port}{path}"
+
+    def add(self, path: str, data: bytes) -> str:
+        self.files[path] = data
+        return self.url(path)
+
+    def requests_for(self, path: str, method: str = "GET") -> list:
+        return [headers for m, p, headers in self.requests if p == path and m == method]
+
+    @property
+    def host(self) -> str:
+        return f"127.0.0.1:{self.httpd.server_port}"
+
+
+def _make_handler(server: StandInServer):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_HEAD(self):
+            self.respond(send_body=False)
+
+        def do_GET(self):
+            self.respond(send_body=True)
+
+        def respond(self, send_body: bool):
+            with server.lock:
+                server.requests.append((self.command, self.path, dict(self.headers)))
+                server.active += 1
+                server.max_active = max(server.max_active, server.active)
+            try:
+                if server.delay:
+                    time.sleep(server.delay)
+                self.respond_now(send_body)
+            finally:
+                with server.lock:
+                    server.active -= 1
+
+        def respond_now(self, send_body: bool):
+            data = server.files.get(self.path)
+            if self.path in server.fail:
+                self.send_response(server.fail[self.path])
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            if data is None:
+                self.send_response(404)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+
+            etag = '"%s"' % hashlib.sha1(data).hexdigest()
+            if self.headers.get("If-None-Match") == etag:
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.end_headers()
+                return
+
+            start, end, status = 0, len(data), 200
+            range_header = self.headers.get("Range")
+            if_range = self.headers.get("If-Range")
+            if range_header and (if_range is None or if_range == etag):
+                first, _, last = range_header[len("bytes="):].partition("-")
+                start, end, status = int(first), int(last) + 1 if last else len(data), 206
+
+            self.send_response(status)
+            self.send_header("ETag", etag)
+            self.send_header("Accept-Ranges", "bytes")
+            self.send_header("Content-Length", str(end - start))
+            if status == 206:
+                self.send_header("Content-Range", f"bytes {start}-{end - 1}/{len(data)}")
+            self.end_headers()
+            if not send_body:
+                return
+
+            body = data[start:end]
+            cut = server.cut_after.get(self.path)
+            if cut and cut[1] > 0:
+                cut[1] -= 1
+                self.wfile.write(body[: cut[0]])
+                self.wfile.flush()
+                self.close_connection = True
+                return
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def _serve():
+    stand_in = StandInServer()
+    stand_in.thread.start()
+    yield stand_in
+    stand_in.httpd.shutdown()
+    stand_in.httpd.server_close()
+
+
+@pytest.fixture
+def server():
+    yield from _serve()
+
+
+@pytest.fixture
+def other_server():
+    """ A second stand-in, e.g. a mirror of the first """
+    yield from _serve()
+
+
+# Never reused, so no thread keeps an index connection of an earlier test
+_generations = itertools.count(1 << 20)
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    """ A fresh, empty STORAGE_DIR, without mirrors, retry delays or progress output """
+    monkeypatch.setattr(mcjar, "STORAGE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setattr(mcjar, "_index_generation", next(_generations))
+    monkeypatch.setattr(mcjar, "MIRRORS", {})
+    monkeypatch.setattr(mcjar, "MIRROR_ROOT", None)
+    monkeypatch.setattr(mcjar, "OFFLINE", False)
+    monkeypatch.setattr(mcjar, "SHOW_PROGRESS", False)
+    monkeypatch.setattr(mcjar, "PROGRESS_SINKS", [])
+    monkeypatch.setattr(mcjar, "DOWNLOAD_BACKOFF", 0.0)
+    monkeypatch.setattr(mcjar, "_revalidated_at", {})
+    monkeypatch.setattr(mcjar, "_content_hashes", {})
+    monkeypatch.setattr(mcjar, "_tool_paths", {})
+    monkeypatch.setattr(mcjar, "_last_gc", float("-inf"))
+    monkeypatch.setattr(mcjar, "SCHEDULER", mcjar.DownloadScheduler())
+    monkeypatch.setattr(mcjar, "MIRROR_HEALTH", mcjar.MirrorHealth())
+    return mcjar
+
+
+def make_jar(classes: dict) -> bytes:
+    """ A jar holding the given class name -> bytes entries, the same bytes for the same input """
+    out = io.BytesIO()
+    with zipfile.ZipFile(out, "w", zipfile.ZIP_DEFLATED) as zf:
+        for name, data in classes.items():
+            zf.writestr(zipfile.ZipInfo(name, date_time=(2020, 1, 1, 0, 0, 0)), data)
+    return out.getvalue()
+
+
+class Piston:
+    """ The versions of the stand-in piston manifest, and their jars """
+
+    VERSIONS = [
+        # id, type, release time
+        ("1.2", "release", "2021-01-01T00:00:00+00:00"),
+        ("1.2-pre1", "snapshot", "2020-12-01T00:00:00+00:00"),
+        ("1.1", "release", "2020-06-01T00:00:00+00:00"),
+        ("1.0", "release", "2020-01-01T00:00:00+00:00"),
+    ]
+
+    def __init__(self, server: StandInServer):
+        self.server = server
+        self.jars = {}
+        self.version_jsons = {}
+        listed = []
+        for version_id, version_type, released in self.VERSIONS:
+            downloads = {}
+            for side in ("client", "server"):
+                jar = make_jar(
+                    {
+                        "shared/Common.class": b"common to every version " * 200,
+                        f"{side}/Main.class": f"{side} of {version_id} ".encode() * 100,
+                    }
+                )
+                self.jars[version_id, side] = jar
+                url = server.add(f"/v1/objects/{hashlib.sha1(jar).hexdigest()}/{side}.jar", jar)
+                downloads[side] = {"url": url, "sha1": hashlib.sha1(jar).hexdigest(), "size": len(jar)}
+            version_json = {"id": version_id, "type": version_type, "downloads": downloads, "libraries": []}
+            self.version_jsons[version_id] = version_json
+            url = server.add(f"/v1/packages/{version_id}.json", json.dumps(version_json).encode())
+            listed.append({"id": version_id, "type": version_type, "releaseTime": released, "url": url})
+        self.manifest = {"latest": {"release": "1.2"}, "versions": listed}
+        self.manifest_url = server.add("/mc/game/version_manifest.json", json.dumps(self.manifest).encode())
+
+
+@pytest.fixture
+def piston(cache, server, monkeypatch):
+    """ A piston manifest with a few versions, served by the stand-in """
+    stand_in = Piston(server)
+    monkeypatch.setattr(cache, "VERSION_MANIFEST_URL", stand_in.manifest_url)
+    return stand_in
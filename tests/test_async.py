@@ -0,0 +1,96 @@
+"""
+The asyncio API: shared runs of identical calls, no cap on calls in
+flight, and JVM tools run by the event loop.
+"""
+import asyncio
+import sys
+import threading
+
+
+def test_identical_calls_share_one_run(cache):
+    calls = []
+    release = threading.Event()
+
+    def slow(name):
+        calls.append(name)
+        release.wait(5)
+        return name.upper()
+
+    async def main():
+        waiters = [asyncio.ensure_future(cache.run_async(slow, "a")) for _ in range(5)]
+        other = asyncio.ensure_future(cache.run_async(slow, "b"))
+        await asyncio.sleep(0.1)
+        release.set()
+        return await asyncio.gather(*waiters), await other
+
+    assert asyncio.run(main()) == (["A"] * 5, "B")
+    assert sorted(calls) == ["a", "b"]
+
+
+def test_cancelling_a_waiter_keeps_the_run(cache):
+    release = threading.Event()
+
+    async def main():
+        first = asyncio.ensure_future(cache.run_async(release.wait, 5))
+        second = asyncio.ensure_future(cache.run_async(release.wait, 5))
+        await asyncio.sleep(0.05)
+        first.cancel()
+        release.set()
+        return await second
+
+    assert asyncio.run(main()) is True
+
+
+def test_unhashable_arguments_are_not_shared(cache):
+    async def main():
+        return await asyncio.gather(cache.run_async(sorted, [3, 1, 2]), cache.run_async(sorted, [2, 1]))
+
+    assert asyncio.run(main()) == [[1, 2, 3], [1, 2]]
+
+
+def test_hundreds_of_calls_in_flight(cache):
+    # Only completes if every call runs at the same time
+    barrier = threading.Barrier(200, timeout=10)
+
+    def request(index):
+        barrier.wait()
+        return index
+
+    async def main():
+        return await asyncio.gather(*(cache.run_async(request, index) for index in range(200)))
+
+    assert asyncio.run(main()) == list(range(200))
+
+
+def test_tools_run_as_event_loop_subprocesses(cache, monkeypatch):
+    started = []
+    create = asyncio.create_subprocess_exec
+
+    async def spy(*cmd, **kwargs):
+        started.append(cmd)
+        return await create(*cmd, **kwargs)
+
+    monkeypatch.setattr(asyncio, "create_subprocess_exec", spy)
+    cmd = [sys.executable, "-c", "print('remapped')"]
+
+    result = asyncio.run(cache.run_async(cache.run_tool, cmd, None, True))
+
+    assert result.returncode == 0 and result.stdout.strip() == b"remapped"
+    assert started == [tuple(cmd)]
+    # Outside the async API, tools run as plain subprocesses
+    assert cache.run_tool(cmd, capture=True).stdout.strip() == b"remapped"
+    assert len(started) == 1
+
+
+def test_async_downloads(cache, piston, server):
+    server.delay = 0.1
+
+    async def main():
+        targets = [(version, side) for version in ("1.0", "1.1", "1.2") for side in ("client", "server")]
+        paths = await asyncio.gather(*(cache.get_piston_file_async(v, s) for v, s in targets))
+        return dict(zip(targets, paths))
+
+    for target, path in asyncio.run(main()).items():
+        with open(path, "rb") as f:
+            assert f.read() == piston.jars[target]
+    assert server.max_active > 1
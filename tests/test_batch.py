@@ -0,0 +1,53 @@
+"""
+Batch get/remap jobs running concurrently, and the cap on JVM tool runs.
+"""
+import subprocess
+import threading
+import time
+
+
+def test_batch_get_runs_jobs_concurrently(cache, piston, server):
+    server.delay = 0.2
+    jobs = [("get", version, side, "yarn") for version in ("1.0", "1.1", "1.2") for side in ("client", "server")]
+
+    results = {}
+    for (_, version, side, _), path, ex in cache.run_jobs(jobs, max_workers=6):
+        assert ex is None
+        with open(path, "rb") as f:
+            results[version, side] = f.read()
+
+    assert results == {(version, side): piston.jars[version, side] for _, version, side, _ in jobs}
+    assert server.max_active > 1
+
+
+def test_batch_reports_each_failure(cache, piston):
+    jobs = [("get", "1.0", "client", "yarn"), ("get", "9.9", "client", "yarn")]
+
+    outcomes = {version: ex for (_, version, _, _), _, ex in cache.run_jobs(jobs, max_workers=2)}
+
+    assert outcomes["1.0"] is None
+    assert isinstance(outcomes["9.9"], IndexError)
+
+
+def test_tool_runs_are_capped(cache, monkeypatch):
+    running, peak = [0], [0]
+    lock = threading.Lock()
+
+    def fake_run(cmd, **kwargs):
+        with lock:
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+        time.sleep(0.05)
+        with lock:
+            running[0] -= 1
+        return subprocess.CompletedProcess(cmd, 0)
+
+    monkeypatch.setattr(cache, "_tool_slots", threading.BoundedSemaphore(2))
+    monkeypatch.setattr(subprocess, "run", fake_run)
+    threads = [threading.Thread(target=cache.run_tool, args=(["java", "-version"],)) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert peak[0] == 2
@@ -0,0 +1,128 @@
+"""
+Cache entries: bundles, corrupt blobs and the mirror server.
+"""
+import hashlib
+import io
+import json
+import os
+import tarfile
+import threading
+import urllib.request
+from http.server import ThreadingHTTPServer
+
+from conftest import _generations
+from test_downloads import payload
+
+
+def test_bundle_round_trip(cache, server, tmp_path, monkeypatch):
+    manifest = json.dumps({"versions": list(range(2000))}).encode()
+    jar = payload(64 * 1024)
+    manifest_path = cache.download_cached(server.add("/v/manifest.json", manifest), "manifest.json")
+    jar_path = cache.download_cached(
+        server.add("/d/client.jar", jar), "client.jar", expected_sha1=hashlib.sha1(jar).hexdigest()
+    )
+    assert manifest_path.endswith(cache.COMPRESSED_EXT)
+    keys = [cache.url_cache_key(server.url("/v/manifest.json")), cache.url_cache_key(server.url("/d/client.jar"))]
+
+    bundle = io.BytesIO()
+    assert cache.pack_cache(keys, bundle)[0] == 2
+
+    monkeypatch.setattr(cache, "STORAGE_DIR", str(tmp_path / "other"))
+    monkeypatch.setattr(cache, "_index_generation", next(_generations))
+    added, skipped, errors = cache.unpack_cache(io.BytesIO(bundle.getvalue()))
+    assert (added, skipped, errors) == (2, 0, [])
+
+    with cache.open_cached(cache.get_cached_file(keys[0]), "rb") as f:
+        assert f.read() == manifest
+    with open(cache.get_cached_file(keys[1]), "rb") as f:
+        assert f.read() == jar
+    assert cache.unpack_cache(io.BytesIO(bundle.getvalue()))[:2] == (0, 2)
+
+
+def test_bundle_entries_cannot_escape(cache, tmp_path):
+    data = b"owned"
+    entry = {"key": "..", "name": "evil", "sha1": hashlib.sha1(data).hexdigest(), "size": len(data), "meta": {}}
+    bundle = io.BytesIO()
+    with tarfile.open(fileobj=bundle, mode="w|") as tar:
+        manifest = json.dumps({"format": cache.BUNDLE_FORMAT, "entries": [entry]}).encode()
+        info = tarfile.TarInfo("manifest.json")
+        info.size = len(manifest)
+        tar.addfile(info, io.BytesIO(manifest))
+        info = tarfile.TarInfo("entries/../evil")
+        info.size = len(data)
+        tar.addfile(info, io.BytesIO(data))
+
+    added, _, errors = cache.unpack_cache(io.BytesIO(bundle.getvalue()))
+
+    assert added == 0 and errors
+    assert not (tmp_path / "evil").exists()
+
+
+def test_corrupt_entry_is_not_relinked_to_its_blob(cache, server):
+    jar = payload(32 * 1024)
+    jar_sha1 = hashlib.sha1(jar).hexdigest()
+    url = server.add("/d/server.jar", jar)
+    path = cache.download_cached(url, "server.jar", expected_sha1=jar_sha1)
+
+    # Damages the blob too, where the entry is a hard link to it
+    with open(path, "r+b") as f:
+        f.write(b"\0\0\0\0")
+
+    path = cache.download_cached(url, "server.jar", expected_sha1=jar_sha1)
+    with open(path, "rb") as f:
+        assert hashlib.sha1(f.read()).hexdigest() == jar_sha1
+    blob = cache.object_path(jar_sha1)
+    with open(blob, "rb") as f:
+        assert hashlib.sha1(f.read()).hexdigest() == jar_sha1
+
+
+def test_same_content_shares_one_blob(cache, server):
+    jar = payload(32 * 1024)
+    first = cache.download_cached(server.add("/a/server.jar", jar), "server.jar")
+    second = cache.download_cached(server.add("/b/server.jar", jar), "server.jar")
+
+    blob = cache.object_path(hashlib.sha1(jar).hexdigest())
+    assert os.path.samefile(first, blob) and os.path.samefile(second, blob)
+
+
+def test_downloads_are_hashed_while_streaming(cache, server, monkeypatch):
+    hashed = []
+    for name in ("file_sha1", "content_sha1"):
+        monkeypatch.setattr(cache, name, lambda path, hash=getattr(cache, name): hashed.append(path) or hash(path))
+    jar = payload(32 * 1024)
+    url = server.add("/d/server.jar", jar)
+
+    with open(cache.download_cached(url, "server.jar"), "rb") as f:
+        assert f.read() == jar
+    # Changed upstream, and picked up by revalidation
+    server.add("/d/server.jar", jar[::-1])
+    revalidated = cache.download_cached(url, "server.jar", ttl=0)
+    with open(revalidated, "rb") as f:
+        assert f.read() == jar[::-1]
+
+    assert hashed == []
+    row = cache.find_cache_entry(url)
+    assert row["sha1"] == hashlib.sha1(jar[::-1]).hexdigest()
+    assert os.path.samefile(revalidated, cache.object_path(row["sha1"]))
+    assert not [name for name in os.listdir(os.path.dirname(revalidated)) if name.endswith(".verified")]
+
+
+def test_mirror_serves_upstream_gz_as_is(cache, server):
+    mappings = io.BytesIO()
+    import gzip
+
+    with gzip.GzipFile(fileobj=mappings, mode="wb") as f:
+        f.write(b"tiny\t2\t0\tofficial\tintermediary\tnamed\n" * 200)
+    mappings = mappings.getvalue()
+    url = server.add("/maven/yarn-1.0-tiny.gz", mappings)
+    cache.download_cached(url, "yarn-1.0-tiny.gz")
+
+    mirror = ThreadingHTTPServer(("127.0.0.1", 0), cache._mirror_handler(cache.CacheUrlIndex(), False))
+    threading.Thread(target=mirror.serve_forever, daemon=True).start()
+    try:
+        host = f"127.0.0.1:{server.httpd.server_port}"
+        with urllib.request.urlopen(f"http://127.0.0.1:{mirror.server_port}/{host}/maven/yarn-1.0-tiny.gz") as r:
+            assert r.read() == mappings
+    finally:
+        mirror.shutdown()
+        mirror.server_close()
@@ -0,0 +1,67 @@
+"""
+deliver_file puts results at their output path without touching the cache.
+"""
+import os
+
+import pytest
+
+
+@pytest.fixture
+def src(tmp_path) -> str:
+    path = tmp_path / "cache" / "server.jar"
+    path.parent.mkdir()
+    path.write_bytes(b"server jar")
+    return str(path)
+
+
+def read(path) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def test_auto_never_shares_the_inode(cache, src, tmp_path):
+    out = str(tmp_path / "out.jar")
+
+    assert cache.deliver_file(src, out, "auto") in ("reflink", "copy")
+    assert read(out) == b"server jar" and not os.path.samefile(src, out)
+
+
+def test_auto_falls_back_to_a_copy(cache, src, tmp_path, monkeypatch):
+    def unsupported(src, dst):
+        open(dst, "wb").close()
+        raise OSError("no reflinks here")
+
+    monkeypatch.setattr(cache, "_reflink", unsupported)
+    out = str(tmp_path / "out.jar")
+
+    assert cache.deliver_file(src, out, "auto") == "copy"
+    assert read(out) == b"server jar"
+    assert sorted(os.listdir(tmp_path)) == ["cache", "out.jar"]
+
+
+def test_explicit_modes(cache, src, tmp_path):
+    copied, linked, symlinked = (str(tmp_path / name) for name in ("copy.jar", "hard.jar", "sym.jar"))
+
+    assert cache.deliver_file(src, copied, "copy") == "copy"
+    assert cache.deliver_file(src, linked, "hardlink") == "hardlink"
+    assert cache.deliver_file(src, symlinked, "symlink") == "symlink"
+
+    assert read(copied) == b"server jar" and not os.path.samefile(src, copied)
+    assert os.path.samefile(src, linked) and not os.path.islink(linked)
+    assert os.readlink(symlinked) == os.path.abspath(src)
+
+
+def test_replacing_a_link_leaves_the_cache_alone(cache, src, tmp_path):
+    out = str(tmp_path / "out.jar")
+    cache.deliver_file(src, out, "hardlink")
+    other = tmp_path / "other.jar"
+    other.write_bytes(b"another jar")
+
+    cache.deliver_file(str(other), out, "copy")
+
+    assert read(out) == b"another jar" and read(src) == b"server jar"
+
+
+def test_unknown_mode(cache, src, tmp_path):
+    with pytest.raises(ValueError):
+        cache.deliver_file(src, str(tmp_path / "out.jar"), "teleport")
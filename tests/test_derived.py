@@ -0,0 +1,80 @@
+"""
+Derived entries are keyed on the content of their inputs, not their paths.
+"""
+import os
+import shutil
+import subprocess
+
+import pytest
+
+from conftest import _generations
+
+
+@pytest.fixture
+def remapper(cache, monkeypatch):
+    """ Stands in for tiny-remapper, recording the commands it ran """
+    runs = []
+
+    def run_tool(cmd, cwd=None, capture=False):
+        runs.append(cmd)
+        src, dst, mapping = cmd[3:6]
+        with open(src, "rb") as a, open(mapping, "rb") as b, open(dst, "wb") as out:
+            out.write(a.read() + b.read())
+        return subprocess.CompletedProcess(cmd, 0)
+
+    monkeypatch.setattr(cache, "get_remapper", lambda: "remapper.jar")
+    monkeypatch.setattr(cache, "run_tool", run_tool)
+    return runs
+
+
+def write(path, data: bytes) -> str:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+    return str(path)
+
+
+def test_content_hash_ignores_the_path(cache, tmp_path):
+    first = write(tmp_path / "a" / "client.jar", b"client")
+    second = write(tmp_path / "b" / "other.jar", b"client")
+
+    assert cache.content_hash(first) == cache.content_hash(second)
+    assert cache.derived_cache_key(f"X: {cache.content_hash(first)}") == cache.derived_cache_key(
+        f"X: {cache.content_hash(second)}"
+    )
+    write(second, b"changed")
+    assert cache.content_hash(first) != cache.content_hash(second)
+
+
+def test_content_hash_of_entries_comes_from_the_index(cache, server, monkeypatch):
+    path = cache.download_cached(server.add("/client.jar", b"client"), "client.jar")
+    monkeypatch.setattr(cache, "content_sha1", lambda path: pytest.fail(f"{path} was hashed"))
+
+    assert cache.content_hash(path) == cache.find_cache_entry(path.split(os.sep)[-2])["sha1"]
+
+
+def test_same_inputs_from_elsewhere_reuse_the_mapped_jar(cache, remapper, tmp_path):
+    src, mapping = write(tmp_path / "a" / "in.jar", b"jar"), write(tmp_path / "a" / "m.tiny", b"map")
+    mapped = cache.map_jar_with_tiny("mapped.jar", src, mapping)
+    src, mapping = write(tmp_path / "b" / "x.jar", b"jar"), write(tmp_path / "b" / "y.tiny", b"map")
+    assert cache.map_jar_with_tiny("mapped.jar", src, mapping) == mapped and len(remapper) == 1
+
+    other = cache.map_jar_with_tiny("mapped.jar", src, write(mapping, b"new"))
+    assert other != mapped and len(remapper) == 2
+    assert cache.map_jar_with_tiny("mapped.jar", src, mapping, to_ns="intermediary") != other
+    assert len(remapper) == 3
+
+
+def test_relocated_cache_keeps_its_derived_entries(cache, remapper, tmp_path, monkeypatch):
+    src, mapping = write(tmp_path / "in.jar", b"jar"), write(tmp_path / "m.tiny", b"map")
+    cache.map_jar_with_tiny("mapped.jar", src, mapping)
+
+    shutil.copytree(cache.STORAGE_DIR, tmp_path / "moved")
+    monkeypatch.setattr(cache, "STORAGE_DIR", str(tmp_path / "moved"))
+    monkeypatch.setattr(cache, "_index_generation", next(_generations))
+    monkeypatch.setattr(cache, "_content_hashes", {})
+    mapped = cache.map_jar_with_tiny("mapped.jar", src, mapping)
+
+    assert mapped.startswith(str(tmp_path / "moved")) and len(remapper) == 1
+    with open(mapped, "rb") as f:
+        assert f.read() == b"jarmap"
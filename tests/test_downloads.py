@@ -0,0 +1,81 @@
+"""
+download_file and download_cached against the local stand-in server.
+"""
+import hashlib
+import json
+import os
+
+import pytest
+
+
+def payload(size: int) -> bytes:
+    return bytes((i * 7 + i // 251) % 256 for i in range(size))
+
+
+def test_segmented_download(cache, server, tmp_path, monkeypatch):
+    monkeypatch.setattr(cache, "SEGMENT_MIN_SIZE", 1 << 16)
+    data = payload(512 * 1024)
+    url = server.add("/big.jar", data)
+    out = str(tmp_path / "big.jar")
+
+    cache.download_file(url, out, segments=4, expected_sha1=hashlib.sha1(data).hexdigest())
+
+    with open(out, "rb") as f:
+        assert f.read() == data
+    ranges = [headers.get("Range") for headers in server.requests_for("/big.jar")]
+    assert len(ranges) == 4 and all(ranges)
+    assert not [name for name in os.listdir(tmp_path) if ".part" in name]
+
+
+def test_resume_from_part(cache, server, tmp_path):
+    data = payload(200 * 1024)
+    url = server.add("/resume.jar", data)
+    server.cut_after["/resume.jar"] = [50 * 1024, 1]
+    out = str(tmp_path / "resume.jar")
+
+    with pytest.raises(cache._transfer_errors()):
+        cache.download_file(url, out, retries=0, segments=1)
+    # A retryable failure keeps the sidecars for the next run
+    assert not os.path.exists(out)
+    assert [name for name in os.listdir(tmp_path) if ".part" in name]
+
+    cache.download_file(url, out, segments=1, expected_sha1=hashlib.sha1(data).hexdigest())
+
+    with open(out, "rb") as f:
+        assert f.read() == data
+    resumed = server.requests_for("/resume.jar")[-1]
+    assert resumed.get("Range") == f"bytes={50 * 1024}-"
+    assert resumed.get("If-Range") == '"%s"' % hashlib.sha1(data).hexdigest()
+    assert not [name for name in os.listdir(tmp_path) if ".part" in name]
+
+
+@pytest.mark.parametrize("check", [{"expected_sha1": "0" * 40}, {"expected_size": 10}])
+def test_rejects_wrong_sha1_or_size(cache, server, tmp_path, check):
+    url = server.add("/file.jar", payload(4096))
+    out = str(tmp_path / "file.jar")
+
+    with pytest.raises(cache.DownloadError):
+        cache.download_file(url, out, segments=1, retries=1, **check)
+
+    assert os.listdir(tmp_path) == []
+
+
+def test_revalidation_uses_304(cache, server):
+    manifest = json.dumps({"versions": ["1.0"] * 1000}).encode()
+    url = server.add("/manifest.json", manifest)
+
+    path = cache.download_cached(url, "manifest.json", ttl=0)
+    with cache.open_cached(path, "rb") as f:
+        assert f.read() == manifest
+
+    assert cache.download_cached(url, "manifest.json", ttl=0) == path
+    revalidation = server.requests_for("/manifest.json")[-1]
+    assert revalidation.get("If-None-Match") == '"%s"' % hashlib.sha1(manifest).hexdigest()
+    assert len(server.requests_for("/manifest.json")) == 2
+
+    updated = json.dumps({"versions": ["1.1"] * 1000}).encode()
+    server.files["/manifest.json"] = updated
+    cache._revalidated_at.clear()
+    path = cache.download_cached(url, "manifest.json", ttl=0)
+    with cache.open_cached(path, "rb") as f:
+        assert f.read() == updated
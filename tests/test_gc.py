@@ -0,0 +1,86 @@
+"""
+Size-bounded eviction: value ranking, grace period, pins and objects.
+"""
+import hashlib
+import os
+import time
+
+from test_prefetch import tools  # noqa: F401
+
+
+def add_entry(cache, key: str, data: bytes, origin=None, idle: float = 3600.0, cost: float = 0.0):
+    """ An entry last used idle seconds ago, that took cost seconds to make """
+    with cache.cache_lock(key):
+        with cache.new_cache_file(key, f"{key[:6]}.jar", origin) as tmp:
+            with open(tmp, "wb") as f:
+                f.write(data)
+    path = cache.get_cached_file(key)
+    when = time.time() - idle
+    cache._index().execute(
+        "UPDATE entries SET accessed = ?, created = ?, cost = ? WHERE key = ?", (when, when, cost, key)
+    )
+    return path
+
+
+def keys(cache) -> set:
+    return {row["key"] for row in cache.cache_entries()}
+
+
+def test_evicts_the_cheapest_to_rebuild_first(cache):
+    cheap = add_entry(cache, "a" * 40, b"a" * 10_000, origin="https://example.invalid/a.jar")
+    costly = add_entry(cache, "b" * 40, b"b" * 10_000, cost=120.0)
+    stale = add_entry(cache, "c" * 40, b"c" * 10_000, cost=120.0, idle=30 * 86400)
+
+    evicted = cache.gc_cache(budget=15_000)
+
+    assert [path for path, _ in evicted] == [stale, cheap]
+    assert keys(cache) == {"b" * 40} and os.path.exists(costly)
+
+
+def test_keeps_pinned_and_recently_used_entries(cache):
+    add_entry(cache, "a" * 40, b"a" * 1000)
+    add_entry(cache, "b" * 40, b"b" * 1000, idle=10)
+    add_entry(cache, "c" * 40, b"c" * 1000)
+    cache.pin_cache_entry("c" * 40)
+
+    cache.gc_cache(budget=0)
+
+    assert keys(cache) == {"b" * 40, "c" * 40}
+    cache.gc_cache(budget=0, grace=0)
+    assert keys(cache) == {"c" * 40}
+
+
+def test_dry_run_evicts_nothing(cache):
+    path = add_entry(cache, "a" * 40, b"a" * 1000)
+
+    assert cache.gc_cache(budget=0, dry_run=True) == [(path, 1000)]
+    assert os.path.exists(path)
+
+
+def test_counts_and_evicts_store_objects(cache, server):
+    data = [f"object {i}".encode() * 100 for i in range(3)]
+    for blob in data:
+        digest = hashlib.sha1(blob).hexdigest()
+        cache.get_object(server.add(f"/o/{digest}", blob), digest, len(blob))
+    # An entry with the content of the first one shares its blob
+    linked = add_entry(cache, "a" * 40, data[0])
+    cache.pin_cache_entry("a" * 40)
+
+    evicted = cache.gc_cache(budget=0, grace=0)
+
+    unlinked = [cache.object_path(hashlib.sha1(blob).hexdigest()) for blob in data[1:]]
+    assert sorted(path for path, _ in evicted) == sorted(unlinked)
+    assert os.path.exists(linked) and os.path.exists(cache.object_path(hashlib.sha1(data[0]).hexdigest()))
+
+
+def test_prefetched_tools_are_pinned(cache, piston, tools):  # noqa: F811
+    # A tool cached by an earlier run, before tools were pinned
+    cache.download_cached(cache.CFR_URL, "cfr.jar")
+    items, _ = cache.plan_prefetch(["1.0"], ["client"], ["vanilla"])
+    assert cache.prefetch(items, quiet=True) == []
+
+    cache.gc_cache(budget=0, grace=0)
+
+    assert cache.get_cached_file(cache.url_cache_key(cache.CFR_URL))
+    assert cache.get_cached_file(cache.url_cache_key(cache.REMAPPER_URL))
+    assert cache.get_cached_file(cache.piston_file_cache_key("1.0", "client")) is None
@@ -0,0 +1,56 @@
+"""
+The SQLite cache index: rows for every entry, lookups and legacy entries.
+"""
+import hashlib
+import json
+import os
+
+
+def test_downloads_are_indexed(cache, server):
+    url = server.add("/files/a.jar", b"indexed jar")
+    path = cache.download_cached(url, "a.jar")
+    key = cache.url_cache_key(url)
+
+    row = cache.find_cache_entry(url)
+    assert row["key"] == key and row["name"] == "a.jar" and row["origin"] == url
+    assert row["size"] == len(b"indexed jar") and row["sha1"] == hashlib.sha1(b"indexed jar").hexdigest()
+    assert cache.find_cache_entry(key[:8])["key"] == key
+    assert cache.find_cache_entry(path)["key"] == key
+    assert cache.find_cache_entry("0000") is None
+
+
+def test_lists_entries_by_pattern(cache, server):
+    for name in ("a.jar", "b.jar", "c.json"):
+        cache.download_cached(server.add(f"/files/{name}", name.encode()), name)
+
+    assert [row["name"] for row in cache.cache_entries("jar", sort="name")] == ["a.jar", "b.jar"]
+    assert len(cache.cache_entries()) == 3
+
+
+def test_removed_files_drop_their_row(cache, server):
+    url = server.add("/files/a.jar", b"soon gone")
+    path = cache.download_cached(url, "a.jar")
+    os.remove(path)
+
+    assert cache.get_cached_file(cache.url_cache_key(url)) is None
+    assert cache.find_cache_entry(url) is None
+
+
+def test_imports_legacy_entries(cache, server):
+    """ Entries of the directory-per-key layout, with their sidecars """
+    url = server.url("/files/legacy.jar")
+    key = cache.url_cache_key(url)
+    folder = os.path.join(cache.STORAGE_DIR, key)
+    os.makedirs(folder)
+    with open(os.path.join(folder, "legacy.jar"), "wb") as f:
+        f.write(b"made by an older mcjar")
+    with open(os.path.join(folder, ".meta.json"), "w") as f:
+        json.dump({"url": url, "etag": '"x"'}, f)
+
+    path = cache.download_cached(url, "legacy.jar")
+
+    assert path == os.path.join(folder, "legacy.jar")
+    assert server.requests == []
+    assert cache.find_cache_entry(url)["key"] == key
+    assert cache.read_cache_meta(key)["etag"] == '"x"'
+    assert not os.path.exists(os.path.join(folder, ".meta.json"))
@@ -0,0 +1,79 @@
+"""
+The class store: dehydrated jars rebuild byte for byte, share their
+classes, and are evicted by gc like any other entry.
+"""
+import hashlib
+import os
+import time
+
+
+def cached_jar(cache, piston, version_id: str, side: str = "client") -> str:
+    url = piston.version_jsons[version_id]["downloads"][side]["url"]
+    return cache.download_cached(url, f"{version_id}-{side}.jar")
+
+
+def dehydrate(cache, path: str, idle: float = 3600.0):
+    key = os.path.basename(os.path.dirname(path))
+    with cache.cache_lock(key):
+        assert cache.dehydrate_entry(key)
+    when = time.time() - idle
+    cache._index().execute("UPDATE entries SET accessed = ?, created = ? WHERE key = ?", (when, when, key))
+    return key
+
+
+def test_dehydrated_jar_rebuilds_byte_for_byte(cache, piston):
+    path = cached_jar(cache, piston, "1.0")
+    key = dehydrate(cache, path)
+    assert not os.path.exists(path)
+
+    assert cache.get_cached_file(key) == path
+    with open(path, "rb") as f:
+        assert f.read() == piston.jars["1.0", "client"]
+    assert os.path.samefile(path, cache.object_path(hashlib.sha1(piston.jars["1.0", "client"]).hexdigest()))
+
+
+def test_jars_share_their_classes(cache, piston):
+    for version_id in ("1.0", "1.1"):
+        dehydrate(cache, cached_jar(cache, piston, version_id))
+
+    stats = cache.jar_store_stats()
+    # One common class, and a main class for each
+    assert stats["jars"] == 2 and stats["chunks"] == 3
+    assert stats["stored_bytes"] < stats["jar_bytes"]
+    sha1_hex = hashlib.sha1(piston.jars["1.1", "client"]).hexdigest()
+    assert cache.read_jar_entry(sha1_hex, "client/Main.class") == b"client of 1.1 " * 100
+
+
+def test_gc_evicts_dehydrated_jars(cache, piston):
+    older = dehydrate(cache, cached_jar(cache, piston, "1.0"), idle=7200)
+    newer = dehydrate(cache, cached_jar(cache, piston, "1.1"))
+    shares = cache.jar_store_shares()
+    assert set(shares) == {hashlib.sha1(piston.jars[v, "client"]).hexdigest() for v in ("1.0", "1.1")}
+
+    # The store counts against the budget, so one of them has to go
+    assert len(cache.gc_cache(budget=max(shares.values()), grace=0)) == 1
+    assert cache.get_cached_file(older) is None and cache.get_cached_file(newer)
+    assert cache.jar_store_stats()["jars"] == 1
+
+    cache.gc_cache(budget=0, grace=0)
+    assert cache.jar_store_stats() == {"jars": 0, "jar_bytes": 0, "chunks": 0, "stored_bytes": 0}
+
+
+def test_gc_keeps_pinned_dehydrated_jars(cache, piston):
+    key = dehydrate(cache, cached_jar(cache, piston, "1.0"))
+    cache.pin_cache_entry(key)
+
+    assert cache.gc_cache(budget=0, grace=0) == []
+    assert cache.jar_store_stats()["jars"] == 1
+
+
+def test_gc_dehydrates_with_jar_store(cache, piston, monkeypatch):
+    monkeypatch.setattr(cache, "JAR_STORE", True)
+    path = cached_jar(cache, piston, "1.0")
+    key = os.path.basename(os.path.dirname(path))
+    cache._index().execute("UPDATE entries SET accessed = ?, created = ? WHERE key = ?", (0, 0, key))
+
+    assert cache.gc_cache(budget=0, grace=0) == [(path, len(piston.jars["1.0", "client"]))]
+    assert not os.path.exists(path) and cache.jar_store_stats()["jars"] == 1
+    with open(cache.get_cached_file(key), "rb") as f:
+        assert f.read() == piston.jars["1.0", "client"]
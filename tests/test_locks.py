@@ -0,0 +1,82 @@
+"""
+Per-key cache locks: single-flight downloads, non-blocking probes, and
+lock files that do not pile up in .locks.
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from test_downloads import payload
+
+
+def lock_files(cache) -> list:
+    folder = os.path.join(cache.STORAGE_DIR, ".locks")
+    return os.listdir(folder) if os.path.exists(folder) else []
+
+
+def test_concurrent_downloads_fetch_once(cache, server):
+    url = server.add("/shared.jar", payload(64 * 1024))
+    server.delay = 0.2
+
+    with ThreadPoolExecutor(8) as pool:
+        paths = list(pool.map(lambda _: cache.download_cached(url, "shared.jar"), range(8)))
+
+    assert len(set(paths)) == 1
+    assert len(server.requests_for("/shared.jar")) == 1
+    assert lock_files(cache) == []
+
+
+def test_non_blocking_lock_while_held(cache):
+    held, release = threading.Event(), threading.Event()
+
+    def hold():
+        with cache.cache_lock("some key"):
+            held.set()
+            release.wait()
+
+    thread = threading.Thread(target=hold)
+    thread.start()
+    held.wait()
+    try:
+        with cache.cache_lock("some key", blocking=False) as locked:
+            assert locked is False
+        with cache.cache_lock("other key", blocking=False) as locked:
+            assert locked is True
+    finally:
+        release.set()
+        thread.join()
+    with cache.cache_lock("some key", blocking=False) as locked:
+        assert locked is True
+
+
+def test_lock_held_by_another_process(cache):
+    # flock locks are per open file, so a second open stands in for another process
+    with cache.cache_lock("some key"):
+        path = cache._lock_file_path("some key")
+    fd = os.open(path, os.O_RDWR | os.O_CREAT)
+    try:
+        assert cache._try_lock_fd(fd)
+        with cache.cache_lock("some key", blocking=False) as locked:
+            assert locked is False
+    finally:
+        os.close(fd)
+    with cache.cache_lock("some key", blocking=False) as locked:
+        assert locked is True
+
+
+def test_reentrant_and_removed_on_release(cache):
+    with cache.cache_lock("some key"):
+        with cache.cache_lock("some key", blocking=False) as locked:
+            assert locked is True
+        assert len(lock_files(cache)) == 1
+    assert lock_files(cache) == []
+
+
+def test_prune_keeps_held_lock_files(cache):
+    os.makedirs(os.path.join(cache.STORAGE_DIR, ".locks"))
+    for i in range(3):
+        open(os.path.join(cache.STORAGE_DIR, ".locks", f"{i}" * 40), "w").close()
+
+    with cache.cache_lock("some key"):
+        cache._prune_lock_files()
+        assert lock_files(cache) == [os.path.basename(cache._lock_file_path("some key"))]
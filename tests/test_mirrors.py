@@ -0,0 +1,65 @@
+"""
+Failover and hedging between interchangeable source mirrors.
+"""
+import threading
+import time
+
+import pytest
+
+
+@pytest.fixture
+def mirrored(cache, server, other_server, monkeypatch):
+    """ other_server mirrors server, and upstream URLs point to server """
+    monkeypatch.setattr(cache, "SOURCE_MIRRORS", {server.url("/"): [server.url("/"), other_server.url("/")]})
+    monkeypatch.setattr(cache, "HEDGE_DELAY", 0.3)
+    for stand_in in (server, other_server):
+        stand_in.add("/maven/a.jar", b"mirrored artifact")
+    return server.url("/maven/a.jar")
+
+
+def read(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def test_fails_over_on_server_errors(cache, server, other_server, mirrored):
+    server.fail["/maven/a.jar"] = 503
+
+    assert read(cache.download_cached(mirrored, "a.jar")) == b"mirrored artifact"
+    assert len(other_server.requests_for("/maven/a.jar")) == 1
+    assert cache.MIRROR_HEALTH.error_rate(server.host) == 1.0
+    # The failing mirror now ranks last
+    assert cache.source_candidates(mirrored)[0] == other_server.url("/maven/a.jar")
+
+
+def test_hedges_slow_requests(cache, server, other_server, mirrored):
+    server.delay = 2.0
+
+    started = time.monotonic()
+    assert read(cache.download_cached(mirrored, "a.jar")) == b"mirrored artifact"
+
+    assert time.monotonic() - started < 1.5
+    assert len(other_server.requests_for("/maven/a.jar")) == 1
+    # The slow response is closed once it arrives
+    deadline = time.monotonic() + 5
+    while cache.SCHEDULER.active.get(server.host) and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert not cache.SCHEDULER.active.get(server.host)
+
+
+def test_local_queueing_does_not_hedge(cache, server, other_server, mirrored, monkeypatch):
+    monkeypatch.setitem(cache.HOST_LIMITS, server.host, 1)
+    cache.SCHEDULER.acquire(server.host)
+    result = []
+    thread = threading.Thread(target=lambda: result.append(cache.download_cached(mirrored, "a.jar")))
+    thread.start()
+
+    # Waiting on our own full host queue is not the mirror being slow
+    time.sleep(1.0)
+    assert other_server.requests == []
+    cache.SCHEDULER.release(server.host)
+    thread.join()
+
+    assert read(result[0]) == b"mirrored artifact"
+    assert other_server.requests == []
+    assert cache.MIRROR_HEALTH.latency[server.host] < 0.3
@@ -0,0 +1,94 @@
+"""
+Libraries and assets: planned from version JSONs, fetched once into the
+content-addressed object store, and laid out from it.
+"""
+import hashlib
+import json
+import os
+
+import pytest
+
+
+def artifact(server, path: str, data: bytes) -> dict:
+    url = server.add(f"/libraries/{path}", data)
+    return {"path": path, "url": url, "sha1": hashlib.sha1(data).hexdigest(), "size": len(data)}
+
+
+@pytest.fixture
+def launcher_files(cache, piston, server):
+    """ Libraries and assets of version 1.1 """
+    shared = b"a library used twice"
+    version = piston.version_jsons["1.1"]
+    version["libraries"] = [
+        {"downloads": {"artifact": artifact(server, "org/lib/lib-1.jar", shared)}},
+        {"downloads": {"artifact": artifact(server, "org/lib/lib-copy-1.jar", shared)}},
+        {
+            "downloads": {
+                "classifiers": {
+                    "natives-linux": artifact(server, "org/native/native-linux.jar", b"linux natives"),
+                    "natives-windows": artifact(server, "org/native/native-windows.jar", b"windows natives"),
+                }
+            },
+            "natives": {"linux": "natives-linux", "windows": "natives-windows"},
+        },
+        {
+            "downloads": {"artifact": artifact(server, "org/mac/only-1.jar", b"mac only")},
+            "rules": [{"action": "allow", "os": {"name": "osx"}}],
+        },
+    ]
+    assets = {"icon.png": b"an icon", "sound.ogg": b"a sound", "copy.png": b"an icon"}
+    objects = {}
+    for name, data in assets.items():
+        digest = hashlib.sha1(data).hexdigest()
+        server.add(f"/assets/{digest[:2]}/{digest}", data)
+        objects[name] = {"hash": digest, "size": len(data)}
+    index = json.dumps({"objects": objects}).encode()
+    version["assetIndex"] = {
+        "id": "7",
+        "url": server.add("/indexes/7.json", index),
+        "sha1": hashlib.sha1(index).hexdigest(),
+        "size": len(index),
+    }
+    server.add("/v1/packages/1.1.json", json.dumps(version).encode())
+    return assets
+
+
+def test_plans_libraries_for_an_os(cache, launcher_files):
+    linux = {obj.path for obj in cache.plan_libraries("1.1", "linux")}
+    every = {obj.path for obj in cache.plan_libraries("1.1", "all")}
+
+    assert linux == {"org/lib/lib-1.jar", "org/lib/lib-copy-1.jar", "org/native/native-linux.jar"}
+    assert every == linux | {"org/native/native-windows.jar", "org/mac/only-1.jar"}
+
+
+def test_fetches_each_object_once(cache, launcher_files, server, tmp_path, monkeypatch):
+    monkeypatch.setattr(cache, "ASSETS_BASE", server.url("/assets/"))
+    libraries = cache.plan_libraries("1.1", "all")
+    index_id, assets = cache.plan_assets("1.1")
+    assert index_id == "7"
+
+    assert cache.fetch_objects(libraries + assets, max_workers=4) == []
+    # Files with the same content share one object, fetched once
+    store = ("/libraries/", "/assets/", "/indexes/")
+    gets = [path for method, path, _ in server.requests if method == "GET" and path.startswith(store)]
+    assert len(gets) == len({obj.sha1 for obj in libraries + assets})
+
+    requests = len(server.requests)
+    assert cache.fetch_objects(libraries + assets) == []
+    assert len(server.requests) == requests
+
+    assert cache.export_objects(assets, str(tmp_path / "assets")) == len({obj.path for obj in assets})
+    digest = hashlib.sha1(b"a sound").hexdigest()
+    assert (tmp_path / "assets" / "objects" / digest[:2] / digest).read_bytes() == b"a sound"
+    assert (tmp_path / "assets" / "indexes" / "7.json").exists()
+
+
+def test_rejects_objects_that_do_not_match(cache, launcher_files, server):
+    libraries = cache.plan_libraries("1.1", "linux")
+    native = next(obj for obj in libraries if "native" in obj.path)
+    server.add(native.url.split(server.host, 1)[1], b"tampered natives")
+
+    errors = cache.fetch_objects(libraries)
+
+    assert len(errors) == 1 and native.path in errors[0]
+    assert not os.path.exists(cache.object_path(native.sha1))
@@ -0,0 +1,52 @@
+"""
+Offline mode, and URLs rewritten to file:// or HTTP mirrors.
+"""
+import pytest
+
+
+def test_offline_fails_fast_on_missing_artifacts(cache, piston, server, monkeypatch):
+    monkeypatch.setattr(cache, "OFFLINE", True)
+
+    with pytest.raises(cache.MissingArtifactError):
+        cache.get_piston_file("1.0", "client")
+    assert server.requests == []
+
+
+def test_offline_uses_what_is_cached(cache, piston, server, monkeypatch):
+    path = cache.get_piston_file("1.0", "client")
+    requests = len(server.requests)
+    monkeypatch.setattr(cache, "OFFLINE", True)
+    monkeypatch.setattr(cache, "REFRESH_MANIFESTS", True)
+    cache._revalidated_at.clear()
+
+    assert cache.get_piston_file("1.0", "client") == path
+    # Expired manifests are used as they are
+    assert cache.query_versions("piston", "release")[-1].id == "1.2"
+    assert len(server.requests) == requests
+
+
+def test_mirror_root_serves_files_offline(cache, tmp_path, monkeypatch):
+    mirrored = tmp_path / "mirror" / "example.invalid" / "files" / "a.jar"
+    mirrored.parent.mkdir(parents=True)
+    mirrored.write_bytes(b"mirrored jar")
+    monkeypatch.setattr(cache, "MIRROR_ROOT", (tmp_path / "mirror").as_uri())
+    monkeypatch.setattr(cache, "OFFLINE", True)
+
+    path = cache.download_cached("https://example.invalid/files/a.jar", "a.jar")
+
+    with open(path, "rb") as f:
+        assert f.read() == b"mirrored jar"
+    with pytest.raises(cache.MissingArtifactError, match="not found in mirror"):
+        cache.download_cached("https://example.invalid/files/b.jar", "b.jar")
+
+
+def test_mirror_prefix_rewrites_to_http(cache, server, monkeypatch):
+    server.add("/mirror/files/a.jar", b"from the mirror")
+    monkeypatch.setattr(cache, "MIRRORS", {"https://example.invalid/": server.url("/mirror/")})
+
+    path = cache.download_cached("https://example.invalid/files/a.jar", "a.jar")
+
+    with open(path, "rb") as f:
+        assert f.read() == b"from the mirror"
+    # Cached under the upstream URL, wherever it came from
+    assert cache.get_cached_file(cache.url_cache_key("https://example.invalid/files/a.jar")) == path
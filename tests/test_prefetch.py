@@ -0,0 +1,57 @@
+"""
+mcjar prefetch: planning what a run needs, and fetching it concurrently.
+"""
+import pytest
+
+from conftest import make_jar
+
+
+@pytest.fixture
+def tools(cache, server, monkeypatch):
+    cfr = make_jar({"org/benf/cfr/Main.class": b"cfr" * 100})
+    remapper = make_jar({"net/fabricmc/tinyremapper/Main.class": b"remapper" * 100})
+    monkeypatch.setattr(cache, "CFR_URL", server.add("/cfr-0.152.jar", cfr))
+    monkeypatch.setattr(cache, "REMAPPER_URL", server.add("/tiny-remapper-fat.jar", remapper))
+    return {"CFR": cfr, "Tiny Remapper": remapper}
+
+
+def test_prefetch_fetches_the_plan_once(cache, piston, tools, server):
+    items, errors = cache.plan_prefetch(["1.0", "1.1"], ["client", "server"], ["vanilla"])
+    assert errors == []
+    labels = {item.label for item in items}
+    assert labels == {"CFR", "Tiny Remapper", "1.0 client", "1.0 server", "1.1 client", "1.1 server"}
+    assert not any(item.cached for item in items)
+
+    assert cache.prefetch(items, max_workers=4, quiet=True) == []
+
+    assert cache.get_piston_file("1.1", "server")
+    with open(cache.get_piston_file("1.0", "client"), "rb") as f:
+        assert f.read() == piston.jars["1.0", "client"]
+    items, _ = cache.plan_prefetch(["1.0", "1.1"], ["client", "server"], ["vanilla"])
+    assert all(item.cached for item in items)
+    jar_gets = [path for method, path, _ in server.requests if method == "GET" and path.endswith(".jar")]
+    assert len(jar_gets) == len(set(jar_gets)) == 6
+
+
+def test_prefetch_collects_errors(cache, piston, tools, server):
+    server.fail["/tiny-remapper-fat.jar"] = 404
+    items, errors = cache.plan_prefetch(["1.0", "7.7"], ["client"], ["vanilla"])
+    assert len(errors) == 1 and errors[0].startswith("7.7 (vanilla)")
+
+    errors = cache.prefetch(items, quiet=True)
+
+    assert len(errors) == 1 and errors[0].startswith("Tiny Remapper: ")
+    assert cache.get_cached_file(cache.url_cache_key(cache.CFR_URL))
+
+
+def test_dry_run_lists_missing_items(cache, piston, tools, capsys):
+    items, _ = cache.plan_prefetch(["1.2"], ["client"], ["vanilla"])
+    cache.prefetch([item for item in items if item.label == "CFR"], quiet=True)
+    items, _ = cache.plan_prefetch(["1.2"], ["client"], ["vanilla"])
+    capsys.readouterr()
+
+    cache.print_prefetch_plan(items)
+
+    out = capsys.readouterr().out
+    assert "1.2 client" in out and "Tiny Remapper" in out and "CFR" not in out
+    assert "Would fetch 2 file(s)" in out and "(1 already cached)" in out
@@ -0,0 +1,83 @@
+"""
+Progress events sent to pluggable sinks, and the bundled sinks.
+"""
+import io
+import json
+
+import pytest
+
+
+@pytest.fixture
+def events(cache, monkeypatch):
+    """ Every event of the downloads made while it is in use """
+    received = []
+    monkeypatch.setattr(cache, "SHOW_PROGRESS", True)
+    cache.add_progress_sink(received.append)
+    return received
+
+
+def test_download_reports_start_progress_and_done(cache, server, events, monkeypatch):
+    monkeypatch.setattr(cache, "PROGRESS_INTERVAL", 0.0)
+    url = server.add("/big.jar", b"x" * (300 * 1024))
+
+    cache.download_cached(url, "big.jar")
+
+    kinds = [event.kind for event in events]
+    assert kinds[0] == "start" and kinds[-1] == "done" and "progress" in kinds
+    assert {event.id for event in events} == {events[0].id}
+    assert events[-1].bytes == events[-1].total == 300 * 1024
+    assert events[-1].name == "big.jar" and events[-1].url == url
+
+
+def test_progress_events_are_throttled(cache, server, events, monkeypatch):
+    monkeypatch.setattr(cache, "PROGRESS_INTERVAL", 60.0)
+
+    cache.download_cached(server.add("/big.jar", b"x" * (1 << 20)), "big.jar")
+
+    assert [event.kind for event in events].count("progress") <= 1
+
+
+def test_failed_transfers_are_reported(cache, server, events, tmp_path):
+    url = server.add("/cut.jar", b"x" * 100_000)
+    server.cut_after["/cut.jar"] = [1000, 1]
+
+    with pytest.raises(cache._transfer_errors()):
+        cache.download_file(url, str(tmp_path / "cut.jar"), retries=0)
+
+    assert [event.kind for event in events][-1] == "failed"
+    assert events[-1].bytes == 1000
+
+
+def test_removed_sinks_get_nothing(cache, server, events):
+    cache.remove_progress_sink(events.append)
+
+    cache.download_cached(server.add("/a.jar", b"quiet"), "a.jar")
+
+    assert events == []
+
+
+def test_json_sink_writes_one_event_per_line(cache):
+    stream = io.StringIO()
+    sink = cache.JsonProgress(stream, interval=1.0)
+    event = cache.ProgressEvent
+
+    sink(event("start", 1, "a.jar", "u", 0, 10, 0.0, 0.0, None))
+    sink(event("progress", 1, "a.jar", "u", 5, 10, 0.5, 10.0, 0.5))
+    sink(event("progress", 1, "a.jar", "u", 6, 10, 0.8, 7.5, 0.5))
+    sink(event("done", 1, "a.jar", "u", 10, 10, 1.2, 8.3, 0.0))
+
+    lines = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert [line["kind"] for line in lines] == ["start", "progress", "done"]
+    assert lines[-1]["bytes"] == 10
+
+
+def test_terminal_sink_prints_finished_transfers(cache):
+    stream = io.StringIO()
+    sink = cache.TerminalProgress(stream)
+    event = cache.ProgressEvent
+
+    sink(event("start", 1, "a.jar", "u", 0, 2048, 0.0, 0.0, None))
+    sink(event("done", 1, "a.jar", "u", 2048, 2048, 0.5, 4096.0, 0.0))
+    sink(event("failed", 2, "b.jar", "u", 1024, 2048, 0.5, 2048.0, None))
+
+    assert stream.getvalue().splitlines() == ["Downloaded a.jar (2.0KiB in 0.5s)", "Stopped b.jar after 1.0KiB"]
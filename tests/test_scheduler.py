@@ -0,0 +1,62 @@
+"""
+The download scheduler: per-host connection caps, fairness between jobs
+and the global rate cap.
+"""
+import threading
+import time
+
+
+def test_host_limit_caps_concurrent_requests(cache, server, monkeypatch):
+    monkeypatch.setitem(cache.HOST_LIMITS, server.host, 2)
+    server.delay = 0.1
+    urls = [server.add(f"/file{i}.jar", b"x" * 1000) for i in range(8)]
+
+    threads = [
+        threading.Thread(target=cache.download_cached, args=(url, f"file{i}.jar")) for i, url in enumerate(urls)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert server.max_active == 2
+    assert all(cache.get_cached_file(cache.url_cache_key(url)) for url in urls)
+
+
+def test_slots_are_shared_round_robin_between_jobs(cache, monkeypatch):
+    scheduler = cache.DownloadScheduler()
+    monkeypatch.setitem(cache.HOST_LIMITS, "example.invalid", 1)
+    order = []
+    scheduler.acquire("example.invalid")
+
+    def request(job: str, index: int):
+        with scheduler.job(job):
+            scheduler.acquire("example.invalid")
+        order.append(job)
+        scheduler.release("example.invalid")
+
+    # A big job queues first, a small one after it
+    threads = [threading.Thread(target=request, args=("big", i)) for i in range(4)]
+    threads.append(threading.Thread(target=request, args=("small", 0)))
+    for thread in threads:
+        thread.start()
+        while sum(len(q) for q in scheduler.waiting.get("example.invalid", {}).values()) < threads.index(thread) + 1:
+            time.sleep(0.001)
+    scheduler.release("example.invalid")
+    for thread in threads:
+        thread.join()
+
+    # The small job does not wait for the whole big one
+    assert order.index("small") <= 1
+
+
+def test_rate_cap_throttles_downloads(cache, server, monkeypatch):
+    monkeypatch.setattr(cache, "MAX_RATE", 256 * 1024)
+    url = server.add("/big.jar", b"x" * (512 * 1024))
+
+    started = time.monotonic()
+    cache.download_cached(url, "big.jar")
+    elapsed = time.monotonic() - started
+
+    assert elapsed >= 1.5
+    assert cache.SCHEDULER.snapshot()["bytes"] == 512 * 1024
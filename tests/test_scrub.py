@@ -0,0 +1,92 @@
+"""
+mcjar cache verify: rehashing entries and objects, quarantining bad ones,
+and holding tool jars to their pins.
+"""
+import hashlib
+import os
+
+import pytest
+
+from test_downloads import payload
+from test_prefetch import tools  # noqa: F401
+
+
+def statuses(results) -> dict:
+    return {result.path: result.status for result in results}
+
+
+def test_scrub_skips_files_that_passed(cache, server):
+    paths = [cache.download_cached(server.add(f"/{i}.jar", payload(1000 + i)), f"{i}.jar") for i in range(3)]
+
+    first = statuses(cache.scrub_cache())
+    assert set(first.values()) == {"ok"} and set(paths) <= set(first)
+    assert set(statuses(cache.scrub_cache()).values()) == {"skipped"}
+    assert set(statuses(cache.scrub_cache(full=True)).values()) == {"ok"}
+
+
+def test_scrub_quarantines_corrupt_entries(cache, server):
+    data = payload(4096)
+    url = server.add("/server.jar", data)
+    path = cache.download_cached(url, "server.jar")
+    cache.scrub_cache()
+    # Same size, and the mtime the scrub saw, so only a rehash notices
+    st = os.stat(path)
+    with open(path, "r+b") as f:
+        f.write(b"\0\0\0\0")
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns))
+
+    assert "corrupt" not in statuses(cache.scrub_cache()).values()
+    corrupt = {result.path for result in cache.scrub_cache(full=True) if result.status == "corrupt"}
+
+    # The entry, and its blob unless the entry scrub got to it first
+    assert path in corrupt <= {path, cache.object_path(hashlib.sha1(data).hexdigest())}
+    assert os.listdir(cache.get_quarantine_dir())
+    assert cache.find_cache_entry(url) is None
+    with open(cache.download_cached(url, "server.jar"), "rb") as f:
+        assert f.read() == data
+
+
+def test_tool_must_match_its_pin(cache, tools, monkeypatch):  # noqa: F811
+    monkeypatch.setattr(cache, "TOOL_SHA1S", {cache.CFR_URL: "0" * 40})
+
+    with pytest.raises(cache.DownloadError):
+        cache.get_cfr()
+    assert cache.find_cache_entry(cache.CFR_URL) is None
+
+
+def test_scrub_holds_cached_tools_to_their_pin(cache, tools, monkeypatch):  # noqa: F811
+    path = cache.get_cfr()
+    monkeypatch.setattr(cache, "TOOL_SHA1S", {cache.CFR_URL: "0" * 40})
+
+    assert statuses(cache.scrub_cache(cache.url_cache_key(cache.CFR_URL)))[path] == "corrupt"
+
+
+def test_tool_pinned_by_its_published_sha1(cache, tools, server, monkeypatch):  # noqa: F811
+    digest = hashlib.sha1(tools["Tiny Remapper"]).hexdigest()
+    sha1_url = server.add("/tiny-remapper-fat.jar.sha1", f"{digest}  tiny-remapper-fat.jar\n".encode())
+    monkeypatch.setattr(cache, "TOOL_SHA1_URLS", {cache.REMAPPER_URL: sha1_url})
+
+    assert cache.tool_sha1(cache.REMAPPER_URL, fetch=False) is None
+    path = cache.get_remapper()
+    assert cache.tool_sha1(cache.REMAPPER_URL, fetch=False) == digest
+
+    cache.gc_cache(budget=0, grace=0)
+    assert cache.find_cache_entry(sha1_url)["pinned"] and os.path.exists(path)
+    assert statuses(cache.scrub_cache(full=True))[path] == "ok"
+
+
+def test_tool_rejected_by_its_published_sha1(cache, tools, server, monkeypatch):  # noqa: F811
+    sha1_url = server.add("/tiny-remapper-fat.jar.sha1", b"0" * 40)
+    monkeypatch.setattr(cache, "TOOL_SHA1_URLS", {cache.REMAPPER_URL: sha1_url})
+
+    with pytest.raises(cache.DownloadError):
+        cache.get_remapper()
+    assert cache.find_cache_entry(cache.REMAPPER_URL) is None
+
+
+def test_tool_checksum_file_must_hold_a_sha1(cache, tools, server, monkeypatch):  # noqa: F811
+    sha1_url = server.add("/tiny-remapper-fat.jar.sha1", b"<html>Not found</html>")
+    monkeypatch.setattr(cache, "TOOL_SHA1_URLS", {cache.REMAPPER_URL: sha1_url})
+
+    with pytest.raises(ValueError):
+        cache.get_remapper()
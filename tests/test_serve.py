@@ -0,0 +1,85 @@
+"""
+mcjar serve: the cache exposed as an HTTP mirror, with pull-through.
+"""
+import threading
+import urllib.error
+import urllib.request
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+
+@pytest.fixture
+def mirror(cache):
+    def start(pull_through: bool = False):
+        httpd = ThreadingHTTPServer(("127.0.0.1", 0), cache._mirror_handler(cache.CacheUrlIndex(), pull_through))
+        httpd.daemon_threads = True
+        threading.Thread(target=httpd.serve_forever, daemon=True).start()
+        servers.append(httpd)
+        return f"http://127.0.0.1:{httpd.server_port}"
+
+    servers = []
+    yield start
+    for httpd in servers:
+        httpd.shutdown()
+        httpd.server_close()
+
+
+def fetch(url: str, headers: dict = None):
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, headers=headers or {})) as resp:
+            return resp.status, dict(resp.headers), resp.read()
+    except urllib.error.HTTPError as ex:
+        return ex.code, dict(ex.headers), b""
+
+
+def test_serves_ranges_and_validators(cache, piston, server, mirror):
+    cache.get_piston_file("1.0", "client")
+    jar = piston.jars["1.0", "client"]
+    path = piston.version_jsons["1.0"]["downloads"]["client"]["url"].split("/", 3)[3]
+    base = f"{mirror()}/{server.host}/{path}"
+
+    status, headers, body = fetch(base)
+    assert (status, body) == (200, jar)
+    status, _, body = fetch(base, {"Range": "bytes=10-19"})
+    assert (status, body) == (206, jar[10:20])
+    status, _, _ = fetch(base, {"If-None-Match": headers["ETag"]})
+    assert status == 304
+
+
+def test_pull_through_fetches_known_upstream_paths(cache, server, mirror, monkeypatch):
+    server.add("/pd/v1/objects/abc/client.jar", b"pulled jar")
+    monkeypatch.setattr(cache, "MIRRORS", {"https://piston-data.mojang.com/": server.url("/pd/")})
+    base = mirror(pull_through=True)
+
+    status, _, body = fetch(f"{base}/piston-data.mojang.com/v1/objects/abc/client.jar")
+
+    assert (status, body) == (200, b"pulled jar")
+    assert cache.get_cached_file(cache.url_cache_key("https://piston-data.mojang.com/v1/objects/abc/client.jar"))
+
+
+@pytest.mark.parametrize(
+    "path",
+    [
+        "piston-data.mojang.com/v1/objects/abc/..%2F..%2F..%2Fevil",
+        "piston-data.mojang.com/v1/objects/%2E%2E/%2E%2E/evil.jar",
+        "piston-data.mojang.com/v1/objects/abc/.hidden",
+        "piston-data.mojang.com/other/file.jar",
+        "raw.githubusercontent.com/someone/else/main/file.jar",
+    ],
+)
+def test_pull_through_rejects_other_paths(cache, server, mirror, monkeypatch, tmp_path, path):
+    monkeypatch.setattr(
+        cache,
+        "MIRRORS",
+        {
+            "https://piston-data.mojang.com/": server.url("/pd/"),
+            "https://raw.githubusercontent.com/": server.url("/raw/"),
+        },
+    )
+
+    status, _, _ = fetch(f"{mirror(pull_through=True)}/{path}")
+
+    assert status == 404
+    assert server.requests == []
+    assert not (tmp_path / "evil").exists()
@@ -0,0 +1,83 @@
+"""
+Startup-time guard for mcjar: `mcjar --help` and `import mcjar` must not
+touch the network, the cache or heavy modules. Run this file directly to
+print the timings as a benchmark.
+"""
+import os
+import subprocess
+import sys
+import time
+from os.path import abspath, dirname, join
+
+SCRIPTS = join(dirname(dirname(abspath(__file__))), "scripts")
+
+# Seconds mcjar may add on top of a bare interpreter
+STARTUP_BUDGET = float(os.environ.get("MCJAR_STARTUP_BUDGET", 0.25))
+
+# Modules only needed once something is downloaded or cached
+HEAVY_MODULES = ["urllib3", "urllib.request", "http.client", "email", "sqlite3", "asyncio"]
+
+
+def _env(home: str) -> dict:
+    env = dict(os.environ, GRYLA_HOME=home, PYTHONPATH=SCRIPTS)
+    # Bytecode is cached after the first run, as it is for installed copies
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    return env
+
+
+def _best_of(cmd, env: dict, runs: int = 5) -> float:
+    best = float("inf")
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(cmd, env=env, stdout=subprocess.DEVNULL, check=True)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def _warm_home(home: str):
+    """ A cache with an index and a few entries in it """
+    script = (
+        "import mcjar\n"
+        "for i in range(50):\n"
+        "    key = mcjar.derived_cache_key(f'STARTUP {i}')\n"
+        "    with mcjar.new_cache_file(key, 'entry.txt', 'startup') as tmp:\n"
+        "        open(tmp, 'w').write(str(i))\n"
+    )
+    subprocess.run([sys.executable, "-c", script], env=_env(home), check=True)
+
+
+def measure(home: str) -> dict:
+    env = _env(home)
+    bare = _best_of([sys.executable, "-c", "pass"], env)
+    return {
+        "bare": bare,
+        "help": _best_of([sys.executable, join(SCRIPTS, "mcjar.py"), "--help"], env) - bare,
+        "import": _best_of([sys.executable, "-c", "import mcjar"], env) - bare,
+    }
+
+
+def test_import_is_side_effect_free(tmp_path):
+    home = str(tmp_path / "home")
+    script = f"import sys, mcjar; print(' '.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    loaded = subprocess.run(
+        [sys.executable, "-c", script], env=_env(home), capture_output=True, text=True, check=True
+    ).stdout.split()
+    assert loaded == []
+    assert not os.path.exists(home)
+
+
+def test_help_and_warm_import_are_fast(tmp_path):
+    home = str(tmp_path / "home")
+    _warm_home(home)
+    timings = measure(home)
+    assert timings["help"] < STARTUP_BUDGET, timings
+    assert timings["import"] < STARTUP_BUDGET, timings
+
+
+if __name__ == "__main__":
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as tmp:
+        _warm_home(tmp)
+        for name, seconds in measure(tmp).items():
+            print(f"{name:>6}: {seconds * 1000:.1f} ms")
@@ -0,0 +1,79 @@
+"""
+The version catalog: lookups and range queries over the indexed manifest,
+and `mcjar versions` errors.
+"""
+import socket
+import subprocess
+import sys
+
+from test_startup import SCRIPTS, _env
+
+
+def ids(versions) -> list:
+    return [version.id for version in versions]
+
+
+def test_query_versions_oldest_first(cache, piston):
+    assert ids(cache.query_versions()) == ["1.0", "1.1", "1.2-pre1", "1.2"]
+    assert ids(cache.query_versions(version_type="release")) == ["1.0", "1.1", "1.2"]
+    assert ids(cache.query_versions(since="1.1", until="1.2-pre1")) == ["1.1", "1.2-pre1"]
+    assert ids(cache.query_versions(version_type="release", since="1.1")) == ["1.1", "1.2"]
+
+
+def test_latest_version(cache, piston):
+    assert cache.latest_version().id == "1.2"
+    assert cache.latest_version(version_type="snapshot").id == "1.2-pre1"
+    assert cache.latest_version(version_type="old_beta") is None
+
+
+def test_catalog_version(cache, piston):
+    assert cache.catalog_version("piston", "1.1")["url"] == piston.manifest["versions"][2]["url"]
+    assert cache.catalog_version("piston", "7.7") is None
+    with cache.open_cached(cache.get_piston_json_path("1.1")) as f:
+        assert cache.json.load(f) == piston.version_jsons["1.1"]
+
+
+def test_catalog_is_loaded_once_per_revision(cache, piston, monkeypatch):
+    get_manifest, parse = cache.CATALOG_SOURCES["piston"]
+    loads = []
+    monkeypatch.setitem(
+        cache.CATALOG_SOURCES, "piston", (get_manifest, lambda path: loads.append(path) or parse(path))
+    )
+
+    cache.query_versions()
+    cache.catalog_version("piston", "1.0")
+    cache.latest_version()
+
+    assert len(loads) == 1
+
+
+def test_unknown_range_bound(cache, piston, capsys):
+    args = cache.argparse.Namespace(source="piston", type=None, since="7.7", until=None, latest=False, quiet=True)
+
+    assert cache.versions_command(args) == 1
+    assert "Error: Unable to find version: 7.7" in capsys.readouterr().err
+
+
+def test_versions_offline_without_a_manifest(tmp_path):
+    cmd = [sys.executable, "-m", "mcjar", "versions", "--offline"]
+    result = subprocess.run(cmd, env=_env(str(tmp_path)), capture_output=True, text=True)
+
+    assert result.returncode == 1
+    assert result.stderr.startswith("Error: ") and "Traceback" not in result.stderr
+
+
+def test_unexpected_errors_exit_with_a_message(tmp_path):
+    with socket.socket() as busy:
+        busy.bind(("127.0.0.1", 0))
+        busy.listen()
+        port = busy.getsockname()[1]
+        result = subprocess.run(
+            [sys.executable, "-m", "mcjar", "serve", "--host", "127.0.0.1", "--port", str(port), "-q"],
+            env=_env(str(tmp_path)),
+            capture_output=True,
+            text=True,
+            cwd=SCRIPTS,
+        )
+
+    assert result.returncode == 1
+    assert result.stderr.startswith("Error: ") and "Traceback" not in result.stderr